@@ -0,0 +1,82 @@
+"""Temps de construction et pic de mémoire (RSS) de la base DuckDB.
+
+Compare le chemin historique (collect Polars + parquet intermédiaire) et le
+chemin en flux (SQL DuckDB sur read_parquet). Chaque construction tourne dans
+un processus dédié pour que le pic de RSS mesuré ne concerne qu'elle.
+
+    python -m benchmarks.bench_build --rows 2000000
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.synthetic import write_synthetic_parquet
+
+ENGINES = ["polars", "duckdb"]
+
+
+def run_child(engine: str, parquet_path: Path, db_path: Path) -> None:
+    from src.build import build_database
+
+    start = time.perf_counter()
+    build_database(db_path, parquet_path, engine=engine)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss est en kilo-octets sous Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"seconds": elapsed, "peak_rss_mb": peak_rss_mb}))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--workdir", type=Path, default=None)
+    parser.add_argument("--child", choices=ENGINES, help=argparse.SUPPRESS)
+    parser.add_argument("--parquet", type=Path, help=argparse.SUPPRESS)
+    parser.add_argument("--db", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.parquet, args.db)
+        return
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="decp-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    parquet_path = write_synthetic_parquet(
+        workdir / f"decp_{args.rows}.parquet", args.rows
+    )
+    print(f"Parquet : {parquet_path} ({parquet_path.stat().st_size / 1e6:.0f} Mo)")
+
+    for engine in ENGINES:
+        db_path = workdir / f"decp_{engine}.duckdb"
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.bench_build",
+                "--child",
+                engine,
+                "--parquet",
+                str(parquet_path),
+                "--db",
+                str(db_path),
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{engine:>7} : {result['seconds']:6.1f} s, "
+            f"pic RSS {result['peak_rss_mb']:7.0f} Mo"
+        )
+        db_path.unlink()
+
+
+if __name__ == "__main__":
+    main()
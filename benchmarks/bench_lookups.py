@@ -0,0 +1,87 @@
+"""Latence des recherches ponctuelles (p50/p99) sur la table decp.
+
+Compare l'ancienne organisation (lignes triées par date, sans index) et
+l'actuelle (lignes regroupées par acheteur, index ART sur uid, acheteur_id et
+titulaire_id), avec les requêtes des pages marché, acheteur et titulaire.
+
+    python -m benchmarks.bench_lookups --rows 2000000
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import duckdb
+
+from benchmarks.synthetic import write_synthetic_parquet
+from src.build import DEFAULT_ORDER_BY, build_database
+
+LOOKUPS = {
+    "marché (uid)": "uid",
+    "acheteur (acheteur_id)": "acheteur_id",
+    "titulaire (titulaire_id)": "titulaire_id",
+}
+
+
+def make_previous_layout(db_path: Path, previous_path: Path) -> None:
+    """Copie decp dans l'ordre de l'ancienne construction, sans index."""
+    previous_path.unlink(missing_ok=True)
+    with duckdb.connect(str(previous_path)) as w:
+        w.execute(f"ATTACH '{db_path.resolve()}' AS actuelle (READ_ONLY)")
+        w.execute(
+            "CREATE TABLE decp AS "
+            f"SELECT * FROM actuelle.decp ORDER BY {DEFAULT_ORDER_BY}"
+        )
+
+
+def measure(db_path: Path, samples: int) -> dict[str, tuple[float, float]]:
+    results = {}
+    with duckdb.connect(str(db_path), read_only=True) as con:
+        for label, column in LOOKUPS.items():
+            values = [
+                r[0]
+                for r in con.execute(
+                    f"SELECT {column} FROM decp USING SAMPLE {int(samples)} ROWS"
+                ).fetchall()
+            ]
+            timings = []
+            for value in values:
+                start = time.perf_counter()
+                con.cursor().execute(
+                    f"SELECT * FROM decp WHERE {column} = ?", [value]
+                ).pl()
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            results[label] = (
+                timings[len(timings) // 2],
+                timings[int(len(timings) * 0.99)],
+            )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--samples", type=int, default=300)
+    parser.add_argument("--workdir", type=Path, default=None)
+    args = parser.parse_args()
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="decp-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    parquet_path = write_synthetic_parquet(
+        workdir / f"decp_{args.rows}.parquet", args.rows
+    )
+    db_path = workdir / "decp.duckdb"
+    build_database(db_path, parquet_path)
+    previous_path = workdir / "decp_sans_index.duckdb"
+    make_previous_layout(db_path, previous_path)
+
+    for name, path in [("avant", previous_path), ("après", db_path)]:
+        print(f"{name} :")
+        for label, (p50, p99) in measure(path, args.samples).items():
+            print(f"  {label:<25} p50 {p50:6.1f} ms   p99 {p99:6.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Durée et mémoire des cartes de l'observatoire calculées à partir des lignes
+ou dans DuckDB.
+
+Compare l'ancien calcul (prepare_dashboard_data : SELECT * des marchés
+filtrés, puis chaque carte agrégée par Polars dans le worker) et
+src.utils.dashboard (une lecture des colonnes utiles pour les cartes Résumé,
+distances, top acheteurs et titulaires, une autre pour les cartes
+géographiques, qui ne renvoient que les lignes agrégées). Les donuts et
+les sources, déjà lus dans les cubes, ne sont pas mesurés.
+
+Chaque calcul tourne dans un processus neuf : le pic de mémoire (RSS) est
+mesuré au-delà de celle du processus après import de l'application.
+
+    DATA_SCHEMA_PATH=schema.json python -m benchmarks.bench_observatoire --rows 2000000
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from benchmarks.synthetic import write_synthetic_parquet
+from src.build import DEFAULT_ORDER_BY, build_database
+
+FILTERS = {
+    "12 derniers mois": {},
+    "année 2024": {"dashboard_year": 2024},
+    "un département, 2024": {
+        "dashboard_year": 2024,
+        "dashboard_acheteur_departement_code": ["35"],
+    },
+}
+# Comme src.figures.MAP_REGIONS
+REGION_CODES = ["Hexagone", "971", "972", "973", "974", "976"]
+
+
+def cards_from_rows(filter_params: dict) -> int:
+    """Ancien calcul ; retourne la taille des lignes matérialisées."""
+    from src.db import query_marches
+    from src.utils.table_sql import dashboard_filters_to_sql
+
+    where_sql, params = dashboard_filters_to_sql(**filter_params)
+    dff = query_marches(where_sql=where_sql, params=params, order_by=DEFAULT_ORDER_BY)
+    lff = dff.lazy()
+
+    dff.select("acheteur_id").n_unique()
+    dff.select("titulaire_id", "titulaire_typeIdentifiant").n_unique()
+    dff.select(pl.median("titulaire_distance")).item()
+
+    distances = (
+        lff.select("titulaire_distance")
+        .filter(pl.col("titulaire_distance") > 0)
+        .collect()["titulaire_distance"]
+    )
+    if distances.len():
+        np.histogram(distances.log(10).to_numpy(), bins=25)
+
+    for org_type in ["acheteur", "titulaire"]:
+        keys = [f"{org_type}_id", f"{org_type}_nom"]
+        if org_type == "titulaire":
+            keys.append("titulaire_typeIdentifiant")
+        lff.group_by(keys).agg(pl.len().alias("Attributions")).collect()
+
+    for code in REGION_CODES:
+        if code == "Hexagone":
+            region = lff.filter(
+                (pl.col("acheteur_departement_code").str.len_chars() == 2)
+                & (pl.col("titulaire_departement_code").str.len_chars() == 2)
+            )
+        else:
+            region = lff.filter(
+                (pl.col("acheteur_departement_code") == code)
+                | (pl.col("titulaire_departement_code") == code)
+            )
+        nb_marches = region.select("uid").collect()["uid"].n_unique()
+        if nb_marches > (30000 if code == "Hexagone" else 10000):
+            region.select("uid", "acheteur_departement_code").drop_nulls().group_by(
+                "uid"
+            ).agg(pl.col("acheteur_departement_code").first()).group_by(
+                "acheteur_departement_code"
+            ).len("uid").collect()
+        elif nb_marches:
+            for org_type in ["acheteur", "titulaire"]:
+                region.group_by(
+                    f"{org_type}_longitude", f"{org_type}_latitude", f"{org_type}_nom"
+                ).len("nb_marches").collect()
+
+    return dff.estimated_size()
+
+
+def cards_in_duckdb(filter_params: dict) -> int:
+    """Calcul de src.utils.dashboard ; retourne la taille des agrégats reçus."""
+    from src.utils.dashboard import get_dashboard_stats, get_maps_data
+
+    stats = get_dashboard_stats(filter_params)
+    size = sum(
+        stats[f"top_{org_type}s"].estimated_size()
+        for org_type in ["acheteur", "titulaire"]
+    )
+    for dfs, _map_type in get_maps_data(filter_params, REGION_CODES).values():
+        size += sum(dff.estimated_size() for dff in dfs)
+    return size
+
+
+def memory_kb(field: str) -> int:
+    """Ligne `field` (VmRSS, VmHWM) de /proc/self/status, en Ko (Linux)."""
+    for line in Path("/proc/self/status").read_text().splitlines():
+        if line.startswith(f"{field}:"):
+            return int(line.split()[1])
+    raise KeyError(field)
+
+
+def measure(approach: str, filter_params: dict, repeat: int) -> tuple:
+    """Dans un processus neuf : médiane (ms), pic de RSS (Mo), taille reçue (Ko)."""
+    import src.utils.dashboard  # noqa: F401
+
+    compute = {"lignes": cards_from_rows, "duckdb": cards_in_duckdb}[approach]
+    # Remet le pic (VmHWM) à la mémoire actuelle : l'import n'est pas compté
+    Path("/proc/self/clear_refs").write_text("5")
+    rss_before = memory_kb("VmRSS")
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = compute(filter_params)
+        timings.append(time.perf_counter() - start)
+    return (
+        sorted(timings)[len(timings) // 2] * 1000,
+        (memory_kb("VmHWM") - rss_before) / 1024,
+        size / 1024,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workdir", type=Path, default=None)
+    args = parser.parse_args()
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="decp-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    parquet_path = write_synthetic_parquet(
+        workdir / f"decp_{args.rows}.parquet", args.rows
+    )
+    db_path = workdir / "decp.duckdb"
+    build_database(db_path, parquet_path)
+    # Hérités par les processus de mesure, qui ouvrent la base à l'import de src.db
+    os.environ["DUCKDB_PATH"] = str(db_path)
+    os.environ["DATA_FILE_PARQUET_PATH"] = str(parquet_path)
+
+    context = multiprocessing.get_context("spawn")
+    for label, filter_params in FILTERS.items():
+        print(f"{label} :")
+        for approach in ["lignes", "duckdb"]:
+            with context.Pool(1) as pool:
+                duration, rss, size = pool.apply(
+                    measure, (approach, filter_params, args.repeat)
+                )
+            print(
+                f"  {approach:>6} : {duration:8.1f} ms   pic RSS +{rss:7.1f} Mo   "
+                f"reçu {size:10.1f} Ko"
+            )
+
+
+if __name__ == "__main__":
+    main()
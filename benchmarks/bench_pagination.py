@@ -0,0 +1,122 @@
+"""Latence d'une page du tableau (/tableau) avec ses deux totaux.
+
+Compare l'ancien chemin (count_marches, count_unique_marches puis la page
+avec ORDER BY/OFFSET : trois parcours de decp) et src.db.page_sql (un seul
+parcours), par OFFSET et par clé (reprise après la dernière ligne de la page
+précédente), sur les filtres des exemples de l'aide du tableau traduits en SQL.
+
+    python -m benchmarks.bench_pagination --rows 2000000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+import duckdb
+
+from benchmarks.synthetic import write_synthetic_parquet
+from src.build import DEFAULT_ORDER_BY, DEFAULT_SORT_KEYS, build_database
+
+# Filtres produits par filter_query_to_sql pour les exemples de l'aide
+FILTERS = {
+    "aucun filtre": ("TRUE", []),
+    "objet contient voirie": ('"objet" ILIKE ?', ["%voirie%"]),
+    "voirie < 40 k€ en 2025 chez un acheteur": (
+        '"acheteur_id" ILIKE ? AND CAST("dateNotification" AS VARCHAR) ILIKE ? '
+        'AND "montant" < ? AND "objet" ILIKE ?',
+        ["2100000000%", "2025%", 40000, "%voirie%"],
+    ),
+    "PME à plus de 100 km, > 500 k€, Var, clause sociale": (
+        '"titulaire_categorie" ILIKE ? AND "titulaire_distance" > ? '
+        'AND "montant" > ? AND "acheteur_departement_code" ILIKE ? '
+        'AND "considerationsSociales" ILIKE ?',
+        ["%PME%", 100, 500000, "%83%", "%clause%"],
+    ),
+}
+PAGE_SIZE = 20
+
+
+def three_queries(con, where_sql, params, offset):
+    con.execute(f"SELECT count(*) FROM decp WHERE {where_sql}", params).fetchone()
+    con.execute(
+        f"SELECT count(DISTINCT uid) FROM decp WHERE {where_sql}", params
+    ).fetchone()
+    con.execute(
+        f"SELECT * FROM decp WHERE {where_sql} ORDER BY {DEFAULT_ORDER_BY} "
+        f"LIMIT {PAGE_SIZE} OFFSET {offset}",
+        params,
+    ).pl()
+
+
+def single_query(con, where_sql, params, offset, after=None):
+    from src.db import page_keys, page_sql
+
+    sql, all_params = page_sql(
+        where_sql, params, DEFAULT_SORT_KEYS, PAGE_SIZE, offset, after
+    )
+    page = con.execute(sql, all_params).pl()
+    if page.height == 0 or page["__in_page"][-1] is None:
+        return None
+    return tuple(page.row(-1, named=True)[c] for c, _ in page_keys(DEFAULT_SORT_KEYS))
+
+
+def keyset_query(con, where_sql, params, offset):
+    """Page suivant la page précédente, dont la dernière ligne est connue."""
+    after = single_query(con, where_sql, params, offset - PAGE_SIZE)
+    start = time.perf_counter()
+    single_query(con, where_sql, params, 0, after)
+    return time.perf_counter() - start
+
+
+def timed(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def median_ms(run, repeat: int) -> float:
+    """Médiane en ms de `repeat` appels à run(), qui retourne une durée en s."""
+    timings = sorted(run() for _ in range(repeat))
+    return timings[len(timings) // 2] * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--workdir", type=Path, default=None)
+    args = parser.parse_args()
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="decp-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    parquet_path = write_synthetic_parquet(
+        workdir / f"decp_{args.rows}.parquet", args.rows
+    )
+    db_path = workdir / "decp.duckdb"
+    build_database(db_path, parquet_path)
+    # src.db (importé par single_query) ouvre la base au chargement
+    os.environ["DUCKDB_PATH"] = str(db_path)
+
+    with duckdb.connect(str(db_path.resolve()), read_only=True) as con:
+        for label, (where_sql, params) in FILTERS.items():
+            print(f"{label} :")
+            for page in (0, 1000):
+                offset = page * PAGE_SIZE
+                query = (con, where_sql, params, offset)
+                before = median_ms(partial(timed, three_queries, *query), args.repeat)
+                single = median_ms(partial(timed, single_query, *query), args.repeat)
+                line = (
+                    f"  page {page:>4} : trois requêtes {before:7.1f} ms   "
+                    f"une requête {single:7.1f} ms"
+                )
+                if page > 0:
+                    keyset = median_ms(partial(keyset_query, *query), args.repeat)
+                    line += f"   par clé {keyset:7.1f} ms"
+                print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Latence (p50/p99) de la recherche et des suggestions d'organisations.
+
+Construit l'index de src.utils.search sur un tableau synthétique de titulaires
+(noms de 2 à 5 mots tirés d'un vocabulaire de taille réaliste, SIRET, communes)
+puis mesure :
+
+- les suggestions pendant la saisie, pour chaque préfixe (2 caractères et plus)
+  de noms et de SIRET tirés au hasard ;
+- la recherche complète de la page d'accueil, sur les mêmes noms ;
+- la recherche approchée (repli quand rien n'est trouvé), sur ces noms dont un
+  mot porte une faute de frappe (lettre supprimée, doublée ou remplacée), avec
+  la part des titulaires visés retrouvés parmi les résultats affichés.
+
+Le script échoue si le p99 de la recherche approchée dépasse --budget-ms.
+
+    python -m benchmarks.bench_search --orgs 1000000
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import polars as pl
+
+from benchmarks.synthetic import DEPARTEMENTS
+
+FORMES = ["SARL", "SAS", "SA", "EURL", "SCI", "ENTREPRISE", "SOCIETE", "ETS"]
+COURANTS = ["DE", "DU", "DES", "LA", "LE", "ET", "SAINT", "FRANCE", "GROUPE"]
+SYLLABES = [
+    "BA", "BE", "BO", "CA", "CHA", "DU", "FA", "GI", "LA", "LO", "MA", "MI",
+    "NE", "PA", "PI", "RA", "RO", "SE", "TA", "TI", "VA", "VE", "ZO", "BER",
+    "TRAN", "MON", "GAR", "NIER", "LET", "ROUX", "QUIN", "CHE",
+]  # fmt: skip
+
+
+def make_org_frame(n_orgs: int, seed: int = 42) -> pl.DataFrame:
+    """Titulaires synthétiques, au format de src.utils.data.get_org_frame."""
+    rng = np.random.default_rng(seed)
+
+    # Vocabulaire de noms propres : 2 à 3 syllabes
+    n_noms = max(1000, n_orgs // 10)
+    syllabes = np.array(SYLLABES)
+    noms = syllabes[rng.integers(0, len(syllabes), (n_noms, 3))]
+    noms[rng.random(n_noms) < 0.5, 2] = ""
+    noms = pl.Series(["".join(n) for n in noms]).unique()
+
+    mots = pl.Series(FORMES + COURANTS).append(noms)
+    # Les premiers mots (formes juridiques, mots courants) sont les plus tirés
+    poids = 1 / np.arange(1, len(mots) + 1) ** 0.8
+    tirage = rng.choice(len(mots), (n_orgs, 5), p=poids / poids.sum())
+    longueurs = rng.integers(2, 6, n_orgs)
+    mots_noms = [
+        " ".join(mots.gather(t[:k])) for t, k in zip(tirage, longueurs, strict=True)
+    ]
+
+    departements = pl.Series(DEPARTEMENTS).gather(
+        rng.integers(0, len(DEPARTEMENTS), n_orgs)
+    )
+    return pl.DataFrame(
+        {
+            "titulaire_id": [f"{s:014d}" for s in rng.choice(10**14, n_orgs)],
+            "titulaire_nom": mots_noms,
+            "titulaire_typeIdentifiant": "SIRET",
+            "titulaire_departement_code": departements,
+            "titulaire_departement_nom": "Département " + departements,
+            "titulaire_commune_nom": noms.gather(rng.integers(0, len(noms), n_orgs)),
+            # Quelques titulaires très fréquents, beaucoup d'occasionnels
+            "Marchés": rng.zipf(1.8, n_orgs).clip(1, 100_000),
+        }
+    )
+
+
+def with_typo(name: str, rng: np.random.Generator) -> str:
+    """`name` avec une faute de frappe dans son mot le plus long."""
+    words = name.split()
+    i = max(range(len(words)), key=lambda j: len(words[j]))
+    word = words[i]
+    pos = int(rng.integers(1, len(word)))
+    kind = rng.integers(0, 3)
+    if kind == 0:
+        word = word[:pos] + word[pos + 1 :]
+    elif kind == 1:
+        word = word[:pos] + word[pos] * 2 + word[pos + 1 :]
+    else:
+        word = word[:pos] + "XQ"[word[pos] == "X"] + word[pos + 1 :]
+    words[i] = word
+    return " ".join(words)
+
+
+def percentiles(timings: list[float]) -> tuple[float, float]:
+    timings = sorted(timings)
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.99)]
+
+
+def summary(timings: list[float]) -> str:
+    p50, p99 = percentiles(timings)
+    return f"p50 {p50:6.2f} ms   p99 {p99:6.2f} ms   ({len(timings)} requêtes)"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orgs", type=int, default=1_000_000)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--budget-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    from src.utils.search import (
+        SEARCH_MAX_RESULTS,
+        SUGGEST_MAX_RESULTS,
+        build_search_index,
+        query_tokens,
+    )
+
+    dff = make_org_frame(args.orgs)
+    start = time.perf_counter()
+    index = build_search_index(dff, "titulaire")
+    print(
+        f"index : {index.orgs.height} titulaires, {index.words.len()} mots, "
+        f"construit en {time.perf_counter() - start:.1f} s"
+    )
+
+    sample = dff.sample(args.samples, seed=1)
+    saisies = [
+        text[:i]
+        for text in sample["titulaire_nom"].to_list() + sample["titulaire_id"].to_list()
+        for i in range(2, len(text) + 1)
+    ]
+
+    timings = []
+    for saisie in saisies:
+        start = time.perf_counter()
+        index.suggest(query_tokens(saisie), SUGGEST_MAX_RESULTS)
+        timings.append((time.perf_counter() - start) * 1000)
+    print(f"suggestions :  {summary(timings)}")
+
+    timings = []
+    for nom in sample["titulaire_nom"].to_list():
+        start = time.perf_counter()
+        index.search(query_tokens(nom), SEARCH_MAX_RESULTS)
+        timings.append((time.perf_counter() - start) * 1000)
+    print(f"recherche :    {summary(timings)}")
+
+    rng = np.random.default_rng(2)
+    timings, found = [], 0
+    for row in sample.iter_rows(named=True):
+        tokens = query_tokens(with_typo(row["titulaire_nom"], rng))
+        start = time.perf_counter()
+        # Comme src.utils.search.search_org : repli si rien n'est trouvé
+        results, count = index.search(tokens, SEARCH_MAX_RESULTS)
+        if count == 0:
+            results, count = index.fuzzy_search(tokens, SEARCH_MAX_RESULTS)
+        timings.append((time.perf_counter() - start) * 1000)
+        found += results["titulaire_id"].str.contains(row["titulaire_id"]).any()
+    print(f"approchée :    {summary(timings)}   retrouvés {found / len(timings):.0%}")
+    p99 = percentiles(timings)[1]
+
+    if p99 > args.budget_ms:
+        sys.exit(f"p99 de la recherche approchée au-delà de {args.budget_ms} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Génération d'un parquet DECP synthétique pour les benchmarks.
+
+Le fichier imite la forme du parquet de production (une ligne par couple
+marché × titulaire, colonnes utilisées par l'application) sans en reproduire
+les valeurs.
+"""
+
+import argparse
+import datetime
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+DEPARTEMENTS = [f"{i:02d}" for i in range(1, 96) if i != 20] + [
+    "2A",
+    "2B",
+    "971",
+    "972",
+    "973",
+    "974",
+    "976",
+]
+CATEGORIES_ACHETEUR = ["Commune", "Département", "Région", "État", "Hôpital", None]
+CATEGORIES_TITULAIRE = ["PME", "ETI", "GE", "Micro", None]
+TYPES = ["Marché", "Concession", "Accord-cadre"]
+SOURCES = ["atexo_1", "atexo_2", "aws_1", "marches-publics.info", "megalis", "pes"]
+TECHNIQUES = ["", "Accord-cadre", "Système d'acquisition dynamique", "Catalogue"]
+CLAUSES = ["", "Clause sociale", "Critère social", "Clause sociale, Critère social"]
+MOTS = ["travaux", "voirie", "fourniture", "services", "nettoyage", "études"]
+
+
+def make_frame(n_rows: int, seed: int = 42) -> pl.DataFrame:
+    rng = np.random.default_rng(seed)
+
+    n_marches = max(1, int(n_rows / 1.5))
+    n_acheteurs = max(1, n_marches // 30)
+    n_titulaires = max(1, n_marches // 5)
+
+    # 1 à 3 titulaires par marché, tronqué au nombre de lignes demandé
+    nb_titulaires = rng.choice([1, 1, 2, 3], size=n_marches)
+    marche_idx = np.repeat(np.arange(n_marches), nb_titulaires)[:n_rows]
+    n = len(marche_idx)
+
+    def par_marche(values: list) -> pl.Series:
+        """Une valeur tirée par marché, répétée sur chacune de ses lignes."""
+        choice = rng.integers(0, len(values), n_marches)[marche_idx]
+        return pl.Series(values, dtype=pl.String).gather(choice)
+
+    def par_ligne(values: list) -> pl.Series:
+        return pl.Series(values, dtype=pl.String).gather(
+            rng.integers(0, len(values), n)
+        )
+
+    def par_org(values: list, nb_orgs: int, org_idx: np.ndarray) -> pl.Series:
+        return pl.Series(values, dtype=pl.String).gather(
+            rng.integers(0, len(values), nb_orgs)[org_idx]
+        )
+
+    acheteur_idx = rng.integers(0, n_acheteurs, n_marches)[marche_idx]
+    titulaire_idx = rng.integers(0, n_titulaires, n)
+
+    epoch = datetime.date(1970, 1, 1).toordinal()
+    start = datetime.date(2018, 1, 1).toordinal() - epoch
+    end = datetime.date.today().toordinal() - epoch
+    jours = rng.integers(start, end, n_marches)[marche_idx]
+
+    frame = pl.DataFrame(
+        {
+            "marche": marche_idx,
+            "acheteur": acheteur_idx,
+            "titulaire": titulaire_idx,
+            "acheteur_categorie": par_marche(CATEGORIES_ACHETEUR),
+            "acheteur_departement_code": par_org(
+                DEPARTEMENTS, n_acheteurs, acheteur_idx
+            ),
+            "titulaire_categorie": par_ligne(CATEGORIES_TITULAIRE),
+            "titulaire_departement_code": par_org(
+                DEPARTEMENTS, n_titulaires, titulaire_idx
+            ),
+            "titulaire_distance": np.round(rng.lognormal(3, 1.2, n), 1),
+            "mot_1": par_ligne(MOTS),
+            "mot_2": par_marche(MOTS),
+            "montant": np.round(rng.lognormal(10, 2, n_marches), 2)[marche_idx],
+            "dateNotification": pl.Series(jours, dtype=pl.Int32).cast(pl.Date),
+            "datePublicationDonnees": pl.Series(jours + 10, dtype=pl.Int32).cast(
+                pl.Date
+            ),
+            "codeCPV": rng.integers(3_000_000, 99_999_999, n_marches)[marche_idx],
+            "dureeMois": rng.integers(1, 60, n_marches)[marche_idx],
+            "dureeRestanteMois": rng.integers(0, 60, n_marches)[marche_idx],
+            "type": par_marche(TYPES),
+            "techniques": par_marche(TECHNIQUES),
+            "considerationsSociales": par_marche(CLAUSES),
+            "considerationsEnvironnementales": par_marche(CLAUSES),
+            "marcheInnovant": rng.random(n_marches)[marche_idx] < 0.05,
+            "sousTraitanceDeclaree": rng.random(n_marches)[marche_idx] < 0.1,
+            "sourceDataset": par_marche(SOURCES),
+            "donneesActuelles": rng.random(n_marches)[marche_idx] < 0.97,
+        }
+    )
+
+    acheteur = pl.col("acheteur").cast(pl.String)
+    titulaire = pl.col("titulaire").cast(pl.String)
+    return frame.select(
+        ("M" + pl.col("marche").cast(pl.String)).alias("uid"),
+        ("M" + pl.col("marche").cast(pl.String)).alias("id"),
+        ("2100" + acheteur.str.zfill(10)).alias("acheteur_id"),
+        ("ACHETEUR " + acheteur).alias("acheteur_nom"),
+        "acheteur_categorie",
+        "acheteur_departement_code",
+        ("Département " + pl.col("acheteur_departement_code")).alias(
+            "acheteur_departement_nom"
+        ),
+        ("COMMUNE " + acheteur).alias("acheteur_commune_nom"),
+        (43 + (pl.col("acheteur") % 700) / 100).alias("acheteur_latitude"),
+        (-1 + (pl.col("acheteur") % 800) / 100).alias("acheteur_longitude"),
+        ("3800" + titulaire.str.zfill(10)).alias("titulaire_id"),
+        ("TITULAIRE " + titulaire).alias("titulaire_nom"),
+        pl.lit("SIRET").alias("titulaire_typeIdentifiant"),
+        "titulaire_categorie",
+        "titulaire_departement_code",
+        ("Département " + pl.col("titulaire_departement_code")).alias(
+            "titulaire_departement_nom"
+        ),
+        ("COMMUNE T" + titulaire).alias("titulaire_commune_nom"),
+        (43 + (pl.col("titulaire") % 700) / 100).alias("titulaire_latitude"),
+        (-1 + (pl.col("titulaire") % 800) / 100).alias("titulaire_longitude"),
+        "titulaire_distance",
+        (pl.col("mot_1") + " " + pl.col("mot_2")).alias("objet"),
+        "montant",
+        "dateNotification",
+        "datePublicationDonnees",
+        pl.col("codeCPV").cast(pl.String).str.zfill(8),
+        "dureeMois",
+        "dureeRestanteMois",
+        pl.col("acheteur_departement_code").alias("lieuExecution_code"),
+        "type",
+        "techniques",
+        "considerationsSociales",
+        "considerationsEnvironnementales",
+        "marcheInnovant",
+        "sousTraitanceDeclaree",
+        "sourceDataset",
+        pl.lit("https://example.com/decp.xml").alias("sourceFile"),
+        "donneesActuelles",
+    )
+
+
+def write_synthetic_parquet(path: Path, n_rows: int, seed: int = 42) -> Path:
+    """Écrit le parquet s'il n'existe pas déjà (réutilisé d'une exécution à l'autre)."""
+    path = Path(path)
+    if not path.exists():
+        make_frame(n_rows, seed).write_parquet(path)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    args = parser.parse_args()
+    write_synthetic_parquet(args.path, args.rows)
@@ -6,10 +6,12 @@ import pandas  # noqa: F401  # eager import: avoid plotly's lazy-import race acr
 import tomllib
 from dash import Dash, Input, Output, State, dcc, html, page_container, page_registry
 from dotenv import load_dotenv
-from flask import Response
+from flask import Response, abort, jsonify, request
 
 from src.utils import DEVELOPMENT
 from src.utils.cache import cache
+from src.utils.export import export_response
+from src.utils.search import suggest_org
 
 load_dotenv()
 
@@ -47,7 +49,8 @@ cache.init_app(
         "CACHE_DEFAULT_TIMEOUT": int(
             os.getenv("CACHE_DEFAULT_TIMEOUT", 3600 * 24)
         ),  # 24h par défaut
-        "CACHE_THRESHOLD": 300,
+        # Nombre de fichiers au-delà duquel le cache est élagué
+        "CACHE_THRESHOLD": int(os.getenv("CACHE_THRESHOLD", 5000)),
     },
 )
 
@@ -80,6 +83,23 @@ def sitemap():
     return Response(xml, mimetype="text/xml")
 
 
+# Fichiers des exports terminés (voir src/utils/export.py)
+@app.server.route("/telechargements/<job_id>/<filename>")
+def telechargement(job_id, filename):
+    return export_response(job_id, filename)
+
+
+# Suggestions pendant la saisie (voir src/utils/search.py et assets/suggestions.js)
+@app.server.route("/suggestions/<org_type>")
+def suggestions(org_type):
+    if org_type not in ("acheteur", "titulaire"):
+        abort(404)
+    response = jsonify(suggest_org(request.args.get("q", ""), org_type))
+    response.cache_control.public = True
+    response.cache_control.max_age = 300
+    return response
+
+
 with open("./pyproject.toml", "rb") as f:
     pyproject = tomllib.load(f)
     version = "v" + pyproject["project"]["version"]
@@ -0,0 +1,72 @@
+// Suggestions d'acheteurs et de titulaires pendant la saisie (route /suggestions,
+// voir src/utils/search.py). Chaque champ est relié à la <datalist> de même id,
+// suffixé par "_suggestions".
+(function () {
+  const SUGGESTED_INPUTS = {
+    search: ["acheteur", "titulaire"],
+    dashboard_acheteur_id: ["acheteur"],
+    dashboard_titulaire_id: ["titulaire"],
+  };
+  const MIN_LENGTH = 2;
+  const DELAY_MS = 120;
+  const timers = {};
+  const controllers = {};
+
+  const fetchSuggestions = async (orgType, query, signal) => {
+    const response = await fetch(
+      `/suggestions/${orgType}?q=${encodeURIComponent(query)}`,
+      { signal }
+    );
+    return response.ok ? response.json() : [];
+  };
+
+  const updateDatalist = async (input) => {
+    const datalist = document.getElementById(`${input.id}_suggestions`);
+    if (!datalist) {
+      return;
+    }
+    controllers[input.id]?.abort();
+    const query = input.value.trim();
+    if (query.length < MIN_LENGTH) {
+      datalist.replaceChildren();
+      return;
+    }
+
+    // Seule la dernière saisie compte : les requêtes précédentes sont annulées
+    const controller = new AbortController();
+    controllers[input.id] = controller;
+    try {
+      const results = await Promise.all(
+        SUGGESTED_INPUTS[input.id].map((orgType) =>
+          fetchSuggestions(orgType, query, controller.signal)
+        )
+      );
+      datalist.replaceChildren(
+        ...results.flat().map(({ value, label }) => {
+          const option = document.createElement("option");
+          option.value = value;
+          option.label = label;
+          return option;
+        })
+      );
+    } catch (error) {
+      if (error.name !== "AbortError") {
+        console.error(error);
+      }
+    }
+  };
+
+  document.addEventListener("input", (event) => {
+    const input = event.target;
+    if (!(input.id in SUGGESTED_INPUTS)) {
+      return;
+    }
+    // Suggestion choisie : inutile d'en chercher d'autres
+    const datalist = document.getElementById(`${input.id}_suggestions`);
+    if (datalist?.querySelector(`option[value="${CSS.escape(input.value)}"]`)) {
+      return;
+    }
+    clearTimeout(timers[input.id]);
+    timers[input.id] = setTimeout(() => updateDatalist(input), DELAY_MS);
+  });
+})();
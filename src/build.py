@@ -0,0 +1,914 @@
+import fcntl
+import os
+import shutil
+import time
+from pathlib import Path
+from time import sleep
+from typing import Literal
+
+import duckdb
+import polars as pl
+import polars.selectors as cs
+from polars.exceptions import ComputeError
+
+from src.utils import logger
+
+NOM_INCONNU = "[Identifiant non reconnu dans la base INSEE]"
+
+# Plafond mémoire de DuckDB pendant la construction : au-delà, les tris et
+# agrégations débordent sur disque au lieu de faire grossir le processus.
+BUILD_MEMORY_LIMIT = os.getenv("DUCKDB_BUILD_MEMORY_LIMIT", "1GB")
+
+# Tri par défaut des marchés (tableau, observatoire). L'ordre physique de decp
+# est différent (voir STORAGE_ORDER_BY) : les requêtes qui affichent des lignes
+# doivent trier explicitement.
+DEFAULT_SORT_KEYS = [("dateNotification", "DESC"), ("uid", "DESC")]
+DEFAULT_ORDER_BY = ", ".join(f'"{c}" {d} NULLS LAST' for c, d in DEFAULT_SORT_KEYS)
+
+# Ordre physique de decp : les lignes d'un même acheteur sont contiguës, donc
+# lues dans un ou deux blocs (page acheteur). Les recherches par uid et par
+# titulaire_id passent par les index ART de INDEXED_COLUMNS.
+STORAGE_ORDER_BY = f'"acheteur_id", {DEFAULT_ORDER_BY}'
+# Les mises à jour incrémentales ajoutent les lignes modifiées en fin de decp,
+# hors de STORAGE_ORDER_BY : au-delà de cette part de lignes réécrites depuis la
+# dernière construction complète, la base est reconstruite (et retriée).
+RECLUSTER_RATIO = float(os.getenv("DUCKDB_RECLUSTER_RATIO", 0.2))
+INDEXED_COLUMNS = ["uid", "acheteur_id", "titulaire_id"]
+
+# ioctl Linux de clonage d'un fichier (reflink), voir copy_database
+FICLONE = 0x40049409
+
+# Tables dérivées de decp (SELECT DISTINCT sur `columns`). `key` est la colonne
+# par laquelle une mise à jour incrémentale supprime puis réinsère les lignes.
+DERIVED_TABLES = {
+    "acheteurs_marches": {
+        "columns": "uid, objet, acheteur_id",
+        "key": "uid",
+        "order_by": "acheteur_id",
+    },
+    "titulaires_marches": {
+        "columns": "uid, objet, titulaire_id",
+        "key": "uid",
+        "order_by": "titulaire_id",
+    },
+    "acheteurs_departement": {
+        "columns": "acheteur_id, acheteur_nom, acheteur_departement_code",
+        "key": "acheteur_id",
+        "order_by": "acheteur_nom",
+    },
+    "titulaires_departement": {
+        "columns": "titulaire_id, titulaire_nom, titulaire_departement_code",
+        "key": "titulaire_id",
+        "order_by": "titulaire_nom",
+    },
+}
+
+# Tables normalisées de decp, dont la clé est uid : une ligne par marché
+# (marches, avec son nombre de titulaires) et une ligne par couple marché ×
+# titulaire distinct (marches_titulaires, avec le nombre de lignes de decp
+# correspondantes). Les colonnes titulaire_* vont dans marches_titulaires, les
+# autres dans marches. Compter des marchés devient un simple COUNT(*).
+MARCHES_TABLES = {
+    "marches": {"order_by": STORAGE_ORDER_BY, "indexed": ["uid"]},
+    "marches_titulaires": {"order_by": '"titulaire_id", "uid"', "indexed": ["uid"]},
+}
+
+# Cubes de l'observatoire : nombre de marchés et montants par mois et par
+# combinaison de dimensions (voir src.utils.cube pour le routage des requêtes).
+# Dans cube_marches, les dimensions sont celles du marché : chaque uid tombe
+# dans une seule cellule et les nombres de marchés s'additionnent exactement.
+# cube_titulaires compte les lignes (couples marché × titulaire).
+CUBE_MARCHE_DIMENSIONS = [
+    "acheteur_departement_code",
+    "acheteur_categorie",
+    "type",
+    "sourceDataset",
+    "marcheInnovant",
+    "sousTraitanceDeclaree",
+    "techniques",
+    "considerationsSociales",
+    "considerationsEnvironnementales",
+]
+CUBE_TABLES = {
+    "cube_marches": {
+        "dimensions": CUBE_MARCHE_DIMENSIONS,
+        "measures": ["nb_marches", "montant"],
+    },
+    "cube_titulaires": {
+        "dimensions": CUBE_MARCHE_DIMENSIONS
+        + ["titulaire_departement_code", "titulaire_categorie"],
+        "measures": ["nb_lignes"],
+    },
+}
+
+# Statistiques des pages acheteur et titulaire, une ligne par organisation et
+# par année de notification (annee NULL : toutes les années). Le titulaire
+# n'est compté que pour ses marchés identifiés par SIRET, comme sur sa page.
+ORG_STATS_TABLES = {
+    "acheteur_stats": {
+        "org_type": "acheteur",
+        "partner": "titulaire",
+        "where": "TRUE",
+    },
+    "titulaire_stats": {
+        "org_type": "titulaire",
+        "partner": "acheteur",
+        "where": "\"titulaire_typeIdentifiant\" = 'SIRET'",
+    },
+}
+# Nombre d'intervalles de l'histogramme des distances (comme np.histogram, voir
+# src.utils.dashboard et src.figures.get_distance_histogram_from_stats)
+DISTANCE_BINS = 25
+# Partenaires gardés par organisation et par année, par nombre d'attributions
+TOP_PARTENAIRES = 100
+ORG_STATS_BATCHES = 8
+
+# Extrait local du fichier SIRENE des établissements (parquet), facultatif : les
+# établissements des acheteurs et titulaires de decp sont copiés dans la table
+# etablissements, lue par src.utils.annuaire à la place de l'API.
+SIRENE_ETABLISSEMENTS_PATH = os.getenv("SIRENE_ETABLISSEMENTS_PATH")
+# Colonnes de etablissements -> (type, noms acceptés dans l'extrait : ceux de
+# l'API recherche-entreprises, puis ceux des fichiers de l'INSEE et d'Etalab)
+ETABLISSEMENTS_COLUMNS = {
+    "siret": ("VARCHAR", ["siret"]),
+    "nom_raison_sociale": (
+        "VARCHAR",
+        ["nom_raison_sociale", "denominationUniteLegale"],
+    ),
+    "adresse": ("VARCHAR", ["adresse", "geo_adresse"]),
+    "code_postal": ("VARCHAR", ["code_postal", "codePostalEtablissement"]),
+    "libelle_commune": ("VARCHAR", ["libelle_commune", "libelleCommuneEtablissement"]),
+    "latitude": ("DOUBLE", ["latitude"]),
+    "longitude": ("DOUBLE", ["longitude"]),
+}
+
+
+def should_rebuild(db_path: Path, parquet_path: Path) -> bool:
+    db_path = Path(db_path)
+    parquet_path = Path(parquet_path)
+    if not db_path.exists():
+        return True
+    dev = os.getenv("DEVELOPMENT", "False").lower() == "true"
+    force = os.getenv("REBUILD_DUCKDB", "False").lower() == "true"
+    if dev and not force:
+        return False
+    return parquet_path.stat().st_mtime > db_path.stat().st_mtime
+
+
+def _load_source_frame(parquet_path: Path) -> pl.DataFrame:
+    """Read the source parquet and apply the row-level transforms.
+
+    Ancien chemin de construction, entièrement matérialisé en mémoire. Conservé
+    comme référence pour `source_select_sql` (tests de parité, benchmarks).
+    """
+    try:
+        lff: pl.LazyFrame = pl.scan_parquet(str(parquet_path))
+    except ComputeError:
+        logger.info("Lecture du parquet échouée, nouvelle tentative dans 10s...")
+        sleep(10)
+        lff = pl.scan_parquet(str(parquet_path))
+
+    lff = lff.sort(by=["dateNotification", "uid"], descending=True, nulls_last=True)
+    lff = lff.filter(pl.col("donneesActuelles")).drop("donneesActuelles")
+
+    # booleans_to_strings: true → "oui", false → "non"
+    lff = lff.with_columns(
+        pl.col(cs.Boolean)
+        .cast(pl.String)
+        .str.replace("true", "oui")
+        .str.replace("false", "non")
+    )
+
+    for col in ["acheteur_nom", "titulaire_nom"]:
+        lff = lff.with_columns(
+            pl.when(pl.col(col).is_null())
+            .then(pl.lit(NOM_INCONNU))
+            .otherwise(pl.col(col))
+            .name.keep()
+        )
+
+    return lff.collect()
+
+
+def source_select_sql(
+    con: duckdb.DuckDBPyConnection, parquet_path: Path, ordered: bool = True
+) -> tuple[str, list]:
+    """Traduit les transformations de `_load_source_frame` en une requête DuckDB.
+
+    La requête lit le parquet en flux (`read_parquet`) : DuckDB filtre, convertit
+    et trie par blocs, en débordant sur disque si nécessaire, sans jamais
+    matérialiser le fichier complet en mémoire.
+
+    Retourne (sql, params) à exécuter tel quel ou à utiliser comme sous-requête.
+    """
+    columns = con.execute(
+        "SELECT column_name, column_type FROM (DESCRIBE SELECT * FROM read_parquet(?))",
+        [str(parquet_path)],
+    ).fetchall()
+
+    select_list = []
+    for name, column_type in columns:
+        quoted = f'"{name}"'
+        if name == "donneesActuelles":
+            continue
+        if column_type == "BOOLEAN":
+            select_list.append(
+                f"CASE WHEN {quoted} THEN 'oui' WHEN NOT {quoted} THEN 'non' END AS {quoted}"
+            )
+        elif name in ("acheteur_nom", "titulaire_nom"):
+            select_list.append(f"COALESCE({quoted}, '{NOM_INCONNU}') AS {quoted}")
+        else:
+            select_list.append(quoted)
+
+    sql = (
+        f'SELECT {", ".join(select_list)} FROM read_parquet(?) WHERE "donneesActuelles"'
+    )
+    if ordered:
+        sql += f" ORDER BY {STORAGE_ORDER_BY}"
+    return sql, [str(parquet_path)]
+
+
+def _index_names() -> dict[str, tuple[str, str]]:
+    """Index attendus dans la base : nom -> (table, colonne)."""
+    indexes = {f"decp_{c}_idx": ("decp", c) for c in INDEXED_COLUMNS}
+    for name, table in MARCHES_TABLES.items():
+        indexes |= {f"{name}_{c}_idx": (name, c) for c in table["indexed"]}
+    return indexes
+
+
+def _create_indexes(w: duckdb.DuckDBPyConnection) -> None:
+    for index, (table, column) in _index_names().items():
+        w.execute(f"CREATE INDEX {index} ON {table} ({column})")
+
+
+def is_titulaire_column(column: str) -> bool:
+    return column.startswith("titulaire_")
+
+
+def marches_select_sql(name: str, columns: list[str], where_sql: str = "TRUE") -> str:
+    """Lignes de la table normalisée `name` pour les marchés de decp filtrés.
+
+    `columns` est la liste des colonnes de decp.
+    """
+    if name == "marches":
+        select = ", ".join(f'"{c}"' for c in columns if not is_titulaire_column(c))
+        # Titulaires distincts : une ligne de decp peut être répétée
+        titulaire = ", ".join(
+            f'"{c}"'
+            for c in ["titulaire_id", "titulaire_typeIdentifiant"]
+            if c in columns
+        )
+        nb_titulaires = (
+            f"count(DISTINCT row({titulaire})) "
+            'FILTER (WHERE "titulaire_id" IS NOT NULL) OVER (PARTITION BY uid)'
+        )
+        # Une ligne par uid, choisie de façon déterministe
+        return (
+            f"SELECT {select}, {nb_titulaires} AS nb_titulaires "
+            f"FROM decp AS d WHERE {where_sql} QUALIFY row_number() OVER "
+            '(PARTITION BY uid ORDER BY "titulaire_id" NULLS LAST, hash(d)) = 1'
+        )
+    select = ", ".join(["uid"] + [f'"{c}"' for c in columns if is_titulaire_column(c)])
+    return (
+        f"SELECT {select}, count(*) AS nb_lignes FROM decp "
+        f"WHERE {where_sql} GROUP BY ALL"
+    )
+
+
+def _create_marches_tables(w: duckdb.DuckDBPyConnection) -> None:
+    columns = list(_decp_schema(w))
+    for name, table in MARCHES_TABLES.items():
+        w.execute(
+            f"CREATE TABLE {name} AS {marches_select_sql(name, columns)} "
+            f"ORDER BY {table['order_by']}"
+        )
+
+
+def _create_derived_tables(w: duckdb.DuckDBPyConnection) -> None:
+    for name, table in DERIVED_TABLES.items():
+        w.execute(
+            f"CREATE TABLE {name} AS SELECT DISTINCT {table['columns']} "
+            f"FROM decp ORDER BY {table['order_by']}"
+        )
+    # Empreinte de chaque marché (somme des hash de ses lignes, insensible à
+    # l'ordre des titulaires) pour détecter les uid modifiés au prochain parquet.
+    w.execute(
+        "CREATE TABLE decp_hashes AS "
+        "SELECT uid, sum(hash(d)) AS row_hash FROM decp AS d GROUP BY uid"
+    )
+    # Lignes écrites par chaque mise à jour incrémentale (voir RECLUSTER_RATIO)
+    w.execute("CREATE TABLE decp_refreshes (refreshed_at TIMESTAMP, nb_lignes BIGINT)")
+
+
+def cube_dimensions(name: str, schema: dict) -> list[str]:
+    """Dimensions du cube présentes dans decp, précédées du mois de notification."""
+    return ["mois"] + [d for d in CUBE_TABLES[name]["dimensions"] if d in schema]
+
+
+def cubes_supported(schema: dict) -> bool:
+    return schema.get("dateNotification") == "DATE" and "montant" in schema
+
+
+def cube_select_sql(name: str, schema: dict, where_sql: str = "TRUE") -> str:
+    """Agrégation de decp (restreinte à where_sql) au format du cube `name`.
+
+    `schema` associe les colonnes de decp à leur type DuckDB. La même requête
+    sert à la construction, aux mises à jour incrémentales et au routeur pour
+    les lignes que le cube ne couvre pas.
+    """
+    dimensions = cube_dimensions(name, schema)[1:]
+    mois = "date_trunc('month', \"dateNotification\")::DATE"
+    if name == "cube_marches":
+        # Une ligne par marché, puis agrégation par cellule
+        per_uid = ", ".join(f'min("{d}") AS "{d}"' for d in dimensions)
+        select_dims = ", ".join(["mois"] + [f'"{d}"' for d in dimensions])
+        return (
+            f"SELECT {select_dims}, count(*) AS nb_marches, "
+            "sum(montant) AS montant FROM ("
+            f"SELECT uid, min({mois}) AS mois, {per_uid}, "
+            "max(montant)::DECIMAL(18, 2) AS montant "
+            f"FROM decp WHERE {where_sql} GROUP BY uid"
+            ") GROUP BY ALL"
+        )
+    select_dims = ", ".join([f"{mois} AS mois"] + [f'"{d}"' for d in dimensions])
+    return (
+        f"SELECT {select_dims}, count(*) AS nb_lignes "
+        f"FROM decp WHERE {where_sql} GROUP BY ALL"
+    )
+
+
+def _decp_schema(w: duckdb.DuckDBPyConnection) -> dict:
+    return {r[0]: r[1] for r in w.execute("DESCRIBE decp").fetchall()}
+
+
+def _create_cubes(w: duckdb.DuckDBPyConnection) -> None:
+    schema = _decp_schema(w)
+    if not cubes_supported(schema):
+        logger.warning(
+            "Colonnes dateNotification ou montant inadaptées : pas de cubes."
+        )
+        return
+    for name in CUBE_TABLES:
+        w.execute(f"CREATE TABLE {name} AS {cube_select_sql(name, schema)}")
+
+
+def org_stats_supported(schema: dict) -> bool:
+    columns = ["acheteur_nom", "titulaire_nom", "titulaire_distance"]
+    return schema.get("dateNotification") == "DATE" and all(
+        c in schema for c in columns + ["titulaire_typeIdentifiant"]
+    )
+
+
+def distance_bin_sql(log_distance: str, log_min: str, log_max: str) -> str:
+    """Intervalle (0 à DISTANCE_BINS - 1) de log_distance entre log_min et log_max."""
+    # Si toutes les distances sont égales, np.histogram centre l'unique valeur
+    return (
+        f"CASE WHEN {log_max} = {log_min} THEN {DISTANCE_BINS // 2} "
+        f"ELSE least(floor(({log_distance} - {log_min}) "
+        f"/ ({log_max} - {log_min}) * {DISTANCE_BINS}), "
+        f"{DISTANCE_BINS - 1}) END"
+    )
+
+
+def distance_bins_sql(bin_column: str) -> str:
+    """Agrégats des comptes par intervalle, dans l'ordre (liste distance_bins)."""
+    return ", ".join(
+        f"count(*) FILTER ({bin_column} = {i})" for i in range(DISTANCE_BINS)
+    )
+
+
+def org_stats_select_sql(name: str, where_sql: str = "TRUE") -> str:
+    """Statistiques de la table `name` (voir ORG_STATS_TABLES) pour les lignes
+    de decp vérifiant where_sql.
+
+    Colonnes : nombre de lignes, de marchés et de partenaires distincts, les
+    TOP_PARTENAIRES principaux partenaires avec leur nombre d'attributions
+    (top_partenaires, liste non triée) et l'histogramme des distances :
+    DISTANCE_BINS intervalles égaux entre distance_log_min et distance_log_max
+    (log10 des distances en km). Sert à la construction, aux mises à jour incrémentales et aux bases qui
+    n'ont pas encore la table (voir src.utils.data.get_org_stats).
+    """
+    table = ORG_STATS_TABLES[name]
+    key = f'"{table["org_type"]}_id"'
+    partner = table["partner"]
+    top_columns = [f"{partner}_id", f"{partner}_nom", "titulaire_distance"]
+    if partner == "titulaire":
+        top_columns.append("titulaire_typeIdentifiant")
+    columns = ", ".join(f'"{c}"' for c in top_columns)
+    fields = ", ".join(f'"{c}" := "{c}"' for c in top_columns)
+    bins = distance_bins_sql("bin")
+    bin_sql = distance_bin_sql(
+        "l.log_distance", "t.distance_log_min", "t.distance_log_max"
+    )
+    # annee = 0 le temps du calcul : les jointures ignoreraient NULL
+    return f"""
+        WITH lignes AS (
+            SELECT {key}, year("dateNotification") AS annee, uid, {columns},
+                CASE WHEN "titulaire_distance" > 0
+                    THEN log10("titulaire_distance") END AS log_distance
+            FROM decp
+            WHERE {key} IS NOT NULL AND {table["where"]} AND {where_sql}
+        ),
+        par_annee AS (
+            SELECT * FROM lignes WHERE annee IS NOT NULL
+            UNION ALL SELECT * REPLACE (0 AS annee) FROM lignes
+        ),
+        totaux AS (
+            SELECT {key}, annee, count(*) AS nb_lignes,
+                count(DISTINCT uid) AS nb_marches,
+                count(DISTINCT "{partner}_id") AS nb_partenaires,
+                min(log_distance) AS distance_log_min,
+                max(log_distance) AS distance_log_max
+            FROM par_annee GROUP BY ALL
+        ),
+        partenaires AS (
+            SELECT {key}, annee,
+                list(struct_pack({fields}, "Attributions" := nb)) AS top_partenaires
+            FROM (
+                SELECT {key}, annee, {columns}, count(*) AS nb
+                FROM par_annee GROUP BY {key}, annee, {columns}
+                QUALIFY row_number() OVER (
+                    PARTITION BY {key}, annee ORDER BY nb DESC, "{partner}_id"
+                ) <= {TOP_PARTENAIRES}
+            ) GROUP BY ALL
+        ),
+        distances AS (
+            SELECT {key}, annee, [{bins}] AS distance_bins
+            FROM (
+                SELECT l.{key}, l.annee, {bin_sql} AS bin
+                FROM par_annee AS l JOIN totaux AS t USING ({key}, annee)
+                WHERE l.log_distance IS NOT NULL
+            ) GROUP BY ALL
+        )
+        SELECT * REPLACE (nullif(annee, 0) AS annee)
+        FROM totaux
+        LEFT JOIN partenaires USING ({key}, annee)
+        LEFT JOIN distances USING ({key}, annee)
+    """
+
+
+def _create_org_stats(w: duckdb.DuckDBPyConnection) -> None:
+    if not org_stats_supported(_decp_schema(w)):
+        logger.warning("Colonnes des statistiques absentes : pas de tables *_stats.")
+        return
+    for name, table in ORG_STATS_TABLES.items():
+        column = f"{table['org_type']}_id"
+        w.execute(f"CREATE TABLE {name} AS {org_stats_select_sql(name, 'FALSE')}")
+        # Par lots d'organisations : en une requête, les agrégats de toutes les
+        # organisations dépassent BUILD_MEMORY_LIMIT
+        for batch in range(ORG_STATS_BATCHES):
+            where_sql = f'hash("{column}") % {ORG_STATS_BATCHES} = {batch}'
+            w.execute(
+                f"INSERT INTO {name} {org_stats_select_sql(name, where_sql)} "
+                f'ORDER BY "{column}", annee NULLS FIRST'
+            )
+        w.execute(f'CREATE INDEX {name}_{column}_idx ON {name} ("{column}")')
+
+
+def etablissements_select_sql(
+    con: duckdb.DuckDBPyConnection, sirene_path: Path, where_sql: str = "TRUE"
+) -> tuple[str, list]:
+    """Établissements de l'extrait SIRENE dont le SIRET est un acheteur ou un
+    titulaire de decp (et vérifiant where_sql)."""
+    available = {
+        r[0]
+        for r in con.execute(
+            "SELECT column_name FROM (DESCRIBE SELECT * FROM read_parquet(?))",
+            [str(sirene_path)],
+        ).fetchall()
+    }
+    select_list = []
+    for column, (column_type, candidates) in ETABLISSEMENTS_COLUMNS.items():
+        source = next((c for c in candidates if c in available), None)
+        if source is None and column == "siret":
+            raise ValueError(f"Colonne siret absente de {sirene_path}")
+        value = f'"{source}"::{column_type}' if source else f"NULL::{column_type}"
+        select_list.append(f'{value} AS "{column}"')
+    sirets = (
+        "SELECT acheteur_id FROM decp UNION SELECT titulaire_id FROM decp "
+        "WHERE \"titulaire_typeIdentifiant\" = 'SIRET'"
+    )
+    sql = (
+        f"SELECT * FROM (SELECT {', '.join(select_list)} FROM read_parquet(?)) "
+        f"WHERE siret IN ({sirets}) AND {where_sql}"
+    )
+    return sql, [str(sirene_path)]
+
+
+def _create_etablissements(w: duckdb.DuckDBPyConnection) -> None:
+    if not SIRENE_ETABLISSEMENTS_PATH:
+        return
+    sql, params = etablissements_select_sql(w, Path(SIRENE_ETABLISSEMENTS_PATH))
+    w.execute(f"CREATE TABLE etablissements AS {sql} ORDER BY siret", params)
+    w.execute("CREATE INDEX etablissements_siret_idx ON etablissements (siret)")
+    nb = w.execute("SELECT count(*) FROM etablissements").fetchone()[0]
+    logger.info(f"{nb} établissements copiés depuis {SIRENE_ETABLISSEMENTS_PATH}")
+
+
+def list_generations(db_path: Path) -> list[Path]:
+    """Générations publiées de la base, de la plus ancienne à la plus récente."""
+    db_path = Path(db_path)
+    generations = db_path.parent.glob(f"{db_path.stem}.*{db_path.suffix}")
+    return sorted(
+        (g for g in generations if g.stem.rsplit(".", 1)[-1].isdigit()),
+        key=lambda g: int(g.stem.rsplit(".", 1)[-1]),
+    )
+
+
+def publish_database(tmp_path: Path, db_path: Path) -> Path:
+    """Publie une base fraîchement écrite comme nouvelle génération.
+
+    La base est renommée en decp.<horodatage>.duckdb puis `db_path` devient un
+    lien symbolique vers elle, remplacé atomiquement : les workers en cours
+    détectent le changement de cible (voir `src.db.DatabaseHandle`) et
+    basculent sans redémarrage. La génération précédente est conservée pour
+    les requêtes encore en cours, les plus anciennes sont supprimées.
+    """
+    db_path = Path(db_path)
+    generation = db_path.with_name(f"{db_path.stem}.{time.time_ns()}{db_path.suffix}")
+    os.replace(tmp_path, generation)
+
+    link_path = db_path.with_suffix(".duckdb.link")
+    link_path.unlink(missing_ok=True)
+    os.symlink(generation.name, link_path)
+    os.replace(link_path, db_path)
+
+    for old in list_generations(db_path)[:-2]:
+        old.unlink(missing_ok=True)
+    return generation
+
+
+def build_database(
+    db_path: Path,
+    parquet_path: Path,
+    engine: Literal["duckdb", "polars"] = "duckdb",
+) -> None:
+    """Build the DuckDB database atomically under an exclusive lock.
+
+    Caller MUST hold the fcntl.flock on the .lock file.
+
+    `engine="duckdb"` (défaut) transforme le parquet en flux dans DuckDB, avec
+    une mémoire plafonnée par DUCKDB_BUILD_MEMORY_LIMIT. `engine="polars"`
+    conserve l'ancien chemin (collect Polars + parquet intermédiaire).
+    """
+    db_path = Path(db_path)
+    parquet_path = Path(parquet_path)
+    tmp_path = db_path.with_suffix(".duckdb.tmp")
+    staging_parquet = db_path.with_suffix(".staging.parquet")
+    if tmp_path.exists():
+        tmp_path.unlink()
+
+    logger.info(f"Construction de la base DuckDB à partir de {parquet_path}...")
+
+    try:
+        with duckdb.connect(str(tmp_path)) as w:
+            if engine == "polars":
+                frame = _load_source_frame(parquet_path)
+                # Write transformed frame as parquet so DuckDB can read it natively
+                # (avoids pyarrow dependency for the Polars→DuckDB handoff)
+                frame.write_parquet(str(staging_parquet))
+                del frame
+                w.execute(
+                    "CREATE TABLE decp AS SELECT * FROM read_parquet(?) "
+                    f"ORDER BY {STORAGE_ORDER_BY}",
+                    [str(staging_parquet)],
+                )
+            else:
+                w.execute(f"SET memory_limit = '{BUILD_MEMORY_LIMIT}'")
+                source_sql, params = source_select_sql(w, parquet_path)
+                w.execute(f"CREATE TABLE decp AS {source_sql}", params)
+
+            _create_marches_tables(w)
+            _create_indexes(w)
+            _create_derived_tables(w)
+            _create_cubes(w)
+            _create_org_stats(w)
+            _create_etablissements(w)
+    finally:
+        if staging_parquet.exists():
+            staging_parquet.unlink()
+
+    generation = publish_database(tmp_path, db_path)
+    logger.info(f"Base DuckDB construite : {generation}")
+
+
+def _missing_tables(w: duckdb.DuckDBPyConnection) -> set[str]:
+    """Tables attendues par l'application et absentes de la base."""
+    tables = {r[0] for r in w.execute("SHOW TABLES").fetchall()}
+    if "decp" not in tables:
+        return {"decp"}
+    expected = {
+        "decp",
+        "decp_hashes",
+        "decp_refreshes",
+        *DERIVED_TABLES,
+        *MARCHES_TABLES,
+    }
+    schema = _decp_schema(w)
+    if cubes_supported(schema):
+        expected |= set(CUBE_TABLES)
+    if org_stats_supported(schema):
+        expected |= set(ORG_STATS_TABLES)
+    if SIRENE_ETABLISSEMENTS_PATH:
+        expected.add("etablissements")
+    return expected - tables
+
+
+def is_outdated(db_path: Path) -> bool:
+    """Vrai s'il manque à la base des tables ajoutées depuis sa construction."""
+    with duckdb.connect(str(Path(db_path).resolve()), read_only=True) as con:
+        return bool(_missing_tables(con))
+
+
+def _can_refresh(w: duckdb.DuckDBPyConnection, source_sql: str, params: list) -> bool:
+    """Vrai si la base existante a le même schéma que le nouveau parquet."""
+    expected = w.execute(f"DESCRIBE {source_sql}", params).fetchall()
+    current = w.execute("DESCRIBE decp").fetchall()
+    if [c[:2] for c in expected] != [c[:2] for c in current]:
+        logger.info("Le schéma des données a changé.")
+        return False
+    missing = _missing_tables(w)
+    if missing:
+        logger.info(f"Tables absentes de la base : {', '.join(sorted(missing))}")
+        return False
+    indexes = {
+        r[0] for r in w.execute("SELECT index_name FROM duckdb_indexes()").fetchall()
+    }
+    if not set(_index_names()) <= indexes:
+        logger.info("Index absents de la base.")
+        return False
+    return True
+
+
+def _merge_cube(w: duckdb.DuckDBPyConnection, name: str, dimensions: list[str]) -> None:
+    """Recalcule les cellules du cube touchées : existant - ancien + nouveau."""
+    measures = CUBE_TABLES[name]["measures"]
+    dims = ", ".join(f'"{d}"' for d in dimensions)
+    same_cell = " AND ".join(
+        f'c."{d}" IS NOT DISTINCT FROM k."{d}"' for d in dimensions
+    )
+    sums = ", ".join(f"sum({m}) AS {m}" for m in measures)
+    negated = ", ".join(f"-{m} AS {m}" for m in measures)
+
+    w.execute(
+        f"CREATE TEMP TABLE {name}_keys AS "
+        f"SELECT {dims} FROM {name}_old UNION SELECT {dims} FROM {name}_new"
+    )
+    w.execute(
+        f"CREATE TEMP TABLE {name}_merged AS SELECT {dims}, {sums} FROM ("
+        f"SELECT c.* FROM {name} AS c SEMI JOIN {name}_keys AS k ON {same_cell} "
+        f"UNION ALL BY NAME SELECT * FROM {name}_new "
+        f"UNION ALL BY NAME SELECT {dims}, {negated} FROM {name}_old"
+        f") GROUP BY ALL HAVING sum({measures[0]}) <> 0"
+    )
+    w.execute(f"DELETE FROM {name} AS c USING {name}_keys AS k WHERE {same_cell}")
+    w.execute(f"INSERT INTO {name} BY NAME SELECT * FROM {name}_merged")
+
+
+def _in_keys_sql(key: str, relation: str) -> str:
+    """Vrai pour les lignes de `relation` dont `key` est dans delta_{key},
+    NULL compris."""
+    return (
+        f"EXISTS (SELECT 1 FROM delta_{key} AS d "
+        f"WHERE d.{key} IS NOT DISTINCT FROM {relation}.{key})"
+    )
+
+
+def _apply_delta(w: duckdb.DuckDBPyConnection, source_sql: str, params: list) -> int:
+    """Remplace dans decp et les tables dérivées les lignes des uid modifiés.
+
+    Retourne le nombre d'uid ajoutés, modifiés ou supprimés.
+    """
+    w.execute("BEGIN TRANSACTION")
+    w.execute(
+        "CREATE TEMP TABLE new_hashes AS "
+        f"SELECT uid, sum(hash(s)) AS row_hash FROM ({source_sql}) AS s GROUP BY uid",
+        params,
+    )
+    w.execute(
+        "CREATE TEMP TABLE delta AS "
+        "SELECT COALESCE(n.uid, o.uid) AS uid "
+        "FROM new_hashes AS n FULL OUTER JOIN decp_hashes AS o ON n.uid = o.uid "
+        "WHERE n.row_hash IS DISTINCT FROM o.row_hash"
+    )
+    nb_uids = w.execute("SELECT count(*) FROM delta").fetchone()[0]
+    if nb_uids == 0:
+        w.execute("ROLLBACK")
+        return 0
+
+    in_delta = "uid IN (SELECT uid FROM delta)"
+
+    # Clés des tables dérivées touchées, avant (anciennes lignes) et après
+    # (nouvelles lignes) la mise à jour de decp
+    other_keys = {t["key"] for t in DERIVED_TABLES.values()} - {"uid"}
+    for key in other_keys:
+        w.execute(
+            f"CREATE TEMP TABLE delta_{key} AS "
+            f"SELECT DISTINCT {key} FROM decp WHERE {in_delta}"
+        )
+
+    # Contributions des uid modifiés aux cubes, avant et après la mise à jour
+    schema = _decp_schema(w)
+    cubes = CUBE_TABLES if cubes_supported(schema) else {}
+    for name in cubes:
+        w.execute(
+            f"CREATE TEMP TABLE {name}_old AS {cube_select_sql(name, schema, in_delta)}"
+        )
+
+    w.execute(f"DELETE FROM decp WHERE {in_delta}")
+    w.execute(
+        f"INSERT INTO decp SELECT * FROM ({source_sql}) AS s "
+        f"WHERE {in_delta} ORDER BY {STORAGE_ORDER_BY}",
+        params,
+    )
+    w.execute(
+        f"INSERT INTO decp_refreshes SELECT now(), count(*) FROM decp WHERE {in_delta}"
+    )
+
+    for key in other_keys:
+        w.execute(
+            f"INSERT INTO delta_{key} SELECT DISTINCT {key} FROM decp WHERE {in_delta}"
+        )
+
+    for name in cubes:
+        w.execute(
+            f"CREATE TEMP TABLE {name}_new AS {cube_select_sql(name, schema, in_delta)}"
+        )
+        _merge_cube(w, name, cube_dimensions(name, schema))
+
+    columns = list(schema)
+    for name, table in MARCHES_TABLES.items():
+        w.execute(f"DELETE FROM {name} WHERE {in_delta}")
+        w.execute(
+            f"INSERT INTO {name} {marches_select_sql(name, columns, in_delta)} "
+            f"ORDER BY {table['order_by']}"
+        )
+
+    for name, table in DERIVED_TABLES.items():
+        key = table["key"]
+        if key == "uid":
+            w.execute(f"DELETE FROM {name} WHERE {in_delta}")
+            w.execute(
+                f"INSERT INTO {name} SELECT DISTINCT {table['columns']} "
+                f"FROM decp WHERE {in_delta}"
+            )
+            continue
+        # Comme la construction complète, ces tables gardent les organisations
+        # sans identifiant : IN ne retrouverait jamais la clé NULL
+        w.execute(f"DELETE FROM {name} WHERE {_in_keys_sql(key, name)}")
+        w.execute(
+            f"INSERT INTO {name} SELECT DISTINCT {table['columns']} "
+            f"FROM decp WHERE {_in_keys_sql(key, 'decp')}"
+        )
+
+    # Statistiques recalculées en entier pour les organisations touchées (sans
+    # les identifiants NULL, exclus aussi par org_stats_select_sql)
+    if org_stats_supported(schema):
+        for name, table in ORG_STATS_TABLES.items():
+            key = f"{table['org_type']}_id"
+            in_keys = f"{key} IN (SELECT {key} FROM delta_{key})"
+            w.execute(f"DELETE FROM {name} WHERE {in_keys}")
+            w.execute(
+                f"INSERT INTO {name} BY NAME {org_stats_select_sql(name, in_keys)}"
+            )
+
+    # Établissements des nouveaux acheteurs et titulaires
+    if SIRENE_ETABLISSEMENTS_PATH:
+        sql, sirene_params = etablissements_select_sql(
+            w,
+            Path(SIRENE_ETABLISSEMENTS_PATH),
+            "siret IN (SELECT acheteur_id FROM delta_acheteur_id "
+            "UNION SELECT titulaire_id FROM delta_titulaire_id) "
+            "AND siret NOT IN (SELECT siret FROM etablissements)",
+        )
+        w.execute(f"INSERT INTO etablissements {sql}", sirene_params)
+
+    w.execute(f"DELETE FROM decp_hashes WHERE {in_delta}")
+    w.execute(f"INSERT INTO decp_hashes SELECT * FROM new_hashes WHERE {in_delta}")
+    w.execute("COMMIT")
+    return nb_uids
+
+
+def unclustered_ratio(db_path: Path) -> float:
+    """Part des lignes de decp écrites par les mises à jour incrémentales depuis
+    la dernière construction complète (0 si la base n'a pas la table de suivi)."""
+    with duckdb.connect(str(Path(db_path).resolve()), read_only=True) as con:
+        if "decp_refreshes" in _missing_tables(con):
+            return 0.0
+        nb_refreshed, nb_rows = con.execute(
+            "SELECT (SELECT COALESCE(sum(nb_lignes), 0) FROM decp_refreshes), "
+            "(SELECT count(*) FROM decp)"
+        ).fetchone()
+    return nb_refreshed / max(nb_rows, 1)
+
+
+def copy_database(src: Path, dst: Path) -> None:
+    """Copie la base, par clonage des blocs si le système de fichiers le permet.
+
+    Sur btrfs ou XFS (reflink), la copie est instantanée et ne duplique pas les
+    données sur disque. Ailleurs (ext4...), c'est une copie complète, dont le
+    coût croît avec la taille de la base.
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+
+def refresh_database(db_path: Path, parquet_path: Path) -> None:
+    """Met à jour la base en n'appliquant que les marchés (uid) qui ont changé.
+
+    Caller MUST hold the fcntl.flock on the .lock file.
+
+    Les modifications sont faites sur une copie de la base (voir
+    `copy_database`), publiée comme une nouvelle génération (voir
+    `publish_database`). Retombe sur `build_database` si la base n'existe pas,
+    si le schéma du parquet a changé, s'il manque une table ou si les mises à
+    jour précédentes ont trop dégradé l'ordre des lignes (RECLUSTER_RATIO).
+    """
+    db_path = Path(db_path)
+    parquet_path = Path(parquet_path)
+    tmp_path = db_path.with_suffix(".duckdb.tmp")
+
+    if not db_path.exists():
+        build_database(db_path, parquet_path)
+        return
+
+    ratio = unclustered_ratio(db_path)
+    if ratio >= RECLUSTER_RATIO:
+        logger.info(
+            f"{ratio:.0%} des lignes écrites par des mises à jour incrémentales, "
+            "reconstruction complète pour retrier la base."
+        )
+        build_database(db_path, parquet_path)
+        return
+
+    logger.info(f"Mise à jour incrémentale de la base à partir de {parquet_path}...")
+    copy_database(db_path, tmp_path)
+    try:
+        with duckdb.connect(str(tmp_path)) as w:
+            w.execute(f"SET memory_limit = '{BUILD_MEMORY_LIMIT}'")
+            source_sql, params = source_select_sql(w, parquet_path, ordered=False)
+            nb_uids = (
+                _apply_delta(w, source_sql, params)
+                if _can_refresh(w, source_sql, params)
+                else None
+            )
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    if nb_uids is None:
+        tmp_path.unlink()
+        logger.info("Mise à jour incrémentale impossible, reconstruction complète.")
+        build_database(db_path, parquet_path)
+        return
+
+    if nb_uids == 0:
+        # Rien à publier : on marque seulement la base comme à jour
+        tmp_path.unlink()
+        os.utime(db_path)
+        logger.info("Base DuckDB déjà à jour.")
+        return
+
+    generation = publish_database(tmp_path, db_path)
+    logger.info(
+        f"Base DuckDB mise à jour ({generation.name}) : "
+        f"{nb_uids} marchés ajoutés, modifiés ou supprimés"
+    )
+
+
+def update_database(db_path: Path, parquet_path: Path) -> None:
+    """Construit ou met à jour la base si le parquet source est plus récent.
+
+    Prend le verrou exclusif sur le fichier .lock : plusieurs processus peuvent
+    l'appeler en même temps, un seul travaille, les autres trouvent ensuite une
+    base à jour.
+    """
+    db_path = Path(db_path)
+    parquet_path = Path(parquet_path)
+    lock_path = db_path.with_suffix(".duckdb.lock")
+
+    with open(lock_path, "w") as lock_fd:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        if not should_rebuild(db_path, parquet_path) and not is_outdated(db_path):
+            logger.debug("Base de données déjà disponible et à jour.")
+        elif os.getenv("DUCKDB_INCREMENTAL_REFRESH", "True").lower() == "true":
+            refresh_database(db_path, parquet_path)
+        else:
+            build_database(db_path, parquet_path)
+
+
+if __name__ == "__main__":
+    # Mise à jour de la base hors des workers (cron, fin de decp-processing) :
+    #   python -m src.build
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    update_database(
+        Path(os.getenv("DUCKDB_PATH", "./decp.duckdb")),
+        Path(os.getenv("DATA_FILE_PARQUET_PATH")),
+    )
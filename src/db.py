@@ -1,136 +1,225 @@
-import fcntl
 import os
+import threading
+import weakref
+from collections.abc import Callable, Iterable
 from pathlib import Path
-from time import sleep
 
 import duckdb
 import polars as pl
-import polars.selectors as cs
-from polars.exceptions import ComputeError
 
+# build_database et should_rebuild restent importables depuis src.db
+from src.build import (  # noqa: F401
+    build_database,
+    is_outdated,
+    is_titulaire_column,
+    should_rebuild,
+    update_database,
+)
 from src.utils import logger
 
+# Mémoire maximale de DuckDB dans chaque worker (au-delà, les tris des exports
+# sont écrits sur disque). Non défini : limite par défaut de DuckDB.
+MEMORY_LIMIT = os.getenv("DUCKDB_MEMORY_LIMIT")
+# Générations successives essayées par DatabaseHandle.cursor
+CURSOR_ATTEMPTS = 3
 
-def should_rebuild(db_path: Path, parquet_path: Path) -> bool:
-    db_path = Path(db_path)
-    parquet_path = Path(parquet_path)
-    if not db_path.exists():
-        return True
-    dev = os.getenv("DEVELOPMENT", "False").lower() == "true"
-    force = os.getenv("REBUILD_DUCKDB", "False").lower() == "true"
-    if dev and not force:
-        return False
-    return parquet_path.stat().st_mtime > db_path.stat().st_mtime
 
+def _ensure_database() -> Path:
+    """Construit la base si elle n'existe pas encore, ou s'il lui manque des
+    tables ajoutées depuis sa construction.
 
-def _load_source_frame(parquet_path: Path) -> pl.DataFrame:
-    """Read the source parquet and apply the row-level transforms.
-
-    Kept here (not in utils.py) so src.db has no dependency on utils.
-    Mirrors the behavior previously in utils.get_decp_data().
+    Une base existante et complète n'est jamais reconstruite à l'import : les
+    mises à jour sont faites hors des workers (`python -m src.build`) et prises
+    en compte à chaud par `DatabaseHandle`.
     """
-    try:
-        lff: pl.LazyFrame = pl.scan_parquet(str(parquet_path))
-    except ComputeError:
-        logger.info("Lecture du parquet échouée, nouvelle tentative dans 10s...")
-        sleep(10)
-        lff = pl.scan_parquet(str(parquet_path))
-
-    lff = lff.sort(by=["dateNotification", "uid"], descending=True, nulls_last=True)
-    lff = lff.filter(pl.col("donneesActuelles")).drop("donneesActuelles")
-
-    # booleans_to_strings: true → "oui", false → "non"
-    lff = lff.with_columns(
-        pl.col(cs.Boolean)
-        .cast(pl.String)
-        .str.replace("true", "oui")
-        .str.replace("false", "non")
-    )
-
-    for col in ["acheteur_nom", "titulaire_nom"]:
-        lff = lff.with_columns(
-            pl.when(pl.col(col).is_null())
-            .then(pl.lit("[Identifiant non reconnu dans la base INSEE]"))
-            .otherwise(pl.col(col))
-            .name.keep()
-        )
-
-    return lff.collect()
+    db_path = Path(os.getenv("DUCKDB_PATH", "./decp.duckdb"))
+    if not db_path.exists() or is_outdated(db_path):
+        update_database(db_path, Path(os.getenv("DATA_FILE_PARQUET_PATH")))
+    return db_path
 
 
-def build_database(db_path: Path, parquet_path: Path) -> None:
-    """Build the DuckDB database atomically under an exclusive lock.
+class Generation:
+    """Une génération publiée de la base, ouverte en lecture seule.
 
-    Caller MUST hold the fcntl.flock on the .lock file.
+    Compte les curseurs en cours d'utilisation pour ne fermer la connexion
+    qu'une fois la génération remplacée et tous ses curseurs libérés.
     """
-    db_path = Path(db_path)
-    parquet_path = Path(parquet_path)
-    tmp_path = db_path.with_suffix(".duckdb.tmp")
-    staging_parquet = db_path.with_suffix(".staging.parquet")
-    if tmp_path.exists():
-        tmp_path.unlink()
-
-    logger.info(f"Construction de la base DuckDB à partir de {parquet_path}...")
-    frame = _load_source_frame(parquet_path)
-
-    # Write transformed frame as parquet so DuckDB can read it natively
-    # (avoids pyarrow dependency for the Polars→DuckDB handoff)
-    frame.write_parquet(str(staging_parquet))
-    try:
-        with duckdb.connect(str(tmp_path)) as w:
-            w.execute(
-                f"CREATE TABLE decp AS SELECT * FROM read_parquet('{staging_parquet}')"
-            )
-            w.execute(
-                "CREATE TABLE acheteurs_marches AS "
-                "SELECT DISTINCT uid, objet, acheteur_id FROM decp "
-                "ORDER BY acheteur_id"
-            )
-            w.execute(
-                "CREATE TABLE titulaires_marches AS "
-                "SELECT DISTINCT uid, objet, titulaire_id FROM decp "
-                "ORDER BY titulaire_id"
-            )
-            w.execute(
-                "CREATE TABLE acheteurs_departement AS "
-                "SELECT DISTINCT acheteur_id, acheteur_nom, acheteur_departement_code "
-                "FROM decp ORDER BY acheteur_nom"
-            )
-            w.execute(
-                "CREATE TABLE titulaires_departement AS "
-                "SELECT DISTINCT titulaire_id, titulaire_nom, titulaire_departement_code "
-                "FROM decp ORDER BY titulaire_nom"
-            )
-    finally:
-        if staging_parquet.exists():
-            staging_parquet.unlink()
-
-    os.replace(tmp_path, db_path)
-    logger.info(f"Base DuckDB construite : {db_path}")
 
+    def __init__(self, path: Path):
+        self.path = path
+        config = {"memory_limit": MEMORY_LIMIT} if MEMORY_LIMIT else {}
+        self.conn = duckdb.connect(str(path), read_only=True, config=config)
+        self.schema: pl.Schema = (
+            self.conn.execute("SELECT * FROM decp LIMIT 0").pl().schema
+        )
+        self.tables: set[str] = {
+            r[0] for r in self.conn.execute("SHOW TABLES").fetchall()
+        }
+        self._lock = threading.RLock()
+        self._in_flight = 0
+        self._retired = False
+        self._closed = False
+        self._memo: dict = {}
+
+    @property
+    def name(self) -> str:
+        return self.path.name
+
+    def cursor(self) -> duckdb.DuckDBPyConnection | None:
+        """Nouveau curseur, ou None si la génération est déjà fermée."""
+        with self._lock:
+            if self._closed:
+                return None
+            cursor = self.conn.cursor()
+            self._in_flight += 1
+        weakref.finalize(cursor, self._release)
+        return cursor
+
+    def _release(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            if self._retired and self._in_flight == 0:
+                self._close()
+
+    def retire(self) -> None:
+        """Ferme la connexion dès que le dernier curseur en cours est libéré."""
+        with self._lock:
+            self._retired = True
+            if self._in_flight == 0:
+                self._close()
+
+    def _close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self.conn.close()
+            logger.info(f"Génération {self.name} de la base fermée.")
+
+    def memoize(self, key, compute: Callable):
+        """Calcule `compute()` une seule fois pour cette génération."""
+        with self._lock:
+            if key in self._memo:
+                return self._memo[key]
+        value = compute()
+        with self._lock:
+            return self._memo.setdefault(key, value)
+
+
+class DatabaseHandle:
+    """Accès versionné à la base : suit la cible du lien symbolique `db_path`.
+
+    Quand `publish_database` fait pointer le lien vers une nouvelle génération,
+    le premier appel qui le remarque lance un thread qui ouvre la nouvelle
+    base, exécute les fonctions enregistrées avec `on_new_generation`
+    (préchargements, parfois longs) puis la rend courante. Les requêtes
+    continuent entre-temps sur l'ancienne génération, sans attendre ; celles en
+    cours au moment de la bascule y terminent, et elle est fermée une fois ses
+    curseurs libérés.
+
+    On se connecte au chemin réel de chaque génération et non au lien : DuckDB
+    réutilise une base déjà ouverte dans le processus pour un même chemin.
+    """
 
-def _ensure_database() -> Path:
-    db_path = Path(os.getenv("DUCKDB_PATH", "./decp.duckdb"))
-    parquet_path = Path(os.getenv("DATA_FILE_PARQUET_PATH"))
-    lock_path = db_path.with_suffix(".duckdb.lock")
-
-    with open(lock_path, "w") as lock_fd:
-        fcntl.flock(lock_fd, fcntl.LOCK_EX)
-        if should_rebuild(db_path, parquet_path):
-            build_database(db_path, parquet_path)
-        else:
-            logger.debug("Base de données déjà disponible et à jour.")
-    return db_path
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self._swap_lock = threading.Lock()
+        self._rejected: Path | None = None
+        self._hooks: list[Callable[[Generation], None]] = []
+        self._swap_thread: threading.Thread | None = None
+        self.current = Generation(self._target())
+
+    def _target(self) -> Path:
+        return Path(os.path.realpath(self.db_path))
+
+    def on_new_generation(self, hook: Callable[[Generation], None]) -> None:
+        self._hooks.append(hook)
+
+    def get(self) -> Generation:
+        target = self._target()
+        # Une seule bascule à la fois, hors du thread de la requête
+        if target not in (
+            self.current.path,
+            self._rejected,
+        ) and self._swap_lock.acquire(blocking=False):
+            if target == self.current.path:
+                self._swap_lock.release()
+            else:
+                self._swap_thread = threading.Thread(
+                    target=self._swap_in_background,
+                    args=(target,),
+                    name="decp-swap",
+                    daemon=True,
+                )
+                self._swap_thread.start()
+        return self.current
+
+    def join_swap(self, timeout: float | None = None) -> None:
+        """Attend la fin de la bascule en cours, s'il y en a une."""
+        if self._swap_thread is not None:
+            self._swap_thread.join(timeout)
+
+    def _swap_in_background(self, target: Path) -> None:
+        try:
+            self._swap(target)
+        finally:
+            self._swap_lock.release()
+
+    def _swap(self, target: Path) -> None:
+        try:
+            new = Generation(target)
+        except duckdb.Error as e:
+            logger.error(f"Ouverture de la base {target} impossible : {e}")
+            self._rejected = target
+            return
+
+        if new.schema != self.current.schema:
+            logger.warning(
+                f"Le schéma de la base {target.name} diffère de celui chargé au "
+                "démarrage, un redémarrage est nécessaire pour l'utiliser."
+            )
+            new.retire()
+            self._rejected = target
+            return
+
+        try:
+            for hook in self._hooks:
+                hook(new)
+        except Exception:
+            # Génération écartée : les requêtes suivantes ne retentent pas la bascule
+            logger.exception(f"Préchargement de la base {target.name} échoué.")
+            new.retire()
+            self._rejected = target
+            return
+
+        old, self.current = self.current, new
+        old.retire()
+        logger.info(f"Bascule sur la génération {new.name} de la base.")
+
+    def cursor(self) -> duckdb.DuckDBPyConnection:
+        # Une bascule peut fermer la génération lue entre get() et cursor() :
+        # self.current désigne alors déjà la suivante, il suffit de la relire
+        for _ in range(CURSOR_ATTEMPTS):
+            cursor = self.get().cursor()
+            if cursor is not None:
+                return cursor
+        raise duckdb.ConnectionException(
+            f"Aucune génération ouverte de la base {self.db_path}"
+        )
 
 
 DB_PATH = _ensure_database()
-conn: duckdb.DuckDBPyConnection = duckdb.connect(str(DB_PATH), read_only=True)
-schema: pl.Schema = conn.execute("SELECT * FROM decp LIMIT 0").pl().schema
+database = DatabaseHandle(DB_PATH)
+# Le schéma ne change pas sans redémarrage (voir DatabaseHandle._swap)
+schema: pl.Schema = database.current.schema
 
 
 def get_cursor() -> duckdb.DuckDBPyConnection:
-    """Return a per-request cursor that shares the process-wide connection."""
-    return conn.cursor()
+    """Return a per-request cursor on the current database generation."""
+    return database.cursor()
+
+
+def get_generation() -> Generation:
+    """Génération courante de la base (après détection d'une éventuelle bascule)."""
+    return database.get()
 
 
 def query_marches(
@@ -147,8 +236,44 @@ def query_marches(
     code, never user input). `params` values are passed through DuckDB's
     parameter binding.
     """
+    return _query_table("decp", where_sql, params, columns, order_by, limit, offset)
+
+
+def query_unique_marches(
+    where_sql: str = "TRUE",
+    params: tuple | list = (),
+    columns: list[str] | None = None,
+    order_by: str | None = None,
+    limit: int | None = None,
+    offset: int | None = None,
+) -> pl.DataFrame:
+    """Comme query_marches, mais une ligne par marché (table marches).
+
+    Les colonnes titulaire_* sont absentes ; nb_titulaires donne le nombre de
+    titulaires distincts (identifiant et type d'identifiant) du marché.
+    where_sql ne peut donc porter que sur les colonnes du marché.
+    """
+    return _query_table("marches", where_sql, params, columns, order_by, limit, offset)
+
+
+def query_marche_titulaires(uid: str) -> pl.DataFrame:
+    """Titulaires distincts d'un marché (table marches_titulaires)."""
+    return _query_table(
+        "marches_titulaires", "uid = ?", [uid], order_by='"titulaire_id"'
+    )
+
+
+def _query_table(
+    table: str,
+    where_sql: str,
+    params: tuple | list,
+    columns: list[str] | None = None,
+    order_by: str | None = None,
+    limit: int | None = None,
+    offset: int | None = None,
+) -> pl.DataFrame:
     cols = ", ".join(columns) if columns else "*"
-    sql = f"SELECT {cols} FROM decp WHERE {where_sql}"
+    sql = f"SELECT {cols} FROM {table} WHERE {where_sql}"
     if order_by:
         sql += f" ORDER BY {order_by}"
     if limit is not None:
@@ -156,7 +281,7 @@ def query_marches(
     if offset is not None:
         sql += f" OFFSET {int(offset)}"
 
-    logger.debug("query_marches: " + sql.replace("?", "{}").format(*params))
+    logger.debug(f"query {table}: " + sql.replace("?", "{}").format(*params))
 
     return get_cursor().execute(sql, list(params)).pl()
 
@@ -169,9 +294,197 @@ def count_marches(where_sql: str = "TRUE", params: tuple | list = ()) -> int:
     return int(result[0]) if result else 0
 
 
-def count_unique_marches(where_sql: str = "TRUE", params: tuple | list = ()) -> int:
-    """Retourne le nombre de uid distincts correspondant à where_sql."""
-    sql = f"SELECT COUNT(DISTINCT uid) FROM decp WHERE {where_sql}"
+def _unique_on_marches(where_sql: str, filtered_columns: Iterable[str] | None) -> bool:
+    """Vrai si les marchés distincts de where_sql peuvent être comptés dans la
+    table marches : aucune colonne filtrée n'est une colonne des titulaires."""
+    if filtered_columns is None:
+        on_marches = where_sql == "TRUE"
+    else:
+        on_marches = not any(is_titulaire_column(c) for c in filtered_columns)
+    return on_marches and "marches" in get_generation().tables
+
+
+def count_unique_marches(
+    where_sql: str = "TRUE",
+    params: tuple | list = (),
+    filtered_columns: Iterable[str] | None = None,
+) -> int:
+    """Retourne le nombre de uid distincts correspondant à where_sql.
+
+    `filtered_columns` liste les colonnes sur lesquelles porte where_sql (voir
+    src.utils.table_sql.filter_query_columns). Simple COUNT(*) sur la table
+    marches quand aucune n'est une colonne des titulaires, COUNT(DISTINCT uid)
+    sur decp sinon, ou quand elles ne sont pas connues.
+    """
+    if _unique_on_marches(where_sql, filtered_columns):
+        sql = f"SELECT COUNT(*) FROM marches WHERE {where_sql}"
+    else:
+        sql = f"SELECT COUNT(DISTINCT uid) FROM decp WHERE {where_sql}"
     logger.debug("count_unique_marches: " + sql.replace("?", "{}").format(*params))
     result = get_cursor().execute(sql, list(params)).fetchone()
     return int(result[0]) if result else 0
+
+
+def keys_to_order_by(keys: list[tuple]) -> str:
+    """Clause ORDER BY (valeurs nulles en dernier) pour des clés de tri."""
+    return ", ".join(f'"{col}" {direction} NULLS LAST' for col, direction in keys)
+
+
+def seek_to_sql(keys: list[tuple], after: tuple) -> tuple[str, list]:
+    """Prédicat des lignes situées après `after` dans l'ordre de `keys`.
+
+    Pagination par clé : `after` contient les valeurs des colonnes de `keys`
+    pour la dernière ligne de la page précédente. L'ordre est celui de
+    keys_to_order_by (NULLS LAST) et doit être total (dernière clé unique).
+    """
+    disjuncts: list[str] = []
+    params: list = []
+    for i, (col, direction) in enumerate(keys):
+        if after[i] is None:
+            # Rien ne suit une valeur nulle dans cette colonne (NULLS LAST)
+            continue
+        operator = ">" if direction == "ASC" else "<"
+        clauses = [f'"{c}" IS NOT DISTINCT FROM ?' for c, _ in keys[:i]]
+        clauses.append(f'("{col}" {operator} ? OR "{col}" IS NULL)')
+        disjuncts.append(" AND ".join(clauses))
+        params.extend([*after[:i], after[i]])
+    if not disjuncts:
+        return "FALSE", []
+    return "(" + " OR ".join(f"({d})" for d in disjuncts) + ")", params
+
+
+def page_keys(sort_keys: list[tuple]) -> list[tuple]:
+    """Clés de tri complétées pour former un ordre total.
+
+    uid départage les lignes de même clé, puis rowid les lignes d'un même
+    marché (une par titulaire).
+    """
+    keys = list(sort_keys)
+    if "uid" not in [col for col, _ in keys]:
+        keys.append(("uid", "DESC"))
+    return keys + [("__rowid", "ASC")]
+
+
+def page_sql(
+    where_sql: str,
+    params: tuple | list,
+    sort_keys: list[tuple],
+    limit: int,
+    offset: int = 0,
+    after: tuple | None = None,
+    with_totals: bool = True,
+    unique_on_marches: bool = False,
+) -> tuple[str, list]:
+    """Requête d'une page de decp accompagnée des deux totaux du filtre.
+
+    decp n'est parcourue qu'une fois : les lignes filtrées sont matérialisées
+    avec seulement leur rowid, uid et les colonnes de tri. Les totaux et le
+    top-N sont tirés de cette table étroite, puis seules les lignes de la page
+    sont relues par rowid.
+
+    Avec `after` (valeurs de page_keys(sort_keys) pour la dernière ligne de la
+    page précédente), la page commence après cette ligne au lieu de sauter
+    `offset` lignes : le top-N ne garde que `limit` + `offset` lignes.
+
+    Avec `with_totals=False` (totaux déjà connus), la table étroite n'est pas
+    matérialisée et la requête ne retourne que les lignes de la page.
+
+    Avec `unique_on_marches=True` (where_sql ne porte sur aucune colonne des
+    titulaires), le nombre de marchés est un COUNT(*) sur la table marches
+    plutôt qu'un COUNT(DISTINCT uid) sur les lignes filtrées.
+    """
+    keys = page_keys(sort_keys)
+    order_by = keys_to_order_by(keys)
+    narrow_columns = ", ".join(f'"{col}"' for col, _ in keys[:-1])
+    seek_sql, seek_params = ("TRUE", []) if after is None else seek_to_sql(keys, after)
+    materialized = "MATERIALIZED" if with_totals else "NOT MATERIALIZED"
+    page = (
+        "SELECT *, rowid AS __rowid, TRUE AS __in_page FROM decp "
+        "WHERE rowid IN (SELECT __rowid FROM page_rowids)"
+    )
+    sql = (
+        f"WITH filtered AS {materialized} ("
+        f"SELECT rowid AS __rowid, {narrow_columns} FROM decp WHERE {where_sql}), "
+        f"page_rowids AS (SELECT __rowid FROM filtered WHERE {seek_sql} "
+        f"ORDER BY {order_by} LIMIT {int(limit)} OFFSET {int(offset)})"
+    )
+    total_params = []
+    if with_totals:
+        total_unique = "count(DISTINCT uid)"
+        if unique_on_marches:
+            total_unique = f"(SELECT count(*) FROM marches WHERE {where_sql})"
+            total_params = list(params)
+        sql += (
+            f", totals AS (SELECT count(*) AS __total, "
+            f"{total_unique} AS __total_unique FROM filtered) "
+            f"SELECT totals.*, page.* FROM totals LEFT JOIN ({page}) AS page ON TRUE"
+        )
+    else:
+        sql += f" {page}"
+    return f"{sql} ORDER BY {order_by}", [*params, *seek_params, *total_params]
+
+
+def query_page(
+    where_sql: str,
+    params: tuple | list,
+    sort_keys: list[tuple],
+    limit: int,
+    offset: int = 0,
+    after: tuple | None = None,
+    totals: tuple[int, int] | None = None,
+    filtered_columns: Iterable[str] | None = None,
+) -> tuple[pl.DataFrame, int, int, tuple | None]:
+    """Page de decp, nombre de lignes et nombre de marchés distincts du filtre.
+
+    Remplace count_marches + count_unique_marches + query_marches (trois
+    parcours de decp) par une seule requête (voir page_sql). Si `totals`
+    (lignes, marchés) est fourni, ils ne sont pas recalculés. Retourne aussi
+    la clé de la dernière ligne de la page, à passer en `after` pour la page
+    suivante (None si la page est vide). `filtered_columns` : voir
+    count_unique_marches.
+    """
+    sql, all_params = page_sql(
+        where_sql,
+        params,
+        sort_keys,
+        limit,
+        offset,
+        after,
+        totals is None,
+        totals is None and _unique_on_marches(where_sql, filtered_columns),
+    )
+    logger.debug("query_page: " + sql.replace("?", "{}").format(*all_params))
+    frame = get_cursor().execute(sql, all_params).pl()
+    if totals is None:
+        totals = int(frame["__total"][0]), int(frame["__total_unique"][0])
+        frame = frame.drop("__total", "__total_unique")
+    total, total_unique = totals
+    page = frame.filter(pl.col("__in_page"))
+    last_key = None
+    if page.height > 0:
+        last_key = tuple(
+            page.row(-1, named=True)[col] for col, _ in page_keys(sort_keys)
+        )
+    page = page.drop("__in_page", "__rowid")
+    return page, total, total_unique, last_key
+
+
+def export_sql(
+    where_sql: str,
+    params: tuple | list,
+    sort_keys: list[tuple],
+    columns: list[str] | None = None,
+) -> tuple[str, list]:
+    """Requête de toutes les lignes filtrées de decp, dans l'ordre du tableau.
+
+    Seules les `columns` demandées sont lues (toutes par défaut). L'ordre est
+    celui de page_sql (mêmes clés de départage), pour que le fichier exporté
+    contienne les lignes affichées à l'écran, dans le même ordre.
+    """
+    keys = page_keys(sort_keys)
+    order_by = keys_to_order_by(keys[:-1]) + ", rowid ASC"
+    cols = ", ".join(f'"{col}"' for col in columns) if columns else "*"
+    return (
+        f"SELECT {cols} FROM decp WHERE {where_sql} ORDER BY {order_by}",
+        list(params),
+    )
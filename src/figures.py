@@ -13,6 +13,8 @@ from dash import dash_table, dcc, html
 from dash_extensions.javascript import Namespace
 
 from src.db import schema
+from src.utils.artifacts import artifact_path
+from src.utils.cache import cache
 from src.utils.data import DATA_SCHEMA, DEPARTEMENTS_GEOJSON
 from src.utils.table import add_links, format_number, setup_table_columns
 
@@ -56,17 +58,14 @@ def get_yearly_statistics(statistics, today_str) -> html.Div:
     return html.Div(children=table, className="marches_table")
 
 
-def get_barchart_sources(lff: pl.LazyFrame, type_date: str):
-    labels = {
-        "dateNotification": "notification",
-        "datePublicationDonnees": "publication des données",
-    }
+def get_barchart_sources(dff_counts: pl.DataFrame):
+    """Histogramme du nombre de marchés par mois de notification et source.
 
+    `dff_counts` a les colonnes mois, sourceDataset et nb_marches.
+    """
     now_year = datetime.now().year
 
-    lff = lff.select("uid", type_date, "sourceDataset")
-
-    lff = lff.unique("uid")
+    lff = dff_counts.lazy()
 
     # Rassemblement des datasets Atexo pour ne pas surcharger le graphique
     lff = lff.with_columns(
@@ -84,15 +83,15 @@ def get_barchart_sources(lff: pl.LazyFrame, type_date: str):
         .alias("sourceDataset")
     )
 
-    lff = lff.with_columns(pl.col(type_date).dt.year().alias("annee"))
+    lff = lff.with_columns(pl.col("mois").dt.year().alias("annee"))
     lff = lff.filter(
-        pl.col(type_date).is_not_null() & pl.col("annee").is_between(2019, now_year)
+        pl.col("mois").is_not_null() & pl.col("annee").is_between(2019, now_year)
     )
-    lff = lff.with_columns(pl.col(type_date).cast(pl.String).str.head(7))
+    lff = lff.with_columns(pl.col("mois").cast(pl.String).str.head(7))
     lff = (
-        lff.group_by([type_date, "sourceDataset"])
-        .len()
-        .sort(by=[type_date, "len"], descending=True)
+        lff.group_by(["mois", "sourceDataset"])
+        .agg(pl.col("nb_marches").sum().alias("len"))
+        .sort(by=["mois", "len"], descending=True)
     )
 
     lff = lff.sort(by=["sourceDataset"], descending=False)
@@ -101,12 +100,12 @@ def get_barchart_sources(lff: pl.LazyFrame, type_date: str):
 
     fig = px.bar(
         dff,
-        x=type_date,
+        x="mois",
         y="len",
         color="sourceDataset",
         labels={
             "len": "Nombre de marchés",
-            type_date: f"Mois de {labels[type_date]}",
+            "mois": "Mois de notification",
             "sourceDataset": "Source de données",
         },
     )
@@ -116,10 +115,11 @@ def get_barchart_sources(lff: pl.LazyFrame, type_date: str):
     return graph
 
 
-def get_sources_tables(source_path) -> html.Div:
+def get_sources_tables() -> html.Div:
+    """Statistiques des sources, lues dans leur copie locale (voir src.utils.artifacts)."""
     try:
-        dff = pl.read_csv(source_path)
-    except (URLError, HTTPError):
+        dff = pl.read_csv(artifact_path("sources"))
+    except (URLError, HTTPError, OSError):
         return html.Div("Erreur de connexion")
     dff = dff.with_columns(
         (
@@ -304,13 +304,21 @@ class DataTable(dash_table.DataTable):
 
 
 def get_duplicate_matrix() -> dcc.Graph:
+    """Matrice des doublons entre sources, à partir de sa copie locale.
+
+    La figure est construite une fois par version du fichier (voir
+    src.utils.artifacts) et partagée par les workers via le cache.
+    """
+    return _duplicate_matrix_graph(str(artifact_path("duplicate_matrix")))
+
+
+@cache.memoize()
+def _duplicate_matrix_graph(path: str) -> dcc.Graph:
     """
     Fonction développée avec l'aide de la LLM Euria d'Infomaniak.
     :return:
     """
-    lff = pl.scan_parquet(
-        "https://www.data.gouv.fr/api/1/datasets/r/a545bf6c-8b24-46ed-b49f-a32bf02eaffa"
-    ).sort("sourceDataset")
+    lff = pl.scan_parquet(path).sort("sourceDataset")
     lff = lff.select(
         ["sourceDataset", "unique"] + sorted(lff.collect_schema().names()[2:])
     )
@@ -360,137 +368,74 @@ def get_duplicate_matrix() -> dcc.Graph:
     return dcc.Graph(figure=fig)
 
 
-def get_geographic_maps(dff: pl.DataFrame) -> list[dbc.Col] | list:
+# Régions des cartes de l'observatoire : l'Hexagone et les départements d'outre-mer
+MAP_REGIONS: dict = {
+    "Hexagone": {
+        "coordinates": [46.6, 2.2],
+        "zoom_leaflet": 5,
+        "zoom_chloropleth": 1,
+        "name": "Hexagone",
+    },
+    "971": {
+        "coordinates": [16.23, -61.55],
+        "zoom_leaflet": 9,
+        "zoom_chloropleth": 1,
+        "name": "Guadeloupe",
+    },
+    "972": {
+        "coordinates": [14.64, -61.02],
+        "zoom_leaflet": 10,
+        "zoom_chloropleth": 1,
+        "name": "Martinique",
+    },
+    "973": {
+        "coordinates": [3.93, -53.12],
+        "zoom_leaflet": 7,
+        "zoom_chloropleth": 1,
+        "name": "Guyane",
+    },
+    "974": {
+        "coordinates": [-21.11, 55.53],
+        "zoom_leaflet": 9,
+        "zoom_chloropleth": 1,
+        "name": "La Réunion",
+    },
+    "976": {
+        "coordinates": [-12.82, 45.16],
+        "zoom_leaflet": 10,
+        "zoom_chloropleth": 1,
+        "name": "Mayotte",
+    },
+}
+
+# Couleurs accessibles (Okabe-Ito)
+MARKER_COLORS = {
+    "acheteur": "#E69F00",  # orange
+    "titulaire": "#56B4E9",  # bleu ciel
+}
+
+
+def get_geographic_maps(maps_data: dict) -> list[dbc.Col] | list:
     """
     Génère les cartes géographiques pour l'hexagone et les DOM-TOM.
-    """
-
-    regions: dict = {
-        "Hexagone": {
-            "coordinates": [46.6, 2.2],
-            "zoom_leaflet": 5,
-            "zoom_chloropleth": 1,
-            "name": "Hexagone",
-        },
-        "971": {
-            "coordinates": [16.23, -61.55],
-            "zoom_leaflet": 9,
-            "zoom_chloropleth": 1,
-            "name": "Guadeloupe",
-        },
-        "972": {
-            "coordinates": [14.64, -61.02],
-            "zoom_leaflet": 10,
-            "zoom_chloropleth": 1,
-            "name": "Martinique",
-        },
-        "973": {
-            "coordinates": [3.93, -53.12],
-            "zoom_leaflet": 7,
-            "zoom_chloropleth": 1,
-            "name": "Guyane",
-        },
-        "974": {
-            "coordinates": [-21.11, 55.53],
-            "zoom_leaflet": 9,
-            "zoom_chloropleth": 1,
-            "name": "La Réunion",
-        },
-        "976": {
-            "coordinates": [-12.82, 45.16],
-            "zoom_leaflet": 10,
-            "zoom_chloropleth": 1,
-            "name": "Mayotte",
-        },
-    }
-
-    def make_map_data(region_code: str) -> tuple[list, str | None]:
-        lff: pl.LazyFrame = dff.lazy()
-        if region_code == "Hexagone":
-            lff = lff.filter(
-                (pl.col("acheteur_departement_code").str.len_chars() == 2)
-                & (pl.col("titulaire_departement_code").str.len_chars() == 2)
-            )
-        else:
-            lff = lff.filter(
-                (pl.col("acheteur_departement_code") == code)
-                | (pl.col("titulaire_departement_code") == code)
-            )
-
-        nb_marches = lff.select("uid").collect()["uid"].n_unique()
-
-        if nb_marches == 0:
-            return [], None
-
-        dfs = []
-
-        if (code == "Hexagone" and nb_marches > 30000) or (
-            code != "Hexagone" and nb_marches > 10000
-        ):
-            _map_type: str = "chloropleth"
-
-            lff = lff.rename({"acheteur_departement_code": "Département"})
-            lff = (
-                lff.select(["uid", "Département"])
-                .drop_nulls()
-                .group_by("uid")
-                .agg(pl.col("Département").first())
-                .group_by("Département")
-                .len("uid")
-            )
-            dfs.append(lff.collect())
-        else:
-            _map_type: str = "clusters"
-            for org_type in ["acheteur", "titulaire"]:
-                lff_org = (
-                    lff.select(
-                        "uid",
-                        f"{org_type}_longitude",
-                        f"{org_type}_latitude",
-                        f"{org_type}_nom",
-                    )
-                    .group_by(
-                        f"{org_type}_longitude",
-                        f"{org_type}_latitude",
-                        f"{org_type}_nom",
-                    )
-                    .len("nb_marches")
-                    .filter(
-                        pl.col(f"{org_type}_latitude").is_not_null()
-                        & pl.col(f"{org_type}_longitude").is_not_null()
-                    )
-                )
-
-                markers = []
-
-                # Couleurs accessibles (Okabe-Ito)
-                colors = {
-                    "acheteur": "#E69F00",  # orange
-                    "titulaire": "#56B4E9",  # bleu ciel
-                }
-
-                for row in lff_org.collect().to_dicts():
-                    markers.append(
-                        {
-                            "lat": row[f"{org_type}_latitude"],
-                            "lon": row[f"{org_type}_longitude"],
-                            "tooltip": f"{row[f'{org_type}_nom']} ({row['nb_marches']} marchés)",
-                            "marker_color": colors[org_type],
-                        }
-                    )
-                dfs.append(markers)
 
-        return dfs, _map_type
+    `maps_data` associe à chaque code de MAP_REGIONS ses données et son type de
+    carte (voir src.utils.dashboard.get_maps_data).
+    """
 
     cols = []
 
-    for code in regions.keys():
-        regions[code]["data"], map_type = make_map_data(code)
+    for code, region in MAP_REGIONS.items():
+        dfs, map_type = maps_data.get(code, ([], None))
 
         if map_type == "chloropleth":
-            map_graph = make_chloropleth_map(regions[code])
+            map_graph = make_chloropleth_map({**region, "data": dfs})
         elif map_type == "clusters":
-            map_graph = make_clusters_map(regions[code])
+            markers = [
+                make_markers(dff, org_type)
+                for dff, org_type in zip(dfs, ["acheteur", "titulaire"], strict=True)
+            ]
+            map_graph = make_clusters_map({**region, "data": markers})
         elif map_type is None:
             continue
         else:
@@ -498,12 +443,27 @@ def get_geographic_maps(dff: pl.DataFrame) -> list[dbc.Col] | list:
 
         lg, xl = (12, 8) if code == "Hexagone" else (6, 4)
 
-        col = make_card(regions[code]["name"], fig=map_graph, lg=lg, xl=xl)
+        col = make_card(region["name"], fig=map_graph, lg=lg, xl=xl)
         cols.append(col)
 
     return cols
 
 
+def make_markers(dff: pl.DataFrame, org_type: str) -> list[dict]:
+    """Points d'une carte : une organisation (longitude, latitude, nom) par ligne."""
+    markers = []
+    for row in dff.to_dicts():
+        markers.append(
+            {
+                "lat": row[f"{org_type}_latitude"],
+                "lon": row[f"{org_type}_longitude"],
+                "tooltip": f"{row[f'{org_type}_nom']} ({row['nb_marches']} marchés)",
+                "marker_color": MARKER_COLORS[org_type],
+            }
+        )
+    return markers
+
+
 def make_chloropleth_map(region: dict) -> dcc.Graph:
     df_map = region["data"][0]
 
@@ -545,8 +505,8 @@ def make_clusters_map(region: dict) -> dl.Map:
     region_titulaires = region["data"][1]
 
     # Couleurs
-    color_acheteur = region_acheteurs[0]["marker_color"]
-    color_titulaire = region_titulaires[0]["marker_color"]
+    color_acheteur = MARKER_COLORS["acheteur"]
+    color_titulaire = MARKER_COLORS["titulaire"]
 
     acheteurs_geojson_data = dlx.dicts_to_geojson(region_acheteurs)
     titulaires_geojson_data = dlx.dicts_to_geojson(region_titulaires)
@@ -586,21 +546,23 @@ def make_clusters_map(region: dict) -> dl.Map:
     return leaflet_map
 
 
-def get_distance_histogram(lff: pl.LazyFrame) -> dcc.Graph:
-    if "titulaire_distance" not in lff.collect_schema().names():
-        dff = pl.DataFrame({"titulaire_distance": pl.Series([], dtype=pl.Float64)})
-    else:
-        dff = (
-            lff.select("titulaire_distance")
-            .drop_nulls()
-            .filter(pl.col("titulaire_distance") > 0)
-            .collect(engine="streaming")
-        )
-    log_distances = dff["titulaire_distance"].log(10).to_numpy()
+def get_distance_histogram_from_stats(stats: dict) -> dcc.Graph:
+    """Histogramme pré-calculé d'une ligne de acheteur_stats ou titulaire_stats."""
+    counts = stats.get("distance_bins")
+    if not counts:
+        return make_distance_histogram([], [])
+    log_min, log_max = stats["distance_log_min"], stats["distance_log_max"]
+    if log_min == log_max:
+        log_min, log_max = log_min - 0.5, log_max + 0.5
+    return make_distance_histogram(
+        np.array(counts), np.linspace(log_min, log_max, len(counts) + 1)
+    )
 
+
+def make_distance_histogram(counts, bin_edges) -> dcc.Graph:
+    """`counts` marchés par intervalle de log10(distance), bornés par `bin_edges`."""
     fig = go.Figure()
-    if len(log_distances) > 0:
-        counts, bin_edges = np.histogram(log_distances, bins=25)
+    if len(counts) > 0:
         bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
         bin_widths = bin_edges[1:] - bin_edges[:-1]
         bin_edges_km = 10.0**bin_edges
@@ -642,11 +604,11 @@ def get_distance_histogram(lff: pl.LazyFrame) -> dcc.Graph:
     return dcc.Graph(figure=fig)
 
 
-def get_dashboard_summary_table(dff, dff_per_uid, nb_marches):
-    nb_acheteurs = dff.select("acheteur_id").n_unique()
-    nb_titulaires = dff.select("titulaire_id", "titulaire_typeIdentifiant").n_unique()
-    total_montant = int(dff_per_uid.select(pl.col("montant").sum()).item())
-    median_distance = dff.select(pl.median("titulaire_distance")).item()
+def get_dashboard_summary_table(summary: dict, nb_marches, total_montant):
+    """Carte Résumé, `summary` venant de src.utils.dashboard.get_summary."""
+    nb_acheteurs = summary["nb_acheteurs"]
+    nb_titulaires = summary["nb_titulaires"]
+    median_distance = summary["distance_mediane"]
 
     summary_table = [
         html.P(["Nombre de marchés : ", html.Strong(str(format_number(nb_marches)))]),
@@ -671,7 +633,7 @@ def get_dashboard_summary_table(dff, dff_per_uid, nb_marches):
                     style={"cursor": "pointer", "textDecoration": "underline dotted"},
                 ),
                 ") : ",
-                html.Strong(format_number(total_montant) + " €"),
+                html.Strong(format_number(int(total_montant)) + " €"),
             ]
         ),
         html.P(
@@ -710,23 +672,33 @@ def make_card(
     return card
 
 
+def make_error_card(title: str, lg=6, xl=4) -> dbc.Col:
+    """Carte affichée à la place d'une carte dont le calcul a échoué."""
+    return make_card(
+        title=title,
+        paragraphs=[
+            html.P(
+                "Cette carte n'a pas pu être calculée. "
+                "Réessayez dans quelques instants ou affinez les filtres.",
+                style={"color": "#b00020"},
+            )
+        ],
+        lg=lg,
+        xl=xl,
+    )
+
+
 def make_donut(
-    lff: pl.LazyFrame,
+    dff_counts: pl.DataFrame,
     names_col,
-    per_uid: bool,
     nulls="?",
     potentially_many_names: bool = False,
 ):
+    """Donut des effectifs `dff_counts` (colonnes names_col et "Nombre")."""
     title = DATA_SCHEMA[names_col]["title"]
-    lff = lff.rename({names_col: title})
-    lff = lff.select("uid", title)
-
-    if per_uid:
-        lff = lff.group_by("uid").first()
-
-    lff = lff.group_by(title).len("Nombre")
-    lff = lff.with_columns(pl.col(title).replace(None, pl.lit(nulls)))
-    dff = lff.collect(engine="streaming")
+    dff = dff_counts.select(
+        pl.col(names_col).replace(None, pl.lit(nulls)).alias(title), "Nombre"
+    )
     nb_names = dff[title].n_unique()
 
     sum_values = dff["Nombre"].sum()
@@ -815,29 +787,22 @@ def make_column_picker(page: str):
     return table
 
 
-def get_top_org_table(data, org_type: str, extra_columns: list, filters: bool = True):
-    if isinstance(data, pl.LazyFrame):
-        lff = data
-    else:
-        lff = pl.LazyFrame(data, strict=False, infer_schema_length=5000)
-
-    if org_type == "titulaire":
-        extra_columns.append("titulaire_typeIdentifiant")
-    columns = ["uid", f"{org_type}_id", f"{org_type}_nom"] + extra_columns
-
-    lff = lff.select(columns)
-    lff = lff.group_by([f"{org_type}_id", f"{org_type}_nom"] + extra_columns).agg(
-        pl.len().alias("Attributions")
-    )
-    lff = lff.sort(by="Attributions", descending=True, nulls_last=True)
-    lff = lff.cast(pl.String)
-    lff = lff.fill_null("")
-
-    dff: pl.DataFrame = lff.collect(engine="streaming")
+def make_top_org_table(dff: pl.DataFrame, org_type: str, filters: bool = True):
+    """Tableau des organisations `org_type` par nombre d'attributions.
 
+    `dff` a une ligne par organisation avec sa colonne Attributions (voir
+    src.utils.dashboard.get_top_orgs, ou top_partenaires dans acheteur_stats et
+    titulaire_stats).
+    """
     if dff.height == 0:
         return html.Div()
 
+    dff = (
+        dff.sort(by="Attributions", descending=True, nulls_last=True)
+        .cast(pl.String)
+        .fill_null("")
+    )
+
     columns, tooltip = setup_table_columns(
         dff, hideable=False, exclude=[f"{org_type}_id"]
     )
@@ -1,5 +1,3 @@
-import os
-
 from dash import dcc, html, register_page
 
 from src.figures import get_sources_tables
@@ -97,7 +95,7 @@ Quant à l'exhaustivité, je consolide toutes les sources de données exploitabl
 Au milieu de ces mauvaises nouvelles, je tiens à souligner la belle continuité de la publication par la DGFiP des données des marchés publics remontées via le [protocole PES](https://www.collectivites-locales.gouv.fr/finances-locales/le-protocole-dechange-standard-pes). Merci à leurs équipes."""
                         ),
                         html.H4("Sources de données ", id="sources"),
-                        get_sources_tables(os.getenv("SOURCE_STATS_CSV_PATH")),
+                        get_sources_tables(),
                         html.H4("Mentions légales", id="mentions-legales"),
                         html.H5("Publication", id="publication"),
                         dcc.Markdown(
@@ -1,9 +1,9 @@
 import datetime
-from typing import Any
 
 import dash_bootstrap_components as dbc
 import polars as pl
 from dash import (
+    ALL,
     ClientsideFunction,
     Input,
     Output,
@@ -12,35 +12,50 @@ from dash import (
     clientside_callback,
     dcc,
     html,
+    no_update,
     register_page,
 )
 
-from src.db import query_marches, schema
+from src.db import schema
 from src.figures import (
     DataTable,
-    get_distance_histogram,
-    get_top_org_table,
+    get_distance_histogram_from_stats,
     make_card,
     make_column_picker,
+    make_top_org_table,
     point_on_map,
 )
-from src.utils.data import DF_ACHETEURS, get_annuaire_data, get_departement_region
-from src.utils.frontend import get_button_properties
+from src.utils.annuaire import get_annuaire_data
+from src.utils.data import (
+    get_departement_region,
+    get_org_frame,
+    get_org_marches,
+    get_org_stats,
+    org_data_handle,
+    org_marches_where,
+)
+from src.utils.frontend import (
+    get_button_properties,
+    make_export_buttons,
+    requested_export_format,
+    start_export,
+)
 from src.utils.seo import META_CONTENT
 from src.utils.table import (
     COLUMNS,
-    filter_table_data,
     format_number,
     get_default_hidden_columns,
     prepare_table_data,
-    sort_table_data,
+    table_export_sql,
 )
 from src.utils.tracking import track_search
 
 
 def get_title(acheteur_id: str | None = None) -> str:
-    acheteur_nom = DF_ACHETEURS.filter(pl.col("acheteur_id") == acheteur_id).select(
-        "acheteur_nom"
+    acheteur_nom = (
+        get_org_frame("acheteur")
+        .filter(pl.col("acheteur_id") == acheteur_id)
+        .select("acheteur_nom")
     )
     if acheteur_nom.height > 0:
         return f"Marchés publics attribués par {acheteur_nom.item(0, 0)} | decp.info"
@@ -190,12 +205,12 @@ layout = [
                             ),
                             html.P("lignes", id="acheteur_nb_rows"),
                             html.Button(
-                                "Téléchargement désactivé au-delà de 65 000 lignes",
+                                "Excel désactivé au-delà de 65 000 lignes",
                                 id="btn-download-filtered-data-acheteur",
                                 className="btn btn-primary",
                                 disabled=True,
                             ),
-                            dcc.Download(id="acheteur-download-filtered-data"),
+                            *make_export_buttons("acheteur"),
                             dbc.Button(
                                 "Remise à zéro",
                                 title="Supprime tous les filtres et les tris. Autrement ils sont conservés même si vous fermez la page.",
@@ -257,13 +272,20 @@ def update_acheteur_infos(url):
     if data_etablissement:
         data_etablissement = data_etablissement[0]
 
-        acheteur_map = point_on_map(
-            data_etablissement["latitude"], data_etablissement["longitude"]
-        )
-        code_departement, nom_departement, nom_region = get_departement_region(
-            data_etablissement["code_postal"]
-        )
-        departement = f"{nom_departement} ({code_departement})"
+        if data_etablissement.get("latitude") is not None:
+            acheteur_map = point_on_map(
+                data_etablissement["latitude"], data_etablissement["longitude"]
+            )
+        else:
+            acheteur_map = html.Div()
+        if data_etablissement.get("code_postal") is not None:
+            code_departement, nom_departement, nom_region = get_departement_region(
+                data_etablissement["code_postal"]
+            )
+            departement = f"{nom_departement} ({code_departement})"
+        else:
+            # Établissement de la table locale sans code postal (à l'étranger)
+            nom_region, departement = "", ""
         lien_annuaire = (
             f"https://annuaire-entreprises.data.gouv.fr/etablissement/{acheteur_siret}"
         )
@@ -297,22 +319,14 @@ def update_acheteur_infos(url):
     Input(component_id="acheteur_data", component_property="data"),
 )
 def update_acheteur_stats(data):
-    dff = pl.DataFrame(data, strict=False, infer_schema_length=5000)
-    if dff.height == 0:
-        dff = pl.DataFrame(schema=schema)
-    df_marches = dff.unique("id")
-    nb_marches = format_number(df_marches.height)
-    # somme_marches = format_number(int(df_marches.select(pl.sum("montant")).item()))
+    stats = get_org_stats(**data)
+    nb_marches = format_number(stats["nb_marches"])
     marches_attribues = [html.Strong(nb_marches), " marchés et accord-cadres attribués"]
-    # + ", pour un total de ", html.Strong(somme_marches + " €")]
-    del df_marches
 
-    nb_titulaires = dff.unique("titulaire_id").height
     nb_titulaires = [
-        html.Strong(format_number(nb_titulaires)),
+        html.Strong(format_number(stats["nb_partenaires"])),
         " titulaires (SIRET) différents",
     ]
-    del dff
 
     return marches_attribues, nb_titulaires
 
@@ -326,16 +340,12 @@ def update_acheteur_stats(data):
     Input(component_id="acheteur_year", component_property="value"),
 )
 def get_acheteur_marches_data(url, ach_year: str) -> tuple:
-    acheteur_siret = url.split("/")[-1]
-    lff = query_marches("acheteur_id = ?", (acheteur_siret,)).lazy()
-    if ach_year and ach_year != "Toutes les années":
-        ach_year = int(ach_year)
-        lff = lff.filter(pl.col("dateNotification").dt.year() == ach_year)
-    lff = lff.sort(["dateNotification", "uid"], descending=True, nulls_last=True)
-    dff: pl.DataFrame = lff.collect(engine="streaming")
-    download_disabled, download_text, download_title = get_button_properties(dff.height)
-    data = dff.to_dicts()
-    return data, download_disabled, download_text, download_title
+    # Seule la référence aux marchés est envoyée au navigateur, le tableau est
+    # lu page par page dans DuckDB (voir org_marches_where)
+    handle = org_data_handle("acheteur", url.split("/")[-1], ach_year)
+    nb_rows = get_org_stats(**handle)["nb_lignes"]
+    download_disabled, download_text, download_title = get_button_properties(nb_rows)
+    return handle, download_disabled, download_text, download_title
 
 
 @callback(
@@ -359,8 +369,18 @@ def get_acheteur_marches_data(url, ach_year: str) -> tuple:
 def get_last_marches_data(
     href, data, page_current, page_size, filter_query, sort_by, data_timestamp
 ) -> tuple:
+    # Filtre, tri et pagination dans DuckDB, comme la page Tableau
+    where_sql, params = org_marches_where(**data)
     return prepare_table_data(
-        data, data_timestamp, filter_query, page_current, page_size, sort_by, "acheteur"
+        None,
+        data_timestamp,
+        filter_query,
+        page_current,
+        page_size,
+        sort_by,
+        "acheteur",
+        where_sql=where_sql,
+        params=tuple(params),
     )
 
 
@@ -369,7 +389,9 @@ def get_last_marches_data(
     Input(component_id="acheteur_data", component_property="data"),
 )
 def get_top_titulaires(data):
-    table = get_top_org_table(data, "titulaire", ["titulaire_distance"])
+    table = make_top_org_table(
+        pl.DataFrame(get_org_stats(**data)["top_partenaires"]), "titulaire"
+    )
     return make_card(fig=table, title="Top titulaires", lg=12, xl=12)
 
 
@@ -383,11 +405,11 @@ def get_top_titulaires(data):
 )
 def download_acheteur_data(
     n_clicks,
-    data: list[dict[str, Any]],
+    data: dict,
     acheteur_nom: str,
     annee: str,
 ):
-    df_to_download = pl.DataFrame(data)
+    df_to_download = get_org_marches(**data)
 
     def to_bytes(buffer):
         df_to_download.write_excel(
@@ -399,9 +421,11 @@ def download_acheteur_data(
 
 
 @callback(
-    Output("acheteur-download-filtered-data", "data"),
-    State("acheteur_data", "data"),
+    Output({"type": "export-job", "page": "acheteur"}, "data"),
     Input("btn-download-filtered-data-acheteur", "n_clicks"),
+    Input({"type": "btn-export", "page": "acheteur", "format": ALL}, "n_clicks"),
+    State("acheteur_url", "pathname"),
+    State("acheteur_year", "value"),
     State("acheteur_nom", "children"),
     State("acheteur_datatable", "filter_query"),
     State("acheteur_datatable", "sort_by"),
@@ -409,35 +433,30 @@ def download_acheteur_data(
     prevent_initial_call=True,
 )
 def download_filtered_acheteur_data(
-    data,
     n_clicks,
+    n_clicks_export,
+    url,
+    annee,
     acheteur_nom,
     filter_query,
     sort_by,
     hidden_columns: list | None = None,
 ):
-    lff: pl.LazyFrame = pl.LazyFrame(
-        data
-    )  # start from the full acheteur data, not from paginated table data
-
-    # Les colonnes masquées sont supprimées
-    if hidden_columns:
-        lff = lff.drop(hidden_columns)
-
+    fmt = requested_export_format("btn-download-filtered-data-acheteur")
+    if fmt is None:
+        return no_update
     if filter_query:
         track_search(filter_query, "ach download")
-        lff = filter_table_data(lff, filter_query)
-
-    if len(sort_by) > 0:
-        lff = sort_table_data(lff, sort_by)
-
-    def to_bytes(buffer):
-        lff.collect(engine="streaming").write_excel(buffer, worksheet="DECP")
 
-    date = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
-    return dcc.send_bytes(
-        to_bytes, filename=f"decp_filtrées_{acheteur_nom}_{date}.xlsx"
+    # Mêmes lignes que acheteur_data, filtrées et triées comme le tableau
+    where_sql, params = org_marches_where(
+        **org_data_handle("acheteur", url.split("/")[-1], annee)
+    )
+    sql, params = table_export_sql(
+        filter_query, sort_by, hidden_columns, where_sql, params
     )
+    date = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+    return start_export(sql, params, fmt, f"decp_filtrées_{acheteur_nom}_{date}")
 
 
 # Pour nettoyer les icontains et i< des filtres
@@ -520,8 +539,7 @@ def reset_view(n_clicks):
     Input("acheteur_data", "data"),
 )
 def update_acheteur_distance_histogram(data):
-    lff = pl.LazyFrame(data, strict=False, infer_schema_length=5000)
-    fig = get_distance_histogram(lff)
+    fig = get_distance_histogram_from_stats(get_org_stats(**data))
     return make_card(
         title="Distance acheteur–titulaire",
         subtitle="en nombre de marchés, échelle logarithmique",
@@ -2,17 +2,17 @@ import polars as pl
 from dash import Input, Output, callback, dcc, html, register_page
 
 from src.db import get_cursor
-from src.utils.data import DF_ACHETEURS, DF_TITULAIRES
+from src.utils.data import get_org_frame
 
 NAME = "Liste des marchés publics"
 
 
 def make_org_nom_verbe(org_type, org_id) -> tuple:
     if org_type == "titulaire":
-        df = DF_TITULAIRES
+        df = get_org_frame("titulaire")
         verbe = "remportés"
     elif org_type == "acheteur":
-        df = DF_ACHETEURS
+        df = get_org_frame("acheteur")
         verbe = "attribués"
     else:
         raise ValueError
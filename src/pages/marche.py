@@ -5,7 +5,7 @@ import dash_bootstrap_components as dbc
 from dash import Input, Output, callback, dcc, html, register_page
 from polars import selectors as cs
 
-from src.db import query_marches
+from src.db import query_marche_titulaires, query_unique_marches
 from src.utils.data import DATA_SCHEMA
 from src.utils.seo import META_CONTENT, make_org_jsonld
 from src.utils.table import format_values, unformat_montant
@@ -84,16 +84,16 @@ def get_marche_data(url) -> tuple[dict, list]:
     marche_uid = url.split("/")[-1]
 
     # Filtre SQL côté DuckDB, puis Polars pour le post-traitement
-    dff_marche = query_marches("uid = ?", (marche_uid,))
+    dff_marche = query_unique_marches("uid = ?", (marche_uid,))
     if dff_marche.height == 0:
         return {}, []
 
-    lff = dff_marche.lazy()
-    dff_titulaires = lff.select(cs.starts_with("titulaire")).collect(engine="streaming")
-    dff_marche_unique = lff.unique("uid").collect(engine="streaming")
-    dff_marche_unique = format_values(dff_marche_unique)
+    dff_titulaires = query_marche_titulaires(marche_uid).select(
+        cs.starts_with("titulaire")
+    )
+    dff_marche = format_values(dff_marche)
 
-    return dff_marche_unique.to_dicts()[0], dff_titulaires.to_dicts()
+    return dff_marche.to_dicts()[0], dff_titulaires.to_dicts()
 
 
 @callback(
@@ -1,5 +1,6 @@
 import urllib.parse
 from datetime import datetime
+from functools import partial
 
 import dash_bootstrap_components as dbc
 import polars as pl
@@ -16,30 +17,48 @@ from dash import (
     register_page,
 )
 
-from src.db import schema
+from src.db import get_generation, schema
 from src.figures import (
+    MAP_REGIONS,
     DataTable,
     get_barchart_sources,
     get_dashboard_summary_table,
-    get_distance_histogram,
+    get_distance_histogram_from_stats,
     get_duplicate_matrix,
     get_geographic_maps,
-    get_top_org_table,
     make_card,
     make_column_picker,
     make_donut,
+    make_error_card,
+    make_top_org_table,
 )
 from src.utils import logger
-from src.utils.cache import cache
+from src.utils.cache import cache, per_generation
+from src.utils.cube import query_cube
+from src.utils.dashboard import (
+    get_dashboard_stats,
+    get_maps_data,
+    run_cards,
+)
 from src.utils.data import (
     DEPARTEMENTS,
-    DF_ACHETEURS,
-    DF_TITULAIRES,
+    get_org_frame,
     prepare_dashboard_data,
 )
-from src.utils.frontend import get_enum_values_as_dict
+from src.utils.frontend import (
+    get_enum_values_as_dict,
+    make_export_buttons,
+    requested_export_format,
+    start_export,
+)
 from src.utils.seo import META_CONTENT
-from src.utils.table import COLUMNS, get_default_hidden_columns, prepare_table_data
+from src.utils.table import (
+    COLUMNS,
+    get_default_hidden_columns,
+    prepare_table_data,
+    table_export_sql,
+)
+from src.utils.table_sql import dashboard_filters_to_sql
 
 NAME = "Observatoire"
 
@@ -89,6 +108,210 @@ OBSERVATOIRE_COLUMNS = [
     ]
 ]
 
+
+def marches_counts(filter_params: dict, column: str, cursor=None) -> pl.DataFrame:
+    return query_cube("cube_marches", filter_params, [column], cursor).select(
+        column, pl.col("nb_marches").alias("Nombre")
+    )
+
+
+def dashboard_stats(filter_params: dict, cursor) -> dict:
+    """Agrégats des cartes Résumé, distances et tops (get_dashboard_stats),
+    gardés en cache par filtres et génération : ces quatre cartes partagent
+    une seule lecture de decp, y compris d'un worker à l'autre."""
+    key = (
+        f"dashboard_stats@{get_generation().name}:"
+        f"{_normalize_filter_params(filter_params)!r}"
+    )
+    stats = cache.get(key)
+    if stats is None:
+        stats = get_dashboard_stats(filter_params, cursor)
+        cache.set(key, stats)
+    return stats
+
+
+def summary_card(filter_params: dict, cursor) -> list[dbc.Col]:
+    # Comptes de marchés et montants lus dans les cubes (src.utils.cube)
+    totals = query_cube("cube_marches", filter_params, cursor=cursor)
+    nb_marches = totals["nb_marches"].item() or 0
+    total_montant = totals["montant"].item() or 0
+
+    card_summary_table = get_dashboard_summary_table(
+        dashboard_stats(filter_params, cursor)["summary"], nb_marches, total_montant
+    )
+    return [make_card(title="Résumé", paragraphs=card_summary_table)]
+
+
+def acheteur_categorie_card(filter_params: dict, cursor) -> list[dbc.Col]:
+    donut_acheteur_categorie, nb_acheteur_categories = make_donut(
+        marches_counts(filter_params, "acheteur_categorie", cursor),
+        "acheteur_categorie",
+        nulls="Autres",
+        potentially_many_names=True,
+    )
+    return [
+        make_card(
+            title="Catégorie d'acheteur",
+            subtitle="en nombre de marchés attribués",
+            fig=donut_acheteur_categorie,
+            lg=12 if nb_acheteur_categories > 4 else 6,
+            xl=8 if nb_acheteur_categories > 4 else 4,
+        )
+    ]
+
+
+def titulaire_categorie_card(filter_params: dict, cursor) -> list[dbc.Col]:
+    titulaire_counts = query_cube(
+        "cube_titulaires", filter_params, ["titulaire_categorie"], cursor
+    ).rename({"nb_lignes": "Nombre"})
+    donut_titulaire_categorie = make_donut(
+        titulaire_counts, "titulaire_categorie", nulls="?"
+    )
+    return [
+        make_card(
+            title="Catégorie d'entreprise",
+            subtitle="en nombre de titulaires",
+            fig=donut_titulaire_categorie,
+        )
+    ]
+
+
+def marche_type_card(filter_params: dict, cursor) -> list[dbc.Col]:
+    donut_marche_type = make_donut(
+        marches_counts(filter_params, "type", cursor), "type", nulls="?"
+    )
+    return [
+        make_card(
+            title="Type d'achat",
+            subtitle="en nombre de marchés attribués",
+            fig=donut_marche_type,
+        )
+    ]
+
+
+def distance_card(filter_params: dict, cursor) -> list[dbc.Col]:
+    distance_histogram = get_distance_histogram_from_stats(
+        dashboard_stats(filter_params, cursor)["distance_histogram"]
+    )
+    return [
+        make_card(
+            title="Distance acheteur–titulaire",
+            subtitle="en nombre de marchés, échelle logarithmique",
+            fig=distance_histogram,
+        )
+    ]
+
+
+def top_acheteurs_card(filter_params: dict, cursor) -> list[dbc.Col]:
+    top_acheteurs = make_top_org_table(
+        dashboard_stats(filter_params, cursor)["top_acheteurs"],
+        "acheteur",
+        filters=False,
+    )
+    return [make_card(title="Top acheteurs", fig=top_acheteurs, lg=12, xl=8)]
+
+
+def top_titulaires_card(filter_params: dict, cursor) -> list[dbc.Col]:
+    top_titulaires = make_top_org_table(
+        dashboard_stats(filter_params, cursor)["top_titulaires"],
+        "titulaire",
+        filters=False,
+    )
+    return [make_card(title="Top titulaires", fig=top_titulaires, lg=12, xl=8)]
+
+
+def maps_cards(filter_params: dict, cursor) -> list[dbc.Col]:
+    return get_geographic_maps(get_maps_data(filter_params, list(MAP_REGIONS), cursor))
+
+
+def sources_card(filter_params: dict, cursor) -> list[dbc.Col]:
+    sources_barchart = get_barchart_sources(
+        query_cube("cube_marches", filter_params, ["mois", "sourceDataset"], cursor)
+    )
+    return [
+        make_card(
+            title="Sources de données",
+            subtitle="Nombre de marchés attribués par mois de notification et source de données",
+            fig=sources_barchart,
+            lg=12,
+            xl=8,
+        )
+    ]
+
+
+def duplicate_matrix_card(filter_params: dict, cursor) -> list[dbc.Col]:
+    duplicate_matrix = get_duplicate_matrix()
+    return [
+        make_card(
+            title="Matrice de doublons entre sources de données",
+            subtitle="Ce graphique illustre les doublons de marchés publics entre sources, c'est-à-dire la proportion de marchés publiés par plus d'une source.",
+            fig=duplicate_matrix,
+            lg=12,
+            xl=8,
+        )
+    ]
+
+
+# Cartes de l'observatoire, dans l'ordre d'affichage. Chaque carte a son
+# callback et son cache : compute (fonction des filtres et d'un curseur, voir
+# run_cards), titre et largeurs (lg 6, xl 4 par défaut) de ses cartes d'attente
+# et d'erreur, et si elle dépend des filtres.
+DASHBOARD_CARDS = {
+    "resume": {"compute": summary_card, "title": "Résumé"},
+    "acheteur_categorie": {
+        "compute": acheteur_categorie_card,
+        "title": "Catégorie d'acheteur",
+    },
+    "titulaire_categorie": {
+        "compute": titulaire_categorie_card,
+        "title": "Catégorie d'entreprise",
+    },
+    "marche_type": {"compute": marche_type_card, "title": "Type d'achat"},
+    "distance": {"compute": distance_card, "title": "Distance acheteur–titulaire"},
+    "top_acheteurs": {
+        "compute": top_acheteurs_card,
+        "title": "Top acheteurs",
+        "lg": 12,
+        "xl": 8,
+    },
+    "top_titulaires": {
+        "compute": top_titulaires_card,
+        "title": "Top titulaires",
+        "lg": 12,
+        "xl": 8,
+    },
+    "cartes": {"compute": maps_cards, "title": "Cartes", "lg": 12, "xl": 8},
+    "sources": {
+        "compute": sources_card,
+        "title": "Sources de données",
+        "lg": 12,
+        "xl": 8,
+    },
+    "doublons": {
+        "compute": duplicate_matrix_card,
+        "title": "Matrice de doublons entre sources de données",
+        "lg": 12,
+        "xl": 8,
+        "filters": False,
+    },
+}
+
+
+def card_slot(name: str) -> html.Div:
+    """Emplacement de la carte `name`, avec une carte d'attente."""
+    card = DASHBOARD_CARDS[name]
+    return html.Div(
+        id=f"card-{name}",
+        className="dashboard-card-slot",
+        children=make_card(
+            title=card["title"],
+            fig=dbc.Spinner(size="sm", color="secondary"),
+            lg=card.get("lg", 6),
+            xl=card.get("xl", 4),
+        ),
+    )
+
+
 layout = [
     dcc.Location(id="dashboard_url", refresh="callback-nav"),
     dcc.Store(id="observatoire-filters", storage_type="local"),
@@ -123,10 +346,9 @@ Alors, on fait comment ?
         className="container-fluid",
         children=[
             html.H2(children=[NAME], id="page_title"),
-            dcc.Loading(
-                overlay_style={"visibility": "visible", "filter": "blur(2px)"},
-                id="loading-statistques",
-                type="default",
+            # Pas d'indicateur de chargement global : chaque carte s'affiche
+            # dès qu'elle est calculée (voir .dashboard-card-slot dans style.css)
+            html.Div(
                 children=[
                     dbc.Row(
                         [
@@ -150,14 +372,21 @@ Alors, on fait comment ?
                                     html.H5("Acheteur"),
                                     dbc.Row(
                                         dbc.Col(
-                                            dcc.Input(
-                                                id="dashboard_acheteur_id",
-                                                placeholder="SIRET",
-                                                debounce=True,
-                                                style={"width": "100%"},
-                                                persistence=True,
-                                                persistence_type="local",
-                                            ),
+                                            [
+                                                dcc.Input(
+                                                    id="dashboard_acheteur_id",
+                                                    placeholder="SIRET",
+                                                    debounce=True,
+                                                    style={"width": "100%"},
+                                                    persistence=True,
+                                                    persistence_type="local",
+                                                    list="dashboard_acheteur_id_suggestions",
+                                                    autoComplete="off",
+                                                ),
+                                                html.Datalist(
+                                                    id="dashboard_acheteur_id_suggestions"
+                                                ),
+                                            ]
                                         ),
                                     ),
                                     dbc.Row(
@@ -189,14 +418,21 @@ Alors, on fait comment ?
                                     html.H5("Titulaire"),
                                     dbc.Row(
                                         dbc.Col(
-                                            dcc.Input(
-                                                id="dashboard_titulaire_id",
-                                                placeholder="SIRET",
-                                                debounce=True,
-                                                style={"width": "100%"},
-                                                persistence=True,
-                                                persistence_type="local",
-                                            ),
+                                            [
+                                                dcc.Input(
+                                                    id="dashboard_titulaire_id",
+                                                    placeholder="SIRET",
+                                                    debounce=True,
+                                                    style={"width": "100%"},
+                                                    persistence=True,
+                                                    persistence_type="local",
+                                                    list="dashboard_titulaire_id_suggestions",
+                                                    autoComplete="off",
+                                                ),
+                                                html.Datalist(
+                                                    id="dashboard_titulaire_id_suggestions"
+                                                ),
+                                            ]
                                         ),
                                     ),
                                     dbc.Row(
@@ -406,9 +642,6 @@ Alors, on fait comment ?
                                         [
                                             dbc.Col(
                                                 [
-                                                    dcc.Download(
-                                                        id="download-observatoire"
-                                                    ),
                                                     dbc.Button(
                                                         "Voir les données",
                                                         id="btn-observatoire-preview",
@@ -439,7 +672,9 @@ Alors, on fait comment ?
                                 lg=8,
                                 xl=9,
                                 id="cards",
-                                children=[],
+                                children=dbc.Row(
+                                    [card_slot(name) for name in DASHBOARD_CARDS]
+                                ),
                             ),
                         ]
                     )
@@ -475,6 +710,7 @@ Alors, on fait comment ?
                                     className="btn btn-primary",
                                     outline=True,
                                 ),
+                                *make_export_buttons("observatoire"),
                             ],
                         ),
                         width="auto",
@@ -666,145 +902,73 @@ def _normalize_filter_params(filter_params: dict) -> tuple:
     )
 
 
-@cache.memoize()
-def _compute_dashboard_children(filter_params_normalized: tuple):
-    logger.debug("Cache miss — computing dashboard")
+# Une carte en erreur n'est pas mise en cache
+@cache.memoize(make_name=per_generation, response_filter=lambda result: result[1])
+def _compute_card(name: str, filter_params_normalized: tuple) -> tuple[list, bool]:
+    """Carte `name` de DASHBOARD_CARDS, et False si son calcul a échoué."""
+    logger.debug(f"Cache miss — computing dashboard card {name}")
     filter_params = {
         k: (list(v) if isinstance(v, tuple) else v) for k, v in filter_params_normalized
     }
-
-    dff = prepare_dashboard_data(**filter_params)
-    lff = dff.lazy()
-
-    df_per_uid = (
-        dff.select("uid", "montant").group_by("uid").agg(pl.col("montant").first())
-    )
-    nb_marches = df_per_uid.height
-
-    cards = []
-    card_summary_table = get_dashboard_summary_table(dff, df_per_uid, nb_marches)
-    cards.append(make_card(title="Résumé", paragraphs=card_summary_table))
-
-    donut_acheteur_categorie, nb_acheteur_categories = make_donut(
-        lff,
-        "acheteur_categorie",
-        nulls="Autres",
-        per_uid=True,
-        potentially_many_names=True,
-    )
-    cards.append(
-        make_card(
-            title="Catégorie d'acheteur",
-            subtitle="en nombre de marchés attribués",
-            fig=donut_acheteur_categorie,
-            lg=12 if nb_acheteur_categories > 4 else 6,
-            xl=8 if nb_acheteur_categories > 4 else 4,
+    card = DASHBOARD_CARDS[name]
+    result = run_cards({name: partial(card["compute"], filter_params)})[name]
+    if isinstance(result, Exception):
+        error_card = make_error_card(
+            card["title"], lg=card.get("lg", 6), xl=card.get("xl", 4)
         )
-    )
+        return [error_card], False
+    return result, True
 
-    donut_titulaire_categorie = make_donut(
-        lff, "titulaire_categorie", per_uid=False, nulls="?"
-    )
-    cards.append(
-        make_card(
-            title="Catégorie d'entreprise",
-            subtitle="en nombre de titulaires",
-            fig=donut_titulaire_categorie,
-        )
-    )
 
-    donut_marche_type = make_donut(lff, "type", per_uid=True, nulls="?")
-    cards.append(
-        make_card(
-            title="Type d'achat",
-            subtitle="en nombre de marchés attribués",
-            fig=donut_marche_type,
-        )
-    )
+def _register_card_callback(name: str) -> None:
+    """Callback de la carte `name` : seuls ses filtres le déclenchent."""
+    if DASHBOARD_CARDS[name].get("filters", True):
+        filter_ids = [fp[0] for fp in FILTER_PARAMS]
+        inputs = [Input(filter_id, "value") for filter_id in filter_ids]
+        compute = _compute_card
+    else:
+        # Calculée à l'ouverture de la page, à partir de fichiers annexes qui ne
+        # suivent pas les générations de la base : leur cache est celui de leur
+        # version (voir src.utils.artifacts)
+        filter_ids = []
+        inputs = [Input("dashboard_url", "pathname")]
+        compute = _compute_card.uncached
 
-    distance_histogram = get_distance_histogram(lff)
-    cards.append(
-        make_card(
-            title="Distance acheteur–titulaire",
-            subtitle="en nombre de marchés, échelle logarithmique",
-            fig=distance_histogram,
-        )
-    )
+    @callback(Output(f"card-{name}", "children"), *inputs)
+    def update_card(*values):
+        filter_params = dict(zip(filter_ids, values))
+        children, _complete = compute(name, _normalize_filter_params(filter_params))
+        return children
 
-    top_acheteurs = get_top_org_table(
-        lff, org_type="acheteur", filters=False, extra_columns=[]
-    )
-    cards.append(make_card(title="Top acheteurs", fig=top_acheteurs, lg=12, xl=8))
 
-    top_titulaires = get_top_org_table(
-        lff, org_type="titulaire", filters=False, extra_columns=[]
-    )
-    cards.append(make_card(title="Top titulaires", fig=top_titulaires, lg=12, xl=8))
-
-    geographic_maps: list[dbc.Col] | None = get_geographic_maps(dff)
-
-    other_cards = []
-    sources_barchart = get_barchart_sources(lff, type_date="dateNotification")
-    other_cards.append(
-        make_card(
-            title="Sources de données",
-            subtitle="Nombre de marchés attribués par mois de notification et source de données",
-            fig=sources_barchart,
-            lg=12,
-            xl=8,
-        )
-    )
-
-    duplicate_matrix = get_duplicate_matrix()
-    other_cards.append(
-        make_card(
-            title="Matrice de doublons entre sources de données",
-            subtitle="Ce graphique illustre les doublons de marchés publics entre sources, c'est-à-dire la proportion de marchés publiés par plus d'une source.",
-            fig=duplicate_matrix,
-            lg=12,
-            xl=8,
-        )
-    )
-
-    return cards + geographic_maps + other_cards
+for card_name in DASHBOARD_CARDS:
+    _register_card_callback(card_name)
 
 
 @callback(
-    Output("cards", "children"),
     Output("observatoire-filters", "data"),
     *[Input(fp[0], "value") for fp in FILTER_PARAMS],
 )
-def update_dashboard_cards(*filter_values):
-    filter_params = {}
-    for (input_id, _url_key, _is_multi, _default), value in zip(
-        FILTER_PARAMS, filter_values
-    ):
-        filter_params[input_id] = value
-
-    filter_params_normalized = _normalize_filter_params(filter_params)
-    children = _compute_dashboard_children(filter_params_normalized)
-
-    return dbc.Row(children=children), filter_params
+def store_dashboard_filters(*filter_values):
+    return {fp[0]: value for fp, value in zip(FILTER_PARAMS, filter_values)}
 
 
 @callback(
-    Output("download-observatoire", "data"),
+    Output({"type": "export-job", "page": "observatoire"}, "data"),
     Input("btn-download-observatoire", "n_clicks"),
+    Input({"type": "btn-export", "page": "observatoire", "format": ALL}, "n_clicks"),
     State("observatoire-filters", "data"),
     State("observatoire-hidden-columns", "data"),
     prevent_initial_call=True,
 )
-def download_observatoire(_n_clicks, filter_params, hidden_columns):
-    dff = prepare_dashboard_data(**(filter_params or {}))
-
-    if hidden_columns:
-        dff = dff.drop(hidden_columns)
-
-    def to_bytes(buffer):
-        dff.write_excel(buffer, worksheet="DECP")
-
+def download_observatoire(_n_clicks, _n_clicks_export, filter_params, hidden_columns):
+    fmt = requested_export_format("btn-download-observatoire")
+    if fmt is None:
+        return no_update
+    where_sql, params = dashboard_filters_to_sql(**(filter_params or {}))
+    sql, params = table_export_sql(None, None, hidden_columns, where_sql, params)
     date = datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
-    return dcc.send_bytes(to_bytes, filename=f"decp_observatoire_{date}.xlsx")
+    return start_export(sql, params, fmt, f"decp_observatoire_{date}")
 
 
 @callback(
@@ -829,14 +993,16 @@ def add_organization_name_in_title(acheteur_id, titulaire_id):
         return match[nom_col].item(0) if match.height >= 1 else None
 
     if acheteur_id and len(acheteur_id) == 14:
-        if nom := lookup_nom(DF_ACHETEURS, "acheteur_id", "acheteur_nom", acheteur_id):
+        if nom := lookup_nom(
+            get_org_frame("acheteur"), "acheteur_id", "acheteur_nom", acheteur_id
+        ):
             return [
                 NAME,
                 html.Small(nom, className="text-muted d-block fw-normal fs-5"),
             ]
     elif titulaire_id and len(titulaire_id) == 14:
         if nom := lookup_nom(
-            DF_TITULAIRES, "titulaire_id", "titulaire_nom", titulaire_id
+            get_org_frame("titulaire"), "titulaire_id", "titulaire_nom", titulaire_id
         ):
             return [
                 NAME,
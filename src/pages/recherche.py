@@ -2,7 +2,6 @@ import dash_bootstrap_components as dbc
 from dash import Input, Output, State, callback, dcc, html, register_page
 
 from src.figures import DataTable
-from src.utils.data import DF_ACHETEURS, DF_TITULAIRES
 from src.utils.search import search_org
 from src.utils.seo import META_CONTENT
 from src.utils.table import setup_table_columns
@@ -39,6 +38,9 @@ layout = html.Div(
                     type="text",
                     placeholder="Nom d'acheteur/entreprise, SIREN/SIRET, code département",
                     autoFocus=True,
+                    # Suggestions pendant la saisie (assets/suggestions.js)
+                    list="search_suggestions",
+                    autoComplete="off",
                     style={
                         "margin": "0",
                         "width": "500px",
@@ -50,6 +52,7 @@ layout = html.Div(
                         "height": "34px",
                     },
                 ),
+                html.Datalist(id="search_suggestions"),
                 html.Button(
                     "=>",
                     id="search-button",
@@ -93,16 +96,8 @@ def update_search_results(n_submit, n_clicks, query):
         cols = []
 
         for org_type in ["acheteur", "titulaire"]:
-            if org_type == "acheteur":
-                dff = DF_ACHETEURS
-            elif org_type == "titulaire":
-                dff = DF_TITULAIRES
-            else:
-                raise ValueError(f"{org_type} is not supported")
-
             # Search acheteurs and titulaires using the same function
-            results = search_org(dff, query, org_type=org_type)
-            count = results.height
+            results, count, approximate = search_org(query, org_type=org_type)
 
             # Format output
             columns, tooltip = setup_table_columns(results, hideable=False)
@@ -111,6 +106,15 @@ def update_search_results(n_submit, n_clicks, query):
                 dbc.Col(
                     children=[
                         html.H3(f"{org_type.title()}s : {count}"),
+                        html.P(
+                            "Aucun résultat exact : résultats approchants, "
+                            "les plus proches en premier."
+                        )
+                        if approximate
+                        else None,
+                        html.P(f"Les {results.height} premiers, par nombre de marchés.")
+                        if results.height < count and not approximate
+                        else None,
                         DataTable(
                             dtid=f"results_{org_type}_datatable",
                             columns=columns,
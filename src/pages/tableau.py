@@ -5,8 +5,8 @@ import uuid
 from datetime import datetime
 
 import dash_bootstrap_components as dbc
-import polars as pl
 from dash import (
+    ALL,
     ClientsideFunction,
     Input,
     Output,
@@ -19,17 +19,21 @@ from dash import (
     register_page,
 )
 
-from src.db import query_marches, schema
+from src.db import schema
 from src.figures import DataTable, make_column_picker
 from src.utils import logger
+from src.utils.frontend import (
+    make_export_buttons,
+    requested_export_format,
+    start_export,
+)
 from src.utils.seo import META_CONTENT
 from src.utils.table import (
     COLUMNS,
-    filter_table_data,
     get_default_hidden_columns,
     invert_columns,
     prepare_table_data,
-    sort_table_data,
+    table_export_sql,
 )
 from src.utils.tracking import track_search
 
@@ -237,11 +241,11 @@ layout = [
                     html.Div(id="copy-container"),
                     dcc.Input(id="share-url", readOnly=True, style={"display": "none"}),
                     dbc.Button(
-                        "Téléchargement désactivé au-delà de 65 000 lignes",
+                        "Excel désactivé au-delà de 65 000 lignes",
                         id="btn-download-data",
                         disabled=True,
                     ),
-                    dcc.Download(id="download-data"),
+                    *make_export_buttons("tableau"),
                     dcc.Store(id="filtered_data", storage_type="memory"),
                     html.P("Données mises à jour le " + str(update_date)),
                     dbc.Button(
@@ -309,32 +313,27 @@ def update_table(href, page_current, page_size, filter_query, sort_by, data_time
 
 
 @callback(
-    Output("download-data", "data"),
+    Output({"type": "export-job", "page": "tableau"}, "data"),
     Input("btn-download-data", "n_clicks"),
+    Input({"type": "btn-export", "page": "tableau", "format": ALL}, "n_clicks"),
     State("tableau_datatable", "filter_query"),
     State("tableau_datatable", "sort_by"),
     State("tableau_datatable", "hidden_columns"),
     prevent_initial_call=True,
 )
-def download_data(n_clicks, filter_query, sort_by, hidden_columns: list | None = None):
-    lff: pl.LazyFrame = query_marches().lazy()
-
-    # Les colonnes masquées sont supprimées
-    if hidden_columns:
-        lff = lff.drop(hidden_columns)
-
+def download_data(
+    n_clicks, n_clicks_export, filter_query, sort_by, hidden_columns: list | None = None
+):
+    fmt = requested_export_format("btn-download-data")
+    if fmt is None:
+        return no_update
     if filter_query:
         track_search(filter_query, "tab download")
-        lff = filter_table_data(lff, filter_query)
-
-    if sort_by and len(sort_by) > 0:
-        lff = sort_table_data(lff, sort_by)
-
-    def to_bytes(buffer):
-        lff.collect(engine="streaming").write_excel(buffer, worksheet="DECP")
 
+    # Filtre, tri et colonnes visibles sont appliqués dans DuckDB, en tâche de fond
+    sql, params = table_export_sql(filter_query, sort_by, hidden_columns)
     date = datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
-    return dcc.send_bytes(to_bytes, filename=f"decp_{date}.xlsx")
+    return start_export(sql, params, fmt, f"decp_{date}")
 
 
 @callback(
@@ -1,9 +1,9 @@
 import datetime
-from typing import Any
 
 import dash_bootstrap_components as dbc
 import polars as pl
 from dash import (
+    ALL,
     ClientsideFunction,
     Input,
     Output,
@@ -12,34 +12,49 @@ from dash import (
     clientside_callback,
     dcc,
     html,
+    no_update,
     register_page,
 )
 
-from src.db import query_marches, schema
+from src.db import schema
 from src.figures import (
     DataTable,
-    get_distance_histogram,
-    get_top_org_table,
+    get_distance_histogram_from_stats,
     make_column_picker,
+    make_top_org_table,
     point_on_map,
 )
-from src.utils.data import DF_TITULAIRES, get_annuaire_data, get_departement_region
-from src.utils.frontend import get_button_properties
+from src.utils.annuaire import get_annuaire_data
+from src.utils.data import (
+    get_departement_region,
+    get_org_frame,
+    get_org_marches,
+    get_org_stats,
+    org_data_handle,
+    org_marches_where,
+)
+from src.utils.frontend import (
+    get_button_properties,
+    make_export_buttons,
+    requested_export_format,
+    start_export,
+)
 from src.utils.seo import META_CONTENT
 from src.utils.table import (
     COLUMNS,
-    filter_table_data,
     format_number,
     get_default_hidden_columns,
     prepare_table_data,
-    sort_table_data,
+    table_export_sql,
 )
 from src.utils.tracking import track_search
 
 
 def get_title(titulaire_id: str = None) -> str:
-    titulaire_nom = DF_TITULAIRES.filter(pl.col("titulaire_id") == titulaire_id).select(
-        "titulaire_nom"
+    titulaire_nom = (
+        get_org_frame("titulaire")
+        .filter(pl.col("titulaire_id") == titulaire_id)
+        .select("titulaire_nom")
     )
     if titulaire_nom.height > 0:
         return f"Marchés publics remportés par {titulaire_nom.item(0, 0)} | decp.info"
@@ -199,12 +214,12 @@ layout = [
                             ),
                             html.P("lignes", id="titulaire_nb_rows"),
                             html.Button(
-                                "Téléchargement désactivé au-delà de 65 000 lignes",
+                                "Excel désactivé au-delà de 65 000 lignes",
                                 id="btn-download-filtered-data-titulaire",
                                 disabled=True,
                                 className="btn btn-primary",
                             ),
-                            dcc.Download(id="titulaire-download-filtered-data"),
+                            *make_export_buttons("titulaire"),
                             dbc.Button(
                                 "Remise à zéro",
                                 title="Supprime tous les filtres et les tris. Autrement ils sont conservés même si vous fermez la page.",
@@ -263,13 +278,20 @@ def update_titulaire_infos(url):
     if data_etablissement:
         data_etablissement = data_etablissement[0]
 
-        titulaire_map = point_on_map(
-            data_etablissement["latitude"], data_etablissement["longitude"]
-        )
-        code_departement, nom_departement, nom_region = get_departement_region(
-            data_etablissement["code_postal"]
-        )
-        departement = f"{nom_departement} ({code_departement})"
+        if data_etablissement.get("latitude") is not None:
+            titulaire_map = point_on_map(
+                data_etablissement["latitude"], data_etablissement["longitude"]
+            )
+        else:
+            titulaire_map = html.Div()
+        if data_etablissement.get("code_postal") is not None:
+            code_departement, nom_departement, nom_region = get_departement_region(
+                data_etablissement["code_postal"]
+            )
+            departement = f"{nom_departement} ({code_departement})"
+        else:
+            # Établissement de la table locale sans code postal (à l'étranger)
+            nom_region, departement = "", ""
         lien_annuaire = (
             f"https://annuaire-entreprises.data.gouv.fr/etablissement/{titulaire_siret}"
         )
@@ -305,14 +327,9 @@ def update_titulaire_infos(url):
     Input(component_id="titulaire_data", component_property="data"),
 )
 def update_titulaire_stats(data):
-    dff = pl.DataFrame(data, strict=False, infer_schema_length=5000)
-    if dff.height == 0:
-        nb_marches = 0
-        nb_acheteurs = 0
-    else:
-        df_marches = dff.unique("uid")
-        nb_marches = format_number(df_marches.height)
-        nb_acheteurs = dff.unique("acheteur_id").height
+    stats = get_org_stats(**data)
+    nb_marches = format_number(stats["nb_marches"])
+    nb_acheteurs = stats["nb_partenaires"]
 
     texte_marches_remportes = [
         html.Strong(nb_marches),
@@ -337,21 +354,12 @@ def update_titulaire_stats(data):
     Input(component_id="titulaire_year", component_property="value"),
 )
 def get_titulaire_marches_data(url, titulaire_year: str) -> tuple:
-    titulaire_siret = url.split("/")[-1]
-    lff = query_marches(
-        "titulaire_id = ? AND titulaire_typeIdentifiant = 'SIRET'",
-        (titulaire_siret,),
-    ).lazy()
-    if titulaire_year and titulaire_year != "Toutes les années":
-        lff = lff.filter(
-            pl.col("dateNotification").cast(pl.String).str.starts_with(titulaire_year)
-        )
-    lff = lff.sort(["dateNotification", "uid"], descending=True, nulls_last=True)
-    lff = lff.fill_null("")
-    dff: pl.DataFrame = lff.collect(engine="streaming")
-    download_disabled, download_text, download_title = get_button_properties(dff.height)
-    data = dff.to_dicts()
-    return data, download_disabled, download_text, download_title
+    # Seule la référence aux marchés est envoyée au navigateur, le tableau est
+    # lu page par page dans DuckDB (voir org_marches_where)
+    handle = org_data_handle("titulaire", url.split("/")[-1], titulaire_year)
+    nb_rows = get_org_stats(**handle)["nb_lignes"]
+    download_disabled, download_text, download_title = get_button_properties(nb_rows)
+    return handle, download_disabled, download_text, download_title
 
 
 @callback(
@@ -375,14 +383,18 @@ def get_titulaire_marches_data(url, titulaire_year: str) -> tuple:
 def get_last_marches_data(
     href, data, page_current, page_size, filter_query, sort_by, data_timestamp
 ) -> list[dict]:
+    # Filtre, tri et pagination dans DuckDB, comme la page Tableau
+    where_sql, params = org_marches_where(**data)
     return prepare_table_data(
-        data,
+        None,
         data_timestamp,
         filter_query,
         page_current,
         page_size,
         sort_by,
         "titulaire",
+        where_sql=where_sql,
+        params=tuple(params),
     )
 
 
@@ -391,7 +403,9 @@ def get_last_marches_data(
     Input(component_id="titulaire_data", component_property="data"),
 )
 def get_top_acheteurs(data):
-    return get_top_org_table(data, "acheteur", ["titulaire_distance"])
+    return make_top_org_table(
+        pl.DataFrame(get_org_stats(**data)["top_partenaires"]), "acheteur"
+    )
 
 
 @callback(
@@ -404,11 +418,11 @@ def get_top_acheteurs(data):
 )
 def download_titulaire_data(
     n_clicks,
-    data: list[dict[str, Any]],
+    data: dict,
     titulaire_nom: str,
     annee: str,
 ):
-    df_to_download = pl.DataFrame(data)
+    df_to_download = get_org_marches(**data)
 
     def to_bytes(buffer):
         df_to_download.write_excel(
@@ -420,9 +434,11 @@ def download_titulaire_data(
 
 
 @callback(
-    Output("titulaire-download-filtered-data", "data"),
-    State("titulaire_data", "data"),
+    Output({"type": "export-job", "page": "titulaire"}, "data"),
     Input("btn-download-filtered-data-titulaire", "n_clicks"),
+    Input({"type": "btn-export", "page": "titulaire", "format": ALL}, "n_clicks"),
+    State("titulaire_url", "pathname"),
+    State("titulaire_year", "value"),
     State("titulaire_nom", "children"),
     State("titulaire_datatable", "filter_query"),
     State("titulaire_datatable", "sort_by"),
@@ -430,35 +446,30 @@ def download_titulaire_data(
     prevent_initial_call=True,
 )
 def download_filtered_titulaire_data(
-    data,
     n_clicks,
+    n_clicks_export,
+    url,
+    annee,
     titulaire_nom,
     filter_query,
     sort_by,
     hidden_columns: list | None = None,
 ):
-    lff: pl.LazyFrame = pl.LazyFrame(
-        data
-    )  # start from the full titulaire data, not from paginated table data
-
-    # Les colonnes masquées sont supprimées
-    if hidden_columns:
-        lff = lff.drop(hidden_columns)
-
+    fmt = requested_export_format("btn-download-filtered-data-titulaire")
+    if fmt is None:
+        return no_update
     if filter_query:
         track_search(filter_query, "titu download")
-        lff = filter_table_data(lff, filter_query)
-
-    if len(sort_by) > 0:
-        lff = sort_table_data(lff, sort_by)
-
-    def to_bytes(buffer):
-        lff.collect(engine="streaming").write_excel(buffer, worksheet="DECP")
 
-    date = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
-    return dcc.send_bytes(
-        to_bytes, filename=f"decp_filtrées_{titulaire_nom}_{date}.xlsx"
+    # Mêmes lignes que titulaire_data, filtrées et triées comme le tableau
+    where_sql, params = org_marches_where(
+        **org_data_handle("titulaire", url.split("/")[-1], annee)
+    )
+    sql, params = table_export_sql(
+        filter_query, sort_by, hidden_columns, where_sql, params
     )
+    date = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+    return start_export(sql, params, fmt, f"decp_filtrées_{titulaire_nom}_{date}")
 
 
 # Pour nettoyer les icontains et i< des filtres
@@ -541,12 +552,7 @@ def reset_view(n_clicks):
     Input("titulaire_data", "data"),
 )
 def update_titulaire_distance_histogram(data):
-    lff = pl.LazyFrame(data)
-    if "titulaire_distance" in lff.collect_schema().names():
-        lff = lff.with_columns(
-            pl.col("titulaire_distance").cast(pl.Float64, strict=False)
-        )
-    fig = get_distance_histogram(lff)
+    fig = get_distance_histogram_from_stats(get_org_stats(**data))
     return [
         html.H3("Distance acheteur-titulaire"),
         html.H6("par nombre de marchés", className="card-subtitle mb-2 text-muted"),
@@ -0,0 +1,154 @@
+"""Informations des établissements (API recherche-entreprises), avec cache local.
+
+Les pages acheteur et titulaire (et leurs données structurées, voir
+src.utils.seo) interrogent l'API pour chaque SIRET affiché. Les réponses sont
+gardées dans une table SQLite partagée par les workers d'une même machine :
+ANNUAIRE_TTL pour un établissement trouvé, ANNUAIRE_NEGATIVE_TTL pour un SIRET
+inconnu de l'API et ANNUAIRE_ERROR_TTL après une erreur ou un dépassement de
+ANNUAIRE_TIMEOUT, pour ne pas bloquer les workers quand l'API est lente. Dans
+un worker, les demandes simultanées d'un même SIRET n'appellent l'API qu'une
+fois.
+
+Si la base a été construite avec un extrait SIRENE (voir
+src.build.SIRENE_ETABLISSEMENTS_PATH), les établissements sont d'abord
+cherchés dans la table etablissements, sans appel réseau.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import closing
+from pathlib import Path
+
+from httpx import HTTPError, get
+
+from src.db import get_cursor, get_generation
+from src.utils import logger
+
+ANNUAIRE_URL = os.getenv(
+    "ANNUAIRE_URL", "https://recherche-entreprises.api.gouv.fr/search"
+)
+ANNUAIRE_CACHE_PATH = Path(
+    os.getenv("ANNUAIRE_CACHE_PATH", "/tmp/decp-annuaire.sqlite")
+)
+# Durées de conservation des réponses (secondes)
+ANNUAIRE_TTL = int(os.getenv("ANNUAIRE_TTL", 7 * 24 * 3600))
+ANNUAIRE_NEGATIVE_TTL = int(os.getenv("ANNUAIRE_NEGATIVE_TTL", 24 * 3600))
+ANNUAIRE_ERROR_TTL = int(os.getenv("ANNUAIRE_ERROR_TTL", 60))
+# Délai maximal d'une requête à l'API (secondes)
+ANNUAIRE_TIMEOUT = float(os.getenv("ANNUAIRE_TIMEOUT", 3))
+
+_in_flight: dict[str, Future] = {}
+_in_flight_lock = threading.Lock()
+
+
+def _cache_db() -> sqlite3.Connection:
+    ANNUAIRE_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(ANNUAIRE_CACHE_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS annuaire ("
+        "siret TEXT PRIMARY KEY, data TEXT, fetched_at REAL, expires_at REAL)"
+    )
+    return conn
+
+
+def _read_cache(siret: str) -> tuple[str | None, float] | None:
+    """(données JSON ou NULL, expiration) de `siret`, ou None s'il est absent."""
+    with closing(_cache_db()) as conn:
+        return conn.execute(
+            "SELECT data, expires_at FROM annuaire WHERE siret = ?", [siret]
+        ).fetchone()
+
+
+def _write_cache(siret: str, data: dict | None, ttl: int) -> None:
+    now = time.time()
+    with closing(_cache_db()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO annuaire VALUES (?, ?, ?, ?)",
+            [siret, json.dumps(data) if data else None, now, now + ttl],
+        )
+
+
+def _fetch(siret: str, stale: tuple[str | None, float] | None) -> dict | None:
+    """Interroge l'API et met la réponse en cache.
+
+    En cas d'erreur, la réponse expirée `stale` est servie (et conservée
+    ANNUAIRE_ERROR_TTL secondes) si elle existe.
+    """
+    try:
+        response = get(
+            ANNUAIRE_URL, params={"q": siret}, timeout=ANNUAIRE_TIMEOUT
+        ).raise_for_status()
+        results = response.json()["results"]
+    except (HTTPError, KeyError, ValueError) as e:
+        logger.warning(f"Could not fetch data from recherche-entreprises.api: {e!r}")
+        data = json.loads(stale[0]) if stale and stale[0] else None
+        _write_cache(siret, data, ANNUAIRE_ERROR_TTL)
+        return data
+
+    if not results:
+        logger.info(f"SIRET {siret} absent de recherche-entreprises.api")
+        _write_cache(siret, None, ANNUAIRE_NEGATIVE_TTL)
+        return None
+    _write_cache(siret, results[0], ANNUAIRE_TTL)
+    return results[0]
+
+
+def _local_etablissement(siret: str) -> dict | None:
+    """Établissement de la table etablissements, au format de l'API."""
+    if "etablissements" not in get_generation().tables:
+        return None
+    rows = (
+        get_cursor()
+        .execute(
+            "SELECT * EXCLUDE (siret) FROM etablissements WHERE siret = ?", [siret]
+        )
+        .pl()
+    )
+    if rows.height == 0:
+        return None
+    etablissement = rows.row(0, named=True)
+    return {
+        "nom_raison_sociale": etablissement.pop("nom_raison_sociale"),
+        "matching_etablissements": [etablissement],
+    }
+
+
+def get_annuaire_data(siret: str) -> dict | None:
+    """Premier résultat de l'API recherche-entreprises pour `siret`, ou None."""
+    if not siret:
+        return None
+    local = _local_etablissement(siret)
+    if local:
+        return local
+    cached = _read_cache(siret)
+    if cached and cached[1] > time.time():
+        return json.loads(cached[0]) if cached[0] else None
+
+    with _in_flight_lock:
+        future = _in_flight.get(siret)
+        leader = future is None
+        if leader:
+            future = _in_flight[siret] = Future()
+
+    if not leader:
+        try:
+            return future.result(timeout=ANNUAIRE_TIMEOUT)
+        except FutureTimeoutError:
+            return None
+
+    try:
+        data = _fetch(siret, cached)
+        future.set_result(data)
+        return data
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            del _in_flight[siret]
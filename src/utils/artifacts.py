@@ -0,0 +1,183 @@
+"""Copies locales des fichiers annexes publiés sur data.gouv.fr.
+
+La matrice des doublons entre sources (observatoire), les statistiques des
+sources (page À propos) et les statistiques générales ne dépendent pas des
+filtres : plutôt que de les télécharger à chaque affichage, une tâche de mise à
+jour (comme src.build, par exemple une tâche cron) les copie dans
+ARTIFACTS_DIR :
+
+    python -m src.utils.artifacts
+
+Chaque fichier est gardé sous le nom de sa version, dérivée de l'ETag renvoyé
+par data.gouv.fr, et current.json désigne la version à servir. Les requêtes
+suivantes sont conditionnelles (If-None-Match) : rien n'est téléchargé tant que
+le fichier publié n'a pas changé. Les workers ne lisent que la copie locale
+(voir artifact_path), partagée par tous les workers de la machine ; ils ne
+téléchargent un fichier que s'il n'a encore jamais été copié.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from httpx import HTTPError, stream
+
+from src.utils import logger
+
+ARTIFACTS_DIR = Path(os.getenv("ARTIFACTS_DIR", "/tmp/decp-artifacts"))
+# Délai maximal d'un téléchargement (secondes)
+ARTIFACTS_TIMEOUT = float(os.getenv("ARTIFACTS_TIMEOUT", 30))
+
+REMOTE_ARTIFACTS = {
+    # Proportion des marchés de chaque source présents dans les autres
+    "duplicate_matrix": {
+        "url": "https://www.data.gouv.fr/api/1/datasets/r/a545bf6c-8b24-46ed-b49f-a32bf02eaffa",
+        "suffix": ".parquet",
+    },
+    "sources": {
+        "url": os.getenv("SOURCE_STATS_CSV_PATH"),
+        "suffix": ".csv",
+    },
+    "statistics": {
+        "url": "https://www.data.gouv.fr/api/1/datasets/r/0ccf4a75-f3aa-4b46-8b6a-18aeb63e36df",
+        "suffix": ".json",
+    },
+}
+
+# Un seul téléchargement à la fois par worker
+_refresh_lock = threading.Lock()
+
+
+def _is_remote(url: str | None) -> bool:
+    return bool(url) and url.startswith(("http://", "https://"))
+
+
+def _current(name: str) -> dict | None:
+    """Version servie de l'artefact `name` (contenu de current.json)."""
+    try:
+        current = json.loads((ARTIFACTS_DIR / name / "current.json").read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if not (ARTIFACTS_DIR / name / current["file"]).exists():
+        return None
+    return current
+
+
+def _write_current(name: str, current: dict) -> None:
+    """Remplace current.json d'un coup : un worker ne lit jamais un fichier partiel."""
+    path = ARTIFACTS_DIR / name / "current.json"
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(current))
+    os.replace(tmp_path, path)
+
+
+def _version(etag: str | None, digest: str) -> str:
+    """Nom de version : l'ETag s'il y en a un, sinon le contenu."""
+    if etag:
+        return hashlib.sha256(etag.encode()).hexdigest()[:16]
+    return digest[:16]
+
+
+def refresh_artifact(name: str) -> bool:
+    """Télécharge l'artefact `name` s'il a changé ; True si une version a été ajoutée.
+
+    En cas d'erreur, la copie existante reste servie.
+    """
+    artifact = REMOTE_ARTIFACTS[name]
+    if not _is_remote(artifact["url"]):
+        return False
+    directory = ARTIFACTS_DIR / name
+    directory.mkdir(parents=True, exist_ok=True)
+    current = _current(name)
+    headers = {"If-None-Match": current["etag"]} if current and current["etag"] else {}
+
+    tmp_path = directory / f"download.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with stream(
+            "GET",
+            artifact["url"],
+            headers=headers,
+            follow_redirects=True,
+            timeout=ARTIFACTS_TIMEOUT,
+        ) as response:
+            if response.status_code == 304:
+                logger.debug(f"Artefact {name} : inchangé")
+                return False
+            response.raise_for_status()
+            etag = response.headers.get("ETag")
+            sha256 = hashlib.sha256()
+            with open(tmp_path, "wb") as f:
+                for chunk in response.iter_bytes():
+                    sha256.update(chunk)
+                    f.write(chunk)
+    except (HTTPError, OSError) as e:
+        logger.warning(f"Artefact {name} : téléchargement impossible ({e!r})")
+        tmp_path.unlink(missing_ok=True)
+        return False
+
+    version = _version(etag, sha256.hexdigest())
+    file_name = f"{version}{artifact['suffix']}"
+    if current and current["file"] == file_name:
+        # Serveur sans requêtes conditionnelles, contenu identique
+        tmp_path.unlink()
+        return False
+    os.replace(tmp_path, directory / file_name)
+    _write_current(
+        name,
+        {
+            "etag": etag,
+            "version": version,
+            "file": file_name,
+            "fetched_at": time.time(),
+        },
+    )
+    logger.info(f"Artefact {name} : version {version}")
+
+    # Les workers qui lisent encore l'ancienne version gardent leur fichier
+    # ouvert, sa suppression ne les gêne pas
+    for path in directory.glob(f"*{artifact['suffix']}"):
+        if path.name not in (file_name, "current.json"):
+            path.unlink(missing_ok=True)
+    return True
+
+
+def refresh_artifacts() -> None:
+    for name in REMOTE_ARTIFACTS:
+        refresh_artifact(name)
+
+
+def artifact_path(name: str) -> Path:
+    """Chemin de la copie locale de l'artefact `name`.
+
+    Son nom change à chaque version : il peut servir de clé de cache. Si
+    l'artefact n'a encore jamais été copié, il est téléchargé. Une source
+    locale (SOURCE_STATS_CSV_PATH peut être un chemin) est lue directement.
+    """
+    url = REMOTE_ARTIFACTS[name]["url"]
+    if url and not _is_remote(url):
+        return Path(url)
+    current = _current(name)
+    if current is None:
+        with _refresh_lock:
+            current = _current(name)
+            if current is None:
+                refresh_artifact(name)
+                current = _current(name)
+    if current is None:
+        raise FileNotFoundError(f"Artefact {name} indisponible (voir {url})")
+    return ARTIFACTS_DIR / name / current["file"]
+
+
+if __name__ == "__main__":
+    # Mise à jour des copies locales hors des workers (cron) :
+    #   python -m src.utils.artifacts
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    # Les constantes sont lues à l'import, avant load_dotenv
+    ARTIFACTS_DIR = Path(os.getenv("ARTIFACTS_DIR", str(ARTIFACTS_DIR)))
+    REMOTE_ARTIFACTS["sources"]["url"] = os.getenv("SOURCE_STATS_CSV_PATH")
+    refresh_artifacts()
@@ -2,3 +2,15 @@ from flask_caching import Cache
 
 # Isolé dans un fichier dédié pour éviter les imports circulaires
 cache = Cache()
+
+
+def per_generation(fname: str) -> str:
+    """`make_name` pour cache.memoize : une clé par génération de la base.
+
+    Après une bascule à chaud (voir src.db.DatabaseHandle), les résultats
+    calculés sur l'ancienne base ne sont plus servis.
+    """
+    # Import local : src.db ouvre la base, inutile pour importer `cache`
+    from src.db import get_generation
+
+    return f"{fname}@{get_generation().name}"
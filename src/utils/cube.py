@@ -0,0 +1,131 @@
+"""Routage des agrégats de l'observatoire vers les cubes pré-calculés.
+
+Les cubes (voir src.build.CUBE_TABLES) contiennent des comptes par mois de
+notification et par dimension. Quand les filtres ne portent que sur ces
+dimensions, les agrégats sont lus dans le cube ; le premier mois, incomplet
+sur la période glissante des 12 derniers mois, est recalculé sur decp.
+Les autres filtres (identifiants, objet, CPV, montants) nécessitent les
+lignes de decp : la requête est alors faite directement sur decp.
+"""
+
+from datetime import date, datetime, timedelta
+
+import polars as pl
+
+from src.build import CUBE_TABLES, cube_dimensions, cube_select_sql
+from src.db import get_cursor, get_generation, schema
+from src.utils.table_sql import dashboard_filters_to_sql, default_period_start
+
+# Filtres qui ne peuvent pas être évalués sur les cubes
+RAW_ONLY_FILTERS = [
+    "dashboard_acheteur_id",
+    "dashboard_titulaire_id",
+    "dashboard_marche_objet",
+    "dashboard_marche_code_cpv",
+    "dashboard_montant_min",
+    "dashboard_montant_max",
+]
+# cube_marches n'a pas les dimensions des titulaires
+RAW_ONLY_FILTERS_MARCHES = [
+    "dashboard_titulaire_categorie",
+    "dashboard_titulaire_departement_code",
+]
+
+
+def available_cubes() -> set[str]:
+    """Cubes présents dans la génération courante de la base."""
+    return get_generation().tables & set(CUBE_TABLES)
+
+
+def can_use_cube(table: str, filter_params: dict) -> bool:
+    raw_only = RAW_ONLY_FILTERS
+    if table == "cube_marches":
+        raw_only = raw_only + RAW_ONLY_FILTERS_MARCHES
+    if any(filter_params.get(f) not in (None, "", []) for f in raw_only):
+        return False
+    filtered_columns = {
+        "dashboard_acheteur_categorie": "acheteur_categorie",
+        "dashboard_acheteur_departement_code": "acheteur_departement_code",
+        "dashboard_titulaire_categorie": "titulaire_categorie",
+        "dashboard_titulaire_departement_code": "titulaire_departement_code",
+        "dashboard_marche_type": "type",
+        "dashboard_marche_techniques": "techniques",
+        "dashboard_marche_considerations_sociales": "considerationsSociales",
+        "dashboard_marche_considerations_environnementales": "considerationsEnvironnementales",
+        "dashboard_marche_innovant": "marcheInnovant",
+        "dashboard_marche_sous_traitance_declaree": "sousTraitanceDeclaree",
+    }
+    dimensions = cube_dimensions(table, schema)
+    return all(
+        column in dimensions
+        for param, column in filtered_columns.items()
+        if filter_params.get(param)
+    )
+
+
+def first_full_month(period_start: datetime) -> tuple[date, date]:
+    """Premier jour inclus de la période et premier jour du premier mois complet."""
+    # "dateNotification" > period_start : le jour de period_start est exclu
+    start = period_start.date() + timedelta(days=1)
+    if start.day == 1:
+        return start, start
+    next_month = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start, next_month
+
+
+def cells_sql(
+    table: str,
+    filter_params: dict,
+    use_cube: bool = True,
+) -> tuple[str, list]:
+    """Requête des cellules de `table` correspondant aux filtres du tableau de bord.
+
+    Les cellules ont les colonnes du cube (mois, dimensions, mesures) et
+    peuvent être ré-agrégées par n'importe quelle dimension.
+    """
+    if not (use_cube and can_use_cube(table, filter_params)):
+        where_sql, params = dashboard_filters_to_sql(**filter_params)
+        return cube_select_sql(table, schema, where_sql), params
+
+    where_sql, params = dashboard_filters_to_sql(**filter_params, with_period=False)
+    year = filter_params.get("dashboard_year")
+    if year:
+        return (
+            f"SELECT * FROM {table} WHERE {where_sql} AND year(mois) = ?",
+            params + [int(year)],
+        )
+
+    start, first_full = first_full_month(default_period_start())
+    sql = f"SELECT * FROM {table} WHERE {where_sql} AND mois >= ?"
+    all_params = params + [first_full]
+    if start < first_full:
+        partial_month = cube_select_sql(
+            table,
+            schema,
+            f'{where_sql} AND "dateNotification" >= ? AND "dateNotification" < ?',
+        )
+        sql = f"{sql} UNION ALL BY NAME {partial_month}"
+        all_params += params + [start, first_full]
+    return sql, all_params
+
+
+def query_cube(
+    table: str,
+    filter_params: dict,
+    group_by: list[str] | None = None,
+    cursor=None,
+) -> pl.DataFrame:
+    """Mesures de `table` sommées par `group_by` pour les filtres donnés."""
+    use_cube = table in available_cubes()
+    sql, params = cells_sql(table, filter_params, use_cube)
+    group_by = group_by or []
+    keys = [f'"{c}"' for c in group_by]
+    # Comptes entiers ; montants en DOUBLE, arrondis seulement à l'affichage
+    sums = [
+        f"sum({m})::{'DOUBLE' if m == 'montant' else 'BIGINT'} AS {m}"
+        for m in CUBE_TABLES[table]["measures"]
+    ]
+    query = f"SELECT {', '.join(keys + sums)} FROM ({sql})"
+    if keys:
+        query += f" GROUP BY {', '.join(keys)} ORDER BY {', '.join(keys)}"
+    return (cursor or get_cursor()).execute(query, params).pl()
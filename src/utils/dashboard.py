@@ -0,0 +1,422 @@
+"""Agrégats des cartes de l'observatoire, calculés dans DuckDB.
+
+Chaque carte a sa propre requête sur decp, qui ne lit que les colonnes dont
+elle a besoin et ne renvoie que les lignes agrégées (comptes, intervalles de
+l'histogramme, top des organisations, points des cartes), au lieu de
+matérialiser toutes les colonnes des marchés filtrés dans le worker (voir
+src.utils.data.prepare_dashboard_data). Les fonctions *_sql renvoient
+(sql, params) ; les fonctions get_* exécutent la requête avec le curseur
+donné, ou un nouveau curseur sur la génération courante de la base.
+
+Les cartes Résumé, distances, top acheteurs et top titulaires lisent les mêmes
+lignes : l'observatoire les calcule ensemble (get_dashboard_stats), en une
+seule lecture de decp.
+
+Les cartes ne dépendent pas les unes des autres : run_cards les calcule en
+parallèle sur un pool borné de threads (DuckDB libère le GIL pendant les
+requêtes), chacune avec son curseur et son délai maximal.
+"""
+
+import os
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import duckdb
+import polars as pl
+
+from src.build import TOP_PARTENAIRES, distance_bin_sql, distance_bins_sql
+from src.db import get_cursor, schema
+from src.utils import logger
+from src.utils.table_sql import dashboard_filters_to_sql
+
+# Cartes calculées en même temps par worker
+DASHBOARD_WORKERS = int(os.getenv("DASHBOARD_WORKERS", 4))
+# Délai maximal du calcul d'une carte (secondes), au-delà sa requête est
+# interrompue et la carte affiche une erreur
+DASHBOARD_CARD_TIMEOUT = float(os.getenv("DASHBOARD_CARD_TIMEOUT", 20))
+
+# Au-delà de ce nombre de marchés, la carte d'une région est une carte
+# choroplèthe des départements plutôt que des points par organisation
+CHOROPLETH_MIN_MARCHES = {"Hexagone": 30000}
+CHOROPLETH_MIN_MARCHES_DROM = 10000
+
+ORG_TYPES = ["acheteur", "titulaire"]
+
+# Calculs de get_dashboard_stats en cours dans ce worker, par filtres
+_stats_in_flight: dict[str, Future] = {}
+_stats_in_flight_lock = threading.Lock()
+
+
+def _summary_select(relation: str) -> str:
+    # SELECT DISTINCT plutôt que count(DISTINCT) : un identifiant manquant
+    # compte pour une organisation, comme dans Polars (n_unique)
+    return f"""
+        SELECT
+            (SELECT count(*) FROM (SELECT DISTINCT "acheteur_id" FROM {relation}))
+                AS nb_acheteurs,
+            (SELECT count(*) FROM (
+                SELECT DISTINCT "titulaire_id", "titulaire_typeIdentifiant"
+                FROM {relation}
+            )) AS nb_titulaires,
+            (SELECT median("titulaire_distance") FROM {relation}) AS distance_mediane
+    """
+
+
+def _distance_histogram_select(relation: str) -> str:
+    bin_sql = distance_bin_sql("log_distance", "distance_log_min", "distance_log_max")
+    return f"""
+        WITH distances AS (
+            SELECT log10("titulaire_distance") AS log_distance
+            FROM {relation} WHERE "titulaire_distance" > 0
+        ),
+        bornes AS (
+            SELECT min(log_distance) AS distance_log_min,
+                max(log_distance) AS distance_log_max
+            FROM distances
+        )
+        SELECT distance_log_min, distance_log_max,
+            [{distance_bins_sql("bin")}] AS distance_bins
+        FROM (SELECT *, {bin_sql} AS bin FROM distances, bornes)
+        GROUP BY ALL
+    """
+
+
+def _top_orgs_columns(org_type: str) -> list[str]:
+    columns = [f"{org_type}_id", f"{org_type}_nom"]
+    if org_type == "titulaire":
+        columns.append("titulaire_typeIdentifiant")
+    return columns
+
+
+def _top_orgs_select(relation: str, org_type: str, limit: int) -> str:
+    columns_sql = ", ".join(f'"{c}"' for c in _top_orgs_columns(org_type))
+    return f"""
+        SELECT {columns_sql}, count(*) AS "Attributions"
+        FROM {relation}
+        GROUP BY ALL
+        ORDER BY "Attributions" DESC, "{org_type}_id"
+        LIMIT {int(limit)}
+    """
+
+
+def summary_sql(filter_params: dict) -> tuple[str, list]:
+    """Acheteurs et titulaires distincts, distance médiane (carte Résumé)."""
+    where_sql, params = dashboard_filters_to_sql(**filter_params)
+    lignes = f"""(
+        SELECT "acheteur_id", "titulaire_id", "titulaire_typeIdentifiant",
+            "titulaire_distance"
+        FROM decp WHERE {where_sql}
+    )"""
+    return f"WITH lignes AS {lignes} {_summary_select('lignes')}", params
+
+
+def get_summary(filter_params: dict, cursor=None) -> dict:
+    cursor = cursor or get_cursor()
+    return cursor.execute(*summary_sql(filter_params)).pl().row(0, named=True)
+
+
+def distance_histogram_sql(filter_params: dict) -> tuple[str, list]:
+    """Histogramme des distances acheteur–titulaire, au format des lignes de
+    acheteur_stats et titulaire_stats (voir src.build.org_stats_select_sql)."""
+    where_sql, params = dashboard_filters_to_sql(**filter_params)
+    relation = f'(SELECT "titulaire_distance" FROM decp WHERE {where_sql})'
+    return _distance_histogram_select(relation), params
+
+
+def get_distance_histogram_stats(filter_params: dict, cursor=None) -> dict:
+    """Histogramme pour src.figures.get_distance_histogram_from_stats ({} si
+    aucune distance)."""
+    cursor = cursor or get_cursor()
+    dff = cursor.execute(*distance_histogram_sql(filter_params)).pl()
+    return dff.row(0, named=True) if dff.height else {}
+
+
+def top_orgs_sql(
+    filter_params: dict, org_type: str, limit: int = TOP_PARTENAIRES
+) -> tuple[str, list]:
+    """Les `limit` acheteurs ou titulaires les plus attributaires (Attributions)."""
+    where_sql, params = dashboard_filters_to_sql(**filter_params)
+    return _top_orgs_select(f"decp WHERE {where_sql}", org_type, limit), params
+
+
+def get_top_orgs(
+    filter_params: dict, org_type: str, limit: int = TOP_PARTENAIRES, cursor=None
+) -> pl.DataFrame:
+    cursor = cursor or get_cursor()
+    return cursor.execute(*top_orgs_sql(filter_params, org_type, limit)).pl()
+
+
+def dashboard_stats_sql(filter_params: dict) -> tuple[str, list]:
+    """Cartes Résumé, distances, top acheteurs et top titulaires en une seule
+    lecture de decp : les colonnes utiles des lignes filtrées sont
+    matérialisées une fois, puis agrégées par carte. Une seule ligne."""
+    where_sql, params = dashboard_filters_to_sql(**filter_params)
+    columns = {"titulaire_distance"} | {
+        c for org_type in ORG_TYPES for c in _top_orgs_columns(org_type)
+    }
+    columns_sql = ", ".join(f'"{c}"' for c in sorted(columns))
+    tops_sql = ", ".join(
+        f"""(
+            SELECT list(t ORDER BY t."Attributions" DESC, t."{org_type}_id")
+            FROM ({_top_orgs_select("lignes", org_type, TOP_PARTENAIRES)}) AS t
+        ) AS top_{org_type}s"""
+        for org_type in ORG_TYPES
+    )
+    sql = f"""
+        WITH lignes AS MATERIALIZED (
+            SELECT {columns_sql} FROM decp WHERE {where_sql}
+        )
+        SELECT
+            (SELECT s FROM ({_summary_select("lignes")}) AS s) AS summary,
+            (
+                SELECT h FROM ({_distance_histogram_select("lignes")}) AS h
+            ) AS distance_histogram,
+            {tops_sql}
+    """
+    return sql, params
+
+
+def _struct_list_frame(values: list | None, dtype: pl.List) -> pl.DataFrame:
+    schema = {field.name: field.dtype for field in dtype.inner.fields}
+    return pl.DataFrame(values or [], schema=schema, orient="row")
+
+
+def _query_dashboard_stats(filter_params: dict, cursor) -> dict:
+    dff = cursor.execute(*dashboard_stats_sql(filter_params)).pl()
+    row = dff.row(0, named=True)
+    return {
+        "summary": row["summary"],
+        "distance_histogram": row["distance_histogram"] or {},
+        **{
+            f"top_{org_type}s": _struct_list_frame(
+                row[f"top_{org_type}s"], dff.schema[f"top_{org_type}s"]
+            )
+            for org_type in ORG_TYPES
+        },
+    }
+
+
+def get_dashboard_stats(filter_params: dict, cursor=None) -> dict:
+    """Résultats de dashboard_stats_sql : summary (comme get_summary),
+    distance_histogram (comme get_distance_histogram_stats), top_acheteurs et
+    top_titulaires (comme get_top_orgs).
+
+    Les cartes qui les demandent en même temps dans ce worker, pour les mêmes
+    filtres, attendent le calcul de la première au lieu de relire decp.
+    """
+    key = repr(sorted(filter_params.items()))
+    with _stats_in_flight_lock:
+        future = _stats_in_flight.get(key)
+        leader = future is None
+        if leader:
+            future = _stats_in_flight[key] = Future()
+
+    if not leader:
+        return future.result(timeout=DASHBOARD_CARD_TIMEOUT)
+
+    try:
+        stats = _query_dashboard_stats(filter_params, cursor or get_cursor())
+        future.set_result(stats)
+        return stats
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _stats_in_flight_lock:
+            del _stats_in_flight[key]
+
+
+def _map_columns(org_type: str) -> list[str]:
+    return [f"{org_type}_{c}" for c in ["longitude", "latitude", "nom"]]
+
+
+def _has_coordinates(org_type: str) -> bool:
+    # Base sans coordonnées (données de test)
+    return set(_map_columns(org_type)) <= set(schema.names())
+
+
+def _choropleth_min_marches(region_code: str) -> int:
+    return CHOROPLETH_MIN_MARCHES.get(region_code, CHOROPLETH_MIN_MARCHES_DROM)
+
+
+def maps_sql(filter_params: dict, region_codes: list[str]) -> tuple[str, list]:
+    """Données de toutes les cartes en une seule lecture de decp.
+
+    Chaque ligne est rattachée à ses régions (l'Hexagone, ou les départements
+    d'outre-mer de l'acheteur et du titulaire), puis un GROUP BY GROUPING SETS
+    compte, par région (colonne ensemble) :
+
+    - "region" : les marchés ;
+    - "departement" : les marchés par département de l'acheteur ;
+    - "acheteur", "titulaire" : les lignes par organisation localisée.
+
+    Seul l'ensemble utile à la carte de chaque région (choroplèthe au-delà de
+    CHOROPLETH_MIN_MARCHES, sinon points) est renvoyé.
+    """
+    where_sql, params = dashboard_filters_to_sql(**filter_params)
+    drom_codes = [code for code in region_codes if code != "Hexagone"]
+    hexagone_sql = "['Hexagone']" if "Hexagone" in region_codes else "[]::VARCHAR[]"
+    regions_sql = f"""
+        CASE
+            WHEN length("acheteur_departement_code") = 2
+                AND length("titulaire_departement_code") = 2 THEN {hexagone_sql}
+            ELSE list_distinct(list_filter(
+                ["acheteur_departement_code", "titulaire_departement_code"],
+                code -> list_contains(?, code)
+            ))
+        END
+    """
+    params = [drom_codes] + params
+
+    org_types = [t for t in ["acheteur", "titulaire"] if _has_coordinates(t)]
+    columns = ["acheteur_departement_code"] + [
+        c for org_type in org_types for c in _map_columns(org_type)
+    ]
+    columns_sql = ", ".join(f'"{c}"' for c in columns)
+    grouping_sets = ["(region)", '(region, "acheteur_departement_code")'] + [
+        "(region, {})".format(", ".join(f'"{c}"' for c in _map_columns(org_type)))
+        for org_type in org_types
+    ]
+    ensemble_sql = "".join(
+        f"""WHEN grouping("{org_type}_nom") = 0 THEN '{org_type}' """
+        for org_type in org_types
+    )
+    markers_sql = " OR ".join(
+        f"""(ensemble = '{org_type}' AND "{org_type}_latitude" IS NOT NULL
+            AND "{org_type}_longitude" IS NOT NULL)"""
+        for org_type in org_types
+    )
+
+    threshold_sql = "CASE region {} END".format("WHEN ? THEN ? " * len(region_codes))
+    threshold_params = [
+        value
+        for code in region_codes
+        for value in (code, _choropleth_min_marches(code))
+    ]
+
+    sql = f"""
+        WITH lignes AS (
+            SELECT unnest({regions_sql}) AS region, uid, {columns_sql}
+            FROM decp WHERE {where_sql}
+        ),
+        ensembles AS (
+            SELECT region, {columns_sql},
+                CASE WHEN grouping("acheteur_departement_code") = 0
+                    THEN 'departement' {ensemble_sql}ELSE 'region' END AS ensemble,
+                count(DISTINCT uid) AS nb_marches,
+                count(*) AS nb_lignes
+            FROM lignes
+            GROUP BY GROUPING SETS ({", ".join(grouping_sets)})
+        ),
+        regions AS (
+            SELECT *,
+                max(nb_marches) FILTER (WHERE ensemble = 'region')
+                    OVER (PARTITION BY region) AS nb_marches_region,
+                {threshold_sql} AS seuil
+            FROM ensembles
+        )
+        SELECT * EXCLUDE (seuil) FROM regions
+        WHERE ensemble = 'region'
+            OR (ensemble = 'departement' AND nb_marches_region > seuil
+                AND "acheteur_departement_code" IS NOT NULL)
+            OR (nb_marches_region <= seuil AND ({markers_sql or "false"}))
+    """
+    return sql, params + threshold_params
+
+
+def get_maps_data(
+    filter_params: dict, region_codes: list[str], cursor=None
+) -> dict[str, tuple[list[pl.DataFrame], str | None]]:
+    """Données des cartes de chaque région et leur type (voir
+    src.figures.get_geographic_maps), calculées par une seule requête.
+
+    - "chloropleth" : un tableau (Département, uid), le nombre de marchés par
+      département de l'acheteur ;
+    - "clusters" : un tableau par type d'organisation (longitude, latitude,
+      nom, nb_marches) ;
+    - None quand aucun marché ne correspond.
+    """
+    cursor = cursor or get_cursor()
+    dff = cursor.execute(*maps_sql(filter_params, region_codes)).pl()
+
+    maps_data = {}
+    for code in region_codes:
+        region = dff.filter(pl.col("region") == code)
+        nb_marches = region.filter(pl.col("ensemble") == "region")["nb_marches"].sum()
+        if nb_marches == 0:
+            maps_data[code] = ([], None)
+        elif nb_marches > _choropleth_min_marches(code):
+            departements = region.filter(pl.col("ensemble") == "departement").select(
+                pl.col("acheteur_departement_code").alias("Département"),
+                pl.col("nb_marches").alias("uid"),
+            )
+            maps_data[code] = ([departements], "chloropleth")
+        else:
+            dfs = []
+            for org_type in ["acheteur", "titulaire"]:
+                names = _map_columns(org_type)
+                if not _has_coordinates(org_type):
+                    dfs.append(pl.DataFrame(schema=names + ["nb_marches"]))
+                    continue
+                dfs.append(
+                    region.filter(pl.col("ensemble") == org_type).select(
+                        *names, pl.col("nb_lignes").alias("nb_marches")
+                    )
+                )
+            maps_data[code] = (dfs, "clusters")
+    return maps_data
+
+
+_executor = ThreadPoolExecutor(
+    max_workers=DASHBOARD_WORKERS, thread_name_prefix="decp-dashboard"
+)
+
+
+def run_cards(
+    cards: dict[str, Callable[[duckdb.DuckDBPyConnection], object]],
+    timeout: float | None = None,
+) -> dict[str, object]:
+    """Calcule les cartes `cards` (nom -> fonction du curseur) en parallèle.
+
+    Chaque carte a son propre curseur. Le résultat d'une carte qui lève une
+    exception ou n'est pas terminée `timeout` secondes après le début de son
+    calcul (DASHBOARD_CARD_TIMEOUT par défaut) est l'exception : les autres
+    cartes n'en sont pas affectées. L'attente d'un thread libre du pool ne
+    compte pas dans ce délai. La requête d'une carte hors délai est interrompue.
+    """
+    timeout = DASHBOARD_CARD_TIMEOUT if timeout is None else timeout
+    cursors = {name: get_cursor() for name in cards}
+    started: dict[str, float] = {}
+
+    def run(name: str, compute: Callable) -> object:
+        started[name] = time.monotonic()
+        return compute(cursors[name])
+
+    futures = {
+        name: _executor.submit(run, name, compute) for name, compute in cards.items()
+    }
+
+    results = {}
+    for name, future in futures.items():
+        while True:
+            start = started.get(name)
+            # En file d'attente, le délai n'a pas commencé : nouvelle vérification
+            # au plus tard `timeout` secondes après
+            wait = timeout if start is None else start + timeout - time.monotonic()
+            try:
+                results[name] = future.result(max(0, wait))
+            except FutureTimeoutError as e:
+                if start is None:
+                    continue
+                logger.warning(f"Carte {name} : pas terminée après {timeout} s")
+                future.cancel()
+                cursors[name].interrupt()
+                results[name] = e
+            except Exception as e:
+                logger.exception(f"Carte {name} : {e!r}")
+                results[name] = e
+            break
+    return results
@@ -4,34 +4,26 @@ import os
 from collections import OrderedDict
 
 import polars as pl
-from httpx import HTTPError, get
-
-from src.db import get_cursor, query_marches, schema
-from src.utils import logger
+from httpx import get
+
+from src.build import DEFAULT_ORDER_BY, org_stats_select_sql
+from src.db import (
+    Generation,
+    database,
+    get_cursor,
+    get_generation,
+    query_marches,
+    schema,
+)
+from src.utils.artifacts import artifact_path
+from src.utils.cache import cache, per_generation
 
 logging.getLogger("httpx").setLevel("WARNING")
 
 
-def get_annuaire_data(siret: str) -> dict:
-    url = f"https://recherche-entreprises.api.gouv.fr/search?q={siret}"
-    try:
-        response = get(url).raise_for_status()
-        response = response.json()["results"][0]
-    except (HTTPError, IndexError):
-        response = None
-        logger.warning("Could not fetch data from recherche-entreprises.api.")
-    return response
-
-
 def get_statistics() -> dict:
-    return (
-        get(
-            "https://www.data.gouv.fr/api/1/datasets/r/0ccf4a75-f3aa-4b46-8b6a-18aeb63e36df",
-            follow_redirects=True,
-        )
-        .raise_for_status()
-        .json()
-    )
+    """Statistiques générales, lues dans leur copie locale (voir src.utils.artifacts)."""
+    return json.loads(artifact_path("statistics").read_text())
 
 
 def get_departements() -> dict:
@@ -92,10 +84,10 @@ def prepare_dashboard_data(**filter_params) -> pl.DataFrame:
     from src.utils.table_sql import dashboard_filters_to_sql
 
     where_sql, params = dashboard_filters_to_sql(**filter_params)
-    return query_marches(where_sql=where_sql, params=params)
+    return query_marches(where_sql=where_sql, params=params, order_by=DEFAULT_ORDER_BY)
 
 
-def build_org_frame(org_type: str) -> pl.DataFrame:
+def build_org_frame(org_type: str, generation: Generation) -> pl.DataFrame:
     org_cols = [
         c
         for c in schema.names()
@@ -105,11 +97,98 @@ def build_org_frame(org_type: str) -> pl.DataFrame:
     select_list = ", ".join(org_cols)
     group_list = ", ".join(org_cols)
     sql = f'SELECT {select_list}, COUNT(*) AS "Marchés" FROM decp GROUP BY {group_list}'
-    return get_cursor().execute(sql).pl()
+    return generation.cursor().execute(sql).pl()
+
+
+def get_org_frame(org_type: str, generation: Generation | None = None) -> pl.DataFrame:
+    """Acheteurs ou titulaires distincts (avec leur nombre de marchés).
+
+    Calculé une fois par génération de la base (remplace DF_ACHETEURS et
+    DF_TITULAIRES, figés à l'import).
+    """
+    generation = generation or get_generation()
+    return generation.memoize(
+        ("org_frame", org_type), lambda: build_org_frame(org_type, generation)
+    )
+
+
+def org_marches_where(
+    org_type: str, org_id: str, year: int | None = None
+) -> tuple[str, list]:
+    """Condition SQL des marchés d'un acheteur ou d'un titulaire, et ses paramètres."""
+    where_sql = f'"{org_type}_id" = ?'
+    params: list = [org_id]
+    if org_type == "titulaire":
+        where_sql += " AND \"titulaire_typeIdentifiant\" = 'SIRET'"
+    if year:
+        where_sql += ' AND year("dateNotification") = ?'
+        params.append(year)
+    return where_sql, params
+
+
+def get_org_marches(
+    org_type: str, org_id: str, year: int | None = None
+) -> pl.DataFrame:
+    """Marchés d'un acheteur ou d'un titulaire, du plus récent au plus ancien.
+
+    Pour le téléchargement complet seulement, sans cache : le tableau des
+    pages acheteur et titulaire est lu page par page dans DuckDB
+    (voir org_marches_where et src.utils.table._fetch_page_sql).
+    """
+    where_sql, params = org_marches_where(org_type, org_id, year)
+    return query_marches(where_sql, params, order_by=DEFAULT_ORDER_BY)
+
+
+@cache.memoize(make_name=per_generation)
+def get_org_stats(org_type: str, org_id: str, year: int | None = None) -> dict:
+    """Statistiques pré-calculées d'un acheteur ou d'un titulaire pour une année
+    (toutes les années si `year` est None), voir src.build.ORG_STATS_TABLES.
+
+    Si la génération courante n'a pas encore la table, la même requête est
+    exécutée sur les marchés de l'organisation.
+    """
+    name = f"{org_type}_stats"
+    where_sql = f'"{org_type}_id" = ?'
+    if name in get_generation().tables:
+        sql = f"SELECT * FROM {name} WHERE {where_sql}"
+    else:
+        sql = org_stats_select_sql(name, where_sql)
+    stats = (
+        get_cursor()
+        .execute(
+            f"SELECT * FROM ({sql}) WHERE annee IS NOT DISTINCT FROM ?",
+            [org_id, year],
+        )
+        .pl()
+    )
+    if stats.height == 0:
+        return {
+            "nb_lignes": 0,
+            "nb_marches": 0,
+            "nb_partenaires": 0,
+            "top_partenaires": [],
+            "distance_bins": None,
+        }
+    return stats.row(0, named=True)
+
+
+def org_data_handle(org_type: str, org_id: str, year: str | None) -> dict:
+    """Référence aux marchés d'une organisation, gardée dans le dcc.Store de la page.
+
+    `year` est la valeur du sélecteur d'année ("Toutes les années" ou une année).
+    """
+    year = int(year) if year and year != "Toutes les années" else None
+    return {"org_type": org_type, "org_id": org_id, "year": year}
+
+
+def _preload_org_frames(generation: Generation) -> None:
+    for org_type in ("acheteur", "titulaire"):
+        get_org_frame(org_type, generation)
 
 
-DF_ACHETEURS = build_org_frame("acheteur")
-DF_TITULAIRES = build_org_frame("titulaire")
+# Calcul à l'import pour la génération courante, puis avant chaque bascule
+_preload_org_frames(get_generation())
+database.on_new_generation(_preload_org_frames)
 DEPARTEMENTS = get_departements()
 DEPARTEMENTS_GEOJSON = get_departements_geojson()
 DATA_SCHEMA = get_data_schema()
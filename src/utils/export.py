@@ -0,0 +1,263 @@
+"""Exports des tableaux en tâche de fond (Excel, CSV, Parquet).
+
+Un clic sur un bouton d'export crée une tâche au lieu de produire le fichier
+dans le callback : la requête est exécutée par un pool borné de threads, qui
+écrit le fichier dans EXPORT_DIR (COPY … TO pour CSV et Parquet, sans limite
+de taille). La page interroge l'état de la tâche (voir src.utils.frontend)
+puis télécharge le fichier par /telechargements/<tâche>/<nom de fichier>
+(voir src/app.py), qui gère les requêtes Range (reprise des téléchargements).
+
+Les tâches sont enregistrées dans une table SQLite de EXPORT_DIR, partagée
+par les workers d'une même machine. L'identifiant d'une tâche est un hachage
+de la requête, de ses paramètres, du format et de la génération de la base :
+des exports identiques demandés en même temps ne sont exécutés qu'une fois.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from pathlib import Path
+from urllib.parse import quote
+
+from flask import Response, abort, send_file
+
+from src.db import get_cursor, get_generation
+from src.utils import logger
+
+EXPORT_DIR = Path(os.getenv("EXPORT_DIR", "/tmp/decp-exports"))
+# Les exports terminés restent téléchargeables pendant ce délai (secondes)
+EXPORT_TTL = int(os.getenv("EXPORT_TTL", 3600))
+# Nombre d'exports exécutés en même temps par worker
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", 2))
+# Au-delà, les nouvelles demandes d'export sont refusées
+EXPORT_MAX_PENDING = int(os.getenv("EXPORT_MAX_PENDING", 20))
+# Un export en cours dont l'avancement n'a pas été mis à jour depuis ce délai
+# est abandonné (worker arrêté pendant l'export)
+EXPORT_JOB_TIMEOUT = int(os.getenv("EXPORT_JOB_TIMEOUT", 600))
+
+EXPORT_FORMATS = {
+    "xlsx": {
+        "label": "Excel",
+        "copy_options": None,
+        "mimetype": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    },
+    "csv": {
+        "label": "CSV",
+        "copy_options": "FORMAT csv, HEADER",
+        "mimetype": "text/csv",
+    },
+    "parquet": {
+        "label": "Parquet",
+        "copy_options": "FORMAT parquet, COMPRESSION zstd",
+        "mimetype": "application/vnd.apache.parquet",
+    },
+}
+
+_JOB_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+_executor = ThreadPoolExecutor(
+    max_workers=EXPORT_WORKERS, thread_name_prefix="decp-export"
+)
+
+
+class ExportQueueFull(Exception):
+    """Trop d'exports en attente ou en cours."""
+
+
+def _jobs_db() -> sqlite3.Connection:
+    EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(EXPORT_DIR / "jobs.sqlite", timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "id TEXT PRIMARY KEY, format TEXT, filename TEXT, status TEXT, "
+        "progress REAL, size INTEGER, error TEXT, "
+        "created_at REAL, updated_at REAL)"
+    )
+    return conn
+
+
+def _update_job(job_id: str, **values) -> None:
+    values["updated_at"] = time.time()
+    assignments = ", ".join(f"{column} = ?" for column in values)
+    with closing(_jobs_db()) as conn, conn:
+        conn.execute(
+            f"UPDATE jobs SET {assignments} WHERE id = ?", [*values.values(), job_id]
+        )
+
+
+def _is_stale(job: sqlite3.Row, now: float) -> bool:
+    """Vrai pour une tâche abandonnée par son worker.
+
+    Un export en cours met à jour son avancement chaque seconde. Une tâche en
+    attente peut attendre longtemps un thread libre du pool : elle n'est
+    abandonnée qu'après EXPORT_TTL (worker arrêté avant de l'exécuter).
+    """
+    if job["status"] == "running":
+        return now - job["updated_at"] > EXPORT_JOB_TIMEOUT
+    return job["status"] == "pending" and now - job["updated_at"] > EXPORT_TTL
+
+
+def _job_path(job_id: str) -> Path:
+    return EXPORT_DIR / job_id
+
+
+def _purge_expired_jobs(conn: sqlite3.Connection, now: float) -> None:
+    """Supprime les exports expirés et abandonne les tâches sans nouvelles."""
+    for job in conn.execute("SELECT * FROM jobs").fetchall():
+        if _is_stale(job, now):
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? "
+                "WHERE id = ?",
+                ["Export interrompu", now, job["id"]],
+            )
+        elif job["status"] in ("done", "failed") and (
+            now - job["updated_at"] > EXPORT_TTL
+        ):
+            conn.execute("DELETE FROM jobs WHERE id = ?", [job["id"]])
+            _job_path(job["id"]).unlink(missing_ok=True)
+
+
+def job_id_for(sql: str, params: tuple | list, fmt: str) -> str:
+    """Identifiant d'un export : identique pour des requêtes identiques."""
+    key = json.dumps([get_generation().name, sql, list(params), fmt], default=str)
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def submit_export(sql: str, params: tuple | list, fmt: str, filename: str) -> str:
+    """Crée (ou retrouve) la tâche d'export de `sql` et retourne son identifiant.
+
+    `filename` est le nom proposé au navigateur, sans extension. Lève
+    ExportQueueFull si EXPORT_MAX_PENDING exports sont déjà en attente ou en
+    cours.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Format d'export inconnu : {fmt!r}")
+    job_id = job_id_for(sql, params, fmt)
+    now = time.time()
+
+    with closing(_jobs_db()) as conn, conn:
+        conn.execute("BEGIN IMMEDIATE")
+        _purge_expired_jobs(conn, now)
+        job = conn.execute("SELECT * FROM jobs WHERE id = ?", [job_id]).fetchone()
+        if job and job["status"] in ("pending", "running"):
+            logger.info(f"Export {job_id} déjà en cours, demande dédoublonnée")
+            return job_id
+        if job and job["status"] == "done" and _job_path(job_id).exists():
+            return job_id
+
+        (active,) = conn.execute(
+            "SELECT count(*) FROM jobs WHERE status IN ('pending', 'running')"
+        ).fetchone()
+        if active >= EXPORT_MAX_PENDING:
+            raise ExportQueueFull(f"{active} exports en attente ou en cours")
+        conn.execute(
+            "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, 'pending', 0, NULL, NULL, ?, ?)",
+            [job_id, fmt, f"{filename}.{fmt}", now, now],
+        )
+
+    _executor.submit(_run_job, job_id, sql, list(params), fmt)
+    return job_id
+
+
+def write_export(cursor, sql: str, params: list, fmt: str, path: Path) -> Path:
+    """Écrit le résultat de `sql` dans `path` au format `fmt`.
+
+    CSV et Parquet sont écrits par DuckDB sans passer par Python ; Excel
+    (limité à 65 000 lignes, voir get_button_properties) passe par Polars.
+    """
+    options = EXPORT_FORMATS[fmt]["copy_options"]
+    # Fichier partiel renommé à la fin : la route ne sert jamais un export incomplet
+    part = path.with_name(path.name + ".part")
+    try:
+        if options:
+            target = str(part).replace("'", "''")
+            cursor.execute(f"COPY ({sql}) TO '{target}' ({options})", params)
+        else:
+            cursor.execute(sql, params).pl().write_excel(part, worksheet="DECP")
+        part.rename(path)
+    finally:
+        part.unlink(missing_ok=True)
+    return path
+
+
+def _run_job(job_id: str, sql: str, params: list, fmt: str) -> None:
+    """Exécute l'export dans le pool et enregistre son avancement."""
+    start = time.perf_counter()
+    # La tâche a pu être abandonnée puis redemandée pendant son attente : un
+    # seul thread la passe en cours et l'exécute
+    with closing(_jobs_db()) as conn, conn:
+        claimed = conn.execute(
+            "UPDATE jobs SET status = 'running', updated_at = ? "
+            "WHERE id = ? AND status = 'pending'",
+            [time.time(), job_id],
+        ).rowcount
+    if not claimed:
+        logger.info(f"Export {job_id} déjà exécuté ou abandonné, ignoré")
+        return
+    cursor = get_cursor()
+    # Avancement de la requête lisible par query_progress() pendant l'export
+    cursor.execute("SET enable_progress_bar = true")
+    cursor.execute("SET enable_progress_bar_print = false")
+    errors: list[Exception] = []
+
+    def write():
+        try:
+            write_export(cursor, sql, params, fmt, _job_path(job_id))
+        except Exception as e:
+            errors.append(e)
+
+    writer = threading.Thread(target=write, name=f"decp-export-{job_id[:8]}")
+    writer.start()
+    while writer.is_alive():
+        writer.join(timeout=1)
+        _update_job(job_id, progress=max(cursor.query_progress(), 0))
+
+    if errors:
+        logger.error(f"Export {job_id} en échec : {errors[0]!r}")
+        _update_job(job_id, status="failed", error=str(errors[0]))
+        return
+    size = _job_path(job_id).stat().st_size
+    _update_job(job_id, status="done", progress=100, size=size)
+    logger.info(
+        f"Export {fmt} {job_id} : {size} octets en {time.perf_counter() - start:.1f} s"
+    )
+
+
+def get_job(job_id: str) -> dict | None:
+    """État de la tâche : status (pending, running, done, failed), progress…"""
+    if not job_id or not _JOB_ID_PATTERN.fullmatch(job_id):
+        return None
+    with closing(_jobs_db()) as conn:
+        job = conn.execute("SELECT * FROM jobs WHERE id = ?", [job_id]).fetchone()
+    if job is None:
+        return None
+    job = dict(job)
+    if _is_stale(job, time.time()):
+        job.update(status="failed", error="Export interrompu")
+    return job
+
+
+def download_url(job: dict) -> str:
+    return f"/telechargements/{job['id']}/{quote(job['filename'], safe='')}"
+
+
+def export_response(job_id: str, filename: str) -> Response:
+    """Fichier d'un export terminé, avec prise en charge des requêtes Range."""
+    job = get_job(job_id)
+    if job is None or job["status"] != "done" or not _job_path(job_id).exists():
+        abort(404)
+    return send_file(
+        _job_path(job_id),
+        mimetype=EXPORT_FORMATS[job["format"]]["mimetype"],
+        as_attachment=True,
+        download_name=job["filename"],
+        conditional=True,
+        max_age=0,
+    )
@@ -1,11 +1,23 @@
+import time
+
+import dash_bootstrap_components as dbc
+from dash import MATCH, Input, Output, callback, ctx, dcc, html, no_update
+
 from src.utils.data import DATA_SCHEMA
+from src.utils.export import (
+    EXPORT_FORMATS,
+    ExportQueueFull,
+    download_url,
+    get_job,
+    submit_export,
+)
 
 
 def get_button_properties(height):
     if height > 65000:
         download_disabled = True
-        download_text = "Téléchargement désactivé au-delà de 65 000 lignes"
-        download_title = " Ajoutez des filtres pour réduire le nombre de lignes, Excel ne supporte pas d'avoir plus de 65 000 URLs dans une même feuille de calcul."
+        download_text = "Excel désactivé au-delà de 65 000 lignes"
+        download_title = "Excel ne supporte pas d'avoir plus de 65 000 URLs dans une même feuille de calcul. Téléchargez au format CSV ou Parquet, ou ajoutez des filtres pour réduire le nombre de lignes."
     elif height == 0:
         download_disabled = True
         download_text = "Pas de données à télécharger"
@@ -17,6 +29,86 @@ def get_button_properties(height):
     return download_disabled, download_text, download_title
 
 
+def make_export_buttons(page: str) -> list:
+    """Boutons d'export CSV et Parquet (sans limite de lignes) et suivi de l'export.
+
+    Le callback d'export de la page écoute ces boutons et le bouton Excel de la
+    page, crée la tâche avec start_export et retourne son résultat dans
+    Output({"type": "export-job", "page": page}, "data"). poll_export suit
+    ensuite la tâche et lance le téléchargement une fois le fichier prêt.
+    """
+    buttons = [
+        dbc.Button(
+            properties["label"],
+            id={"type": "btn-export", "page": page, "format": fmt},
+            title=f"Télécharger les données telles qu'affichées au format {properties['label']}, sans limite de lignes",
+            className="btn btn-primary",
+            outline=True,
+        )
+        for fmt, properties in EXPORT_FORMATS.items()
+        if properties["copy_options"]
+    ]
+    return buttons + [
+        html.Div(id={"type": "export-status", "page": page}),
+        dcc.Store(id={"type": "export-job", "page": page}),
+        dcc.Interval(
+            id={"type": "export-interval", "page": page}, interval=1000, disabled=True
+        ),
+        # refresh=True : le navigateur suit l'URL, la réponse est un téléchargement
+        dcc.Location(id={"type": "export-location", "page": page}, refresh=True),
+    ]
+
+
+def requested_export_format(excel_button_id: str) -> str | None:
+    """Format demandé par le bouton qui a déclenché le callback d'export."""
+    if not ctx.triggered or not ctx.triggered[0]["value"]:
+        return None
+    if ctx.triggered_id == excel_button_id:
+        return "xlsx"
+    return ctx.triggered_id["format"]
+
+
+def start_export(sql: str, params: list, fmt: str, filename: str) -> dict:
+    """Crée la tâche d'export. Le résultat va dans le dcc.Store export-job."""
+    try:
+        job_id = submit_export(sql, params, fmt, filename)
+    except ExportQueueFull:
+        return {"error": "Trop d'exports en cours, réessayez dans quelques minutes."}
+    return {"id": job_id, "requested_at": time.time()}
+
+
+@callback(
+    Output({"type": "export-status", "page": MATCH}, "children"),
+    Output({"type": "export-interval", "page": MATCH}, "disabled"),
+    Output({"type": "export-location", "page": MATCH}, "href"),
+    Input({"type": "export-job", "page": MATCH}, "data"),
+    Input({"type": "export-interval", "page": MATCH}, "n_intervals"),
+    prevent_initial_call=True,
+)
+def poll_export(export_job, _n_intervals):
+    if not export_job:
+        return no_update, True, no_update
+    if export_job.get("error"):
+        return export_job["error"], True, no_update
+
+    job = get_job(export_job["id"])
+    if job is None or job["status"] == "failed":
+        return "L'export a échoué, réessayez plus tard.", True, no_update
+    if job["status"] == "done":
+        # Paramètre propre à chaque demande : un nouveau clic relance le téléchargement
+        return "", True, f"{download_url(job)}?demande={export_job['requested_at']}"
+
+    label = "En attente" if job["status"] == "pending" else f"{job['progress']:.0f} %"
+    progress = dbc.Progress(
+        value=job["progress"],
+        label=label,
+        striped=True,
+        animated=True,
+        style={"minWidth": "150px"},
+    )
+    return progress, False, no_update
+
+
 def get_enum_values_as_dict(column_name):
     try:
         options = {}
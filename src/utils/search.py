@@ -1,84 +1,433 @@
+"""Recherche d'acheteurs et de titulaires (page d'accueil).
+
+Pour chaque génération de la base, un index inversé est construit au premier
+chargement (voir `get_search_index`) : chaque mot, sans accents et en
+majuscules, de l'identifiant, du nom, du département (nom et code) et de la
+commune pointe vers la liste triée des organisations qui le contiennent.
+
+Une recherche garde les organisations dont un mot commence par chacun des
+termes saisis (ET) : les listes des mots commençant par un terme sont
+contiguës dans l'index, puis intersectées, de la plus courte à la plus longue.
+Les organisations étant numérotées par nombre de marchés décroissant, les k
+premiers résultats sont les k premières lignes de l'intersection.
+
+Le même index sert les suggestions pendant la saisie (route /suggestions,
+voir `suggest_org`) : seules les premières lignes correspondantes sont
+cherchées, à l'aide d'un index direct (mots de chaque ligne), sans calculer le
+nombre total.
+
+Quand une recherche ne trouve rien, elle est refaite en tolérant les fautes de
+frappe (`fuzzy_search`) : un index de trigrammes des mots des noms donne, pour
+chaque terme, les mots les plus proches (coefficient de Dice des trigrammes),
+dont les organisations sont classées par proximité puis nombre de marchés.
+"""
+
+import os
+from dataclasses import dataclass
+
+import numpy as np
 import polars as pl
-from unidecode import unidecode
 
+from src.db import Generation, database, get_generation
+from src.utils.data import get_org_frame
 from src.utils.table import add_links
 from src.utils.tracking import track_search
 
+# Nombre maximal d'organisations affichées par type
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", 200))
+# Nombre maximal de suggestions pendant la saisie, par type
+SUGGEST_MAX_RESULTS = int(os.getenv("SUGGEST_MAX_RESULTS", 8))
+# Au-delà de ce nombre de lignes, un terme n'est pas développé pour suggérer
+SUGGEST_SCAN_THRESHOLD = 50_000
+# Recherche approchée : proximité minimale (0 à 1) d'un mot avec le terme saisi,
+# et nombre maximal de mots proches retenus par terme
+SEARCH_FUZZY_THRESHOLD = float(os.getenv("SEARCH_FUZZY_THRESHOLD", 0.5))
+SEARCH_FUZZY_WORDS = int(os.getenv("SEARCH_FUZZY_WORDS", 10))
+# Un terme trouvé tel quel dans plus de lignes n'est pas corrigé
+SEARCH_FUZZY_MAX_EXACT = 1000
 
-def search_org(dff: pl.DataFrame, query: str, org_type: str) -> pl.DataFrame:
-    """
-    Search in either 'acheteur' or 'titulaire' DataFrame.
+# Au-delà du dernier caractère Unicode : borne des mots commençant par un terme
+_PREFIX_END = "\U0010ffff"
 
-    :param dff: Polars DataFrame with acheteur or titulaire columns
-    :param query: User search string
-    :param org_type: 'acheteur' or 'titulaire'
-    :return: Filtered DataFrame with 'matches' column
+# Trigrammes des mots normalisés, bordés d'une espace, numérotés en base 37
+_TRIGRAM_ALPHABET = " 0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+_TRIGRAM_CODES = np.zeros(256, dtype=np.int32)
+_TRIGRAM_CODES[np.frombuffer(_TRIGRAM_ALPHABET.encode(), np.uint8)] = np.arange(37)
+_NB_TRIGRAMS = 37**3
+
+
+def normalize_words(expr: pl.Expr) -> pl.Expr:
+    """Liste des mots de `expr`, sans accents et en majuscules."""
+    return (
+        expr.str.normalize("NFKD")
+        .str.replace_all(r"\p{Mn}", "")
+        .str.to_uppercase()
+        .str.replace_many(["Œ", "Æ"], ["OE", "AE"])
+        .str.extract_all(r"[0-9A-Z]+")
+    )
+
+
+def query_tokens(query: str) -> list[str]:
+    """Termes distincts de la recherche, normalisés comme les mots de l'index."""
+    words = pl.select(normalize_words(pl.lit(query))).to_series()[0]
+    return list(dict.fromkeys(words))
+
+
+def word_trigrams(words: pl.Series) -> tuple[np.ndarray, np.ndarray]:
+    """(position du mot dans `words`, trigramme) pour chaque trigramme distinct.
+
+    Chaque mot est bordé d'une espace : « LYON » donne « _LY », « LYO », « YON »
+    et « ON_ ». Les mots doivent être normalisés (chiffres et lettres A-Z).
     """
-    if not query.strip():
-        return dff.select(pl.lit(False).alias("matches"))
+    lengths = words.str.len_bytes().fill_null(0).to_numpy().astype(np.int64)
+    text = " " + "  ".join(words.fill_null("").to_list()) + " "
+    codes = _TRIGRAM_CODES[np.frombuffer(text.encode(), np.uint8)]
+    # Début de chaque trigramme dans `text` : un par caractère du mot
+    ends = np.cumsum(lengths)
+    starts = np.repeat(
+        np.cumsum(lengths + 2) - (lengths + 2) - (ends - lengths), lengths
+    )
+    starts += np.arange(ends[-1] if len(ends) else 0)
+    trigrams = codes[starts] * 37**2 + codes[starts + 1] * 37 + codes[starts + 2]
+    # Tri par (mot, trigramme), sans doublons
+    keys = np.sort(np.repeat(np.arange(len(words)), lengths) * _NB_TRIGRAMS + trigrams)
+    keys = keys[np.r_[True, keys[1:] != keys[:-1]]] if len(keys) else keys
+    return keys // _NB_TRIGRAMS, keys % _NB_TRIGRAMS
+
+
+@dataclass(frozen=True)
+class SearchIndex:
+    org_type: str
+    # Organisations, par nombre de marchés décroissant
+    orgs: pl.DataFrame
+    # Vocabulaire trié, et début de la liste de chaque mot dans `postings`
+    words: pl.Series
+    offsets: np.ndarray
+    # Numéros de lignes de `orgs`, triés pour chaque mot
+    postings: np.ndarray
+    # Index direct : numéros (dans `words`) des mots de chaque ligne, à partir
+    # de row_offsets[ligne]
+    row_offsets: np.ndarray
+    row_words: np.ndarray
+    # Index des trigrammes des mots des noms : numéros des mots contenant
+    # chaque trigramme, à partir de trigram_offsets[trigramme], et nombre de
+    # trigrammes distincts de chaque mot
+    trigram_offsets: np.ndarray
+    trigram_words: np.ndarray
+    word_trigram_counts: np.ndarray
+
+    def word_range(self, token: str) -> tuple[int, int]:
+        """Numéros des mots commençant par `token` (intervalle [début, fin[)."""
+        start = self.words.search_sorted(token, side="left")
+        end = self.words.search_sorted(token + _PREFIX_END, side="left")
+        return start, end
+
+    def lookup(self, token: str) -> np.ndarray:
+        """Lignes dont un mot commence par `token`, triées."""
+        start, end = self.word_range(token)
+        rows = self.postings[self.offsets[start] : self.offsets[end]]
+        if end - start <= 1:
+            return rows
+        # Union des listes de plusieurs mots (np.sort est bien plus rapide
+        # que np.unique ; au-delà d'un quart des lignes, un masque l'emporte)
+        if len(rows) * 4 < self.orgs.height:
+            rows = np.sort(rows)
+            return rows[np.r_[True, rows[1:] != rows[:-1]]]
+        seen = np.zeros(self.orgs.height, dtype=bool)
+        seen[rows] = True
+        return np.flatnonzero(seen)
+
+    def search(self, tokens: list[str], limit: int | None = None):
+        """(k premières lignes contenant tous les termes, nombre total)."""
+        if not tokens:
+            return self._results(np.array([], dtype=np.uint32)), 0
+        postings = sorted((self.lookup(t) for t in tokens), key=len)
+        rows = postings[0]
+        for other in postings[1:]:
+            if len(rows) == 0:
+                break
+            # `rows` est la plus courte : recherche dichotomique dans `other`
+            found = np.searchsorted(other, rows)
+            found[found == len(other)] = 0
+            rows = rows[other[found] == rows]
+        return self._results(rows[:limit]), len(rows)
+
+    def suggest(self, tokens: list[str], limit: int) -> pl.DataFrame:
+        """Les `limit` premières organisations dont un mot commence par chaque terme.
+
+        Contrairement à `search`, le nombre total n'est pas calculé : les
+        lignes candidates sont vérifiées par paquets, dans l'ordre, avec
+        l'index direct, jusqu'à en trouver assez. Les candidates sont celles du
+        terme le plus rare ou, si tous les termes sont fréquents (« C », début
+        de SIRET), toutes les lignes.
+        """
+        ranges = [self.word_range(t) for t in tokens]
+        sizes = [self.offsets[end] - self.offsets[start] for start, end in ranges]
+        if not ranges or min(sizes) == 0:
+            return self.orgs.clear()
+
+        rarest = int(np.argmin(sizes))
+        if sizes[rarest] <= SUGGEST_SCAN_THRESHOLD:
+            candidates = self.lookup(tokens[rarest])
+            ranges.pop(rarest)
+        else:
+            candidates = None
+        total = self.orgs.height if candidates is None else len(candidates)
+
+        found, count, start, size = [], 0, 0, 4 * limit
+        while count < limit and start < total:
+            if candidates is None:
+                rows = np.arange(start, min(start + size, total))
+            else:
+                rows = candidates[start : start + size]
+            rows = rows[self._match_all(rows, ranges)]
+            found.append(rows)
+            count += len(rows)
+            start += size
+            size *= 2
+        rows = np.concatenate(found)[:limit] if found else np.array([], dtype=np.int64)
+        return self.orgs[rows]
+
+    def similar_words(self, token: str) -> tuple[np.ndarray, np.ndarray]:
+        """(numéros, proximités) des mots des noms les plus proches de `token`."""
+        _, trigrams = word_trigrams(pl.Series([token]))
+        hits = np.concatenate(
+            [
+                self.trigram_words[
+                    self.trigram_offsets[t] : self.trigram_offsets[t + 1]
+                ]
+                for t in trigrams
+            ]
+        )
+        if len(hits) == 0:
+            return hits, np.zeros(0)
+        # Nombre de trigrammes en commun avec chaque mot
+        hits.sort()
+        firsts = np.flatnonzero(np.r_[True, hits[1:] != hits[:-1]])
+        words = hits[firsts]
+        shared = np.diff(np.r_[firsts, len(hits)])
+        similarity = 2 * shared / (len(trigrams) + self.word_trigram_counts[words])
+        best = np.argsort(-similarity, kind="stable")[:SEARCH_FUZZY_WORDS]
+        best = best[similarity[best] >= SEARCH_FUZZY_THRESHOLD]
+        return words[best], similarity[best]
 
-    # Enregistrement des recherche dans Matomo
-    track_search(query, "home_page_search")
+    def _token_scores(self, token: str) -> tuple[np.ndarray, np.ndarray]:
+        """(lignes triées, proximité) des organisations correspondant à `token`.
 
-    # Normalize query
-    normalized_query = unidecode(query.strip()).upper()
-    tokens = [" " + t.strip() for t in normalized_query.split() if t.strip()]
+        Les lignes trouvées telles quelles valent 1. Si elles sont rares, celles
+        des mots proches s'y ajoutent avec la proximité de leur mot.
+        """
+        rows = self.lookup(token)
+        if len(rows) > SEARCH_FUZZY_MAX_EXACT or len(token) < 3 or token.isdigit():
+            return rows, np.ones(len(rows))
+        words, similarity = self.similar_words(token)
+        lengths = self.offsets[words + 1] - self.offsets[words]
+        rows = np.concatenate(
+            [
+                rows,
+                *(self.postings[self.offsets[w] : self.offsets[w + 1]] for w in words),
+            ]
+        )
+        scores = np.concatenate(
+            [np.ones(len(rows) - lengths.sum()), np.repeat(similarity, lengths)]
+        )
+        if len(rows) == 0:
+            return rows, scores
+        # Meilleure proximité de chaque ligne
+        order = np.lexsort((-scores, rows))
+        rows, scores = rows[order], scores[order]
+        first = np.r_[True, rows[1:] != rows[:-1]]
+        return rows[first], scores[first]
 
-    # Define columns based on entity type
-    cols = [
-        f"{org_type}_id",
-        f"{org_type}_nom",
+    def fuzzy_search(self, tokens: list[str], limit: int | None = None):
+        """Comme `search`, en remplaçant chaque terme par les mots proches.
+
+        Les lignes sont classées par somme des proximités des termes, puis par
+        nombre de marchés.
+        """
+        if not tokens:
+            return self._results(np.array([], dtype=np.uint32)), 0
+        matches = sorted(
+            (self._token_scores(t) for t in tokens), key=lambda m: len(m[0])
+        )
+        rows, scores = matches[0]
+        for other_rows, other_scores in matches[1:]:
+            if len(rows) == 0:
+                break
+            found = np.searchsorted(other_rows, rows)
+            found[found == len(other_rows)] = 0
+            keep = other_rows[found] == rows
+            rows, scores = rows[keep], scores[keep] + other_scores[found[keep]]
+        order = np.lexsort((rows, -scores))
+        return self._results(rows[order][:limit]), len(rows)
+
+    def _match_all(self, rows: np.ndarray, ranges: list[tuple[int, int]]):
+        """Masque des lignes `rows` ayant un mot dans chacun des intervalles."""
+        keep = np.ones(len(rows), dtype=bool)
+        if not ranges or len(rows) == 0:
+            return keep
+        firsts = self.row_offsets[rows]
+        lengths = self.row_offsets[rows + 1] - firsts
+        # Mots de chaque ligne, et ligne (dans `rows`) de chaque mot
+        ends = np.cumsum(lengths)
+        positions = np.arange(ends[-1]) + np.repeat(firsts - (ends - lengths), lengths)
+        word_ids = self.row_words[positions]
+        owners = np.repeat(np.arange(len(rows)), lengths)
+        for start, end in ranges:
+            has_word = np.zeros(len(rows), dtype=bool)
+            has_word[owners[(word_ids >= start) & (word_ids < end)]] = True
+            keep &= has_word
+        return keep
+
+    def _results(self, rows: np.ndarray) -> pl.DataFrame:
+        """Lignes `rows` telles qu'affichées (noms et identifiants en liens)."""
+        org_id, org_nom = f"{self.org_type}_id", f"{self.org_type}_nom"
+        return add_links(self.orgs[rows]).select(
+            org_id, org_nom, "Département", "Marchés"
+        )
+
+
+def build_search_index(dff: pl.DataFrame, org_type: str) -> SearchIndex:
+    """Index d'un tableau d'organisations (voir src.utils.data.get_org_frame)."""
+    org_id, org_nom = f"{org_type}_id", f"{org_type}_nom"
+    departement = pl.concat_str(
+        pl.col(f"{org_type}_departement_nom"),
+        pl.lit(" ("),
+        pl.col(f"{org_type}_departement_code"),
+        pl.lit(")"),
+    )
+    text = pl.concat_str(
+        org_id,
+        org_nom,
         f"{org_type}_departement_nom",
         f"{org_type}_departement_code",
         f"{org_type}_commune_nom",
-    ]
+        separator=" ",
+        ignore_nulls=True,
+    )
+    link_cols = ["titulaire_typeIdentifiant"] if org_type == "titulaire" else []
+
+    # Une ligne par organisation affichée, avec les mots de toutes ses communes
+    orgs = (
+        dff.lazy()
+        .group_by(org_id, org_nom, departement.alias("Département"))
+        .agg(
+            pl.col("Marchés").sum(),
+            *[pl.col(c).first() for c in link_cols],
+            normalize_words(text).list.explode(keep_nulls=False).unique().alias("mots"),
+        )
+        .sort(["Marchés", org_id], descending=[True, False], nulls_last=True)
+        .with_row_index("ligne")
+        .collect()
+    )
+
+    postings = (
+        orgs.lazy()
+        .select("ligne", "mots")
+        .explode("mots")
+        .drop_nulls("mots")
+        .sort("mots", "ligne")
+        .with_columns(pl.col("mots").rle_id().alias("mot"))
+        .collect()
+    )
+    words = postings.group_by("mots", maintain_order=True).len()
+    offsets = np.zeros(words.height + 1, dtype=np.int64)
+    offsets[1:] = words["len"].cum_sum().to_numpy()
+
+    by_row = postings.select("ligne", "mot").sort("ligne", "mot")
+    row_offsets = np.zeros(orgs.height + 1, dtype=np.int64)
+    row_offsets[1:] = np.cumsum(
+        np.bincount(by_row["ligne"].to_numpy(), minlength=orgs.height)
+    )
 
-    # Concatenate all fields into one string per row
-    org_str = pl.concat_str(pl.lit(" "), pl.col(cols), separator=" ").str.replace(
-        "-", " "
+    # Trigrammes des mots des noms (et non des identifiants ou des communes)
+    name_words = (
+        orgs.lazy()
+        .select(normalize_words(pl.col(org_nom)).list.explode(keep_nulls=False))
+        .unique()
+        .collect()
+        .to_series()
     )
+    name_words = words["mots"].search_sorted(name_words.sort())
+    word_ids, trigrams = word_trigrams(words["mots"].gather(name_words))
+    word_ids = name_words.to_numpy()[word_ids]
+    order = np.argsort(trigrams, kind="stable")
+    trigram_offsets = np.zeros(_NB_TRIGRAMS + 1, dtype=np.int64)
+    trigram_offsets[1:] = np.cumsum(np.bincount(trigrams, minlength=_NB_TRIGRAMS))
 
-    # For each token, create a boolean column: True if token is found
-    token_matches = []
-    for token in tokens:
-        token_match = org_str.str.contains(token).alias(f"token_{token}")
-        token_matches.append(token_match)
-
-    # Count how many tokens match per row
-    match_score = pl.sum_horizontal(token_matches).alias("match_score")
-
-    # For each token, create a boolean column: True if token is found
-    token_matches = []
-    for token in tokens:
-        token_match = org_str.str.contains(token).alias(f"token_{token}")
-        token_matches.append(token_match)
-
-    # Sélection des colonnes
-    if org_type == "acheteur":
-        dff = dff.select(cols + ["Marchés"])
-    if org_type == "titulaire":
-        dff = dff.select(cols + ["Marchés", "titulaire_typeIdentifiant"])
-
-    # Apply and filter
-    dff = (
-        dff.with_columns(token_matches + [match_score])
-        .filter(pl.col("match_score") == len(tokens))
-        .drop([f"token_{token}" for token in tokens])
+    return SearchIndex(
+        org_type=org_type,
+        orgs=orgs.drop("ligne", "mots"),
+        words=words["mots"],
+        offsets=offsets,
+        postings=postings["ligne"].to_numpy(),
+        row_offsets=row_offsets,
+        row_words=by_row["mot"].to_numpy(),
+        trigram_offsets=trigram_offsets,
+        trigram_words=word_ids[order],
+        word_trigram_counts=np.bincount(word_ids, minlength=words.height),
     )
 
-    # Format result
-    dff = add_links(dff)
-    dff = dff.with_columns(
-        pl.concat_str(
-            pl.col(f"{org_type}_departement_nom"),
-            pl.lit(" ("),
-            pl.col(f"{org_type}_departement_code"),
-            pl.lit(")"),
-        ).alias("Département")
+
+def get_search_index(
+    org_type: str, generation: Generation | None = None
+) -> SearchIndex:
+    """Index de recherche des acheteurs ou titulaires, une fois par génération."""
+    generation = generation or get_generation()
+    return generation.memoize(
+        ("search_index", org_type),
+        lambda: build_search_index(get_org_frame(org_type, generation), org_type),
     )
 
-    dff = dff.select(f"{org_type}_id", f"{org_type}_nom", "Département", "Marchés")
-    dff = dff.group_by(f"{org_type}_id", f"{org_type}_nom", "Département").sum()
-    dff = dff.sort("Marchés", descending=True)
 
-    return dff
+def search_org(
+    query: str, org_type: str, limit: int | None = SEARCH_MAX_RESULTS
+) -> tuple[pl.DataFrame, int, bool]:
+    """
+    Search acheteurs or titulaires whose words start with every query token.
+
+    When nothing matches, the search is run again with typo tolerance.
+
+    :param query: User search string
+    :param org_type: 'acheteur' or 'titulaire'
+    :param limit: Maximum number of returned rows (None: all)
+    :return: (rows, total number of matches, whether matches are approximate)
+    """
+    if query.strip():
+        # Enregistrement des recherche dans Matomo
+        track_search(query, "home_page_search")
+    index = get_search_index(org_type)
+    tokens = query_tokens(query)
+    results, count = index.search(tokens, limit)
+    if count == 0 and tokens:
+        results, count = index.fuzzy_search(tokens, limit)
+        return results, count, count > 0
+    return results, count, False
+
+
+def suggest_org(
+    query: str, org_type: str, limit: int = SUGGEST_MAX_RESULTS
+) -> list[dict]:
+    """Suggestions pendant la saisie : [{"value": identifiant, "label": nom}]."""
+    tokens = query_tokens(query)
+    if not tokens:
+        return []
+    orgs = get_search_index(org_type).suggest(tokens, limit)
+    return [
+        {
+            "value": org[f"{org_type}_id"],
+            "label": " – ".join(
+                v for v in (org[f"{org_type}_nom"], org["Département"]) if v
+            ),
+        }
+        for org in orgs.iter_rows(named=True)
+    ]
+
+
+def _preload_search_indexes(generation: Generation) -> None:
+    for org_type in ("acheteur", "titulaire"):
+        get_search_index(org_type, generation)
+
+
+_preload_search_indexes(get_generation())
+database.on_new_generation(_preload_search_indexes)
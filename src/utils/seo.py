@@ -1,13 +1,16 @@
 from src.utils import DOMAIN_NAME
-from src.utils.data import get_annuaire_data
+from src.utils.annuaire import get_annuaire_data
 
 
 def make_org_jsonld(org_id, org_type, org_name=None, type_org_id="SIRET") -> dict:
     org_types = {"acheteur": "GovernmentOrganization", "titulaire": "Organization"}
     address = None
+    etablissements = None
     if type_org_id.lower() == "siret" and len(org_id) == 14:
-        annuaire_data = get_annuaire_data(org_id)
-        annuaire_address = annuaire_data["matching_etablissements"][0]
+        annuaire_data = get_annuaire_data(org_id) or {}
+        etablissements = annuaire_data.get("matching_etablissements")
+    if etablissements:
+        annuaire_address = etablissements[0]
         code_postal = annuaire_address["code_postal"]
         commune = annuaire_address["libelle_commune"]
 
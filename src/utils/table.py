@@ -5,9 +5,16 @@ import polars as pl
 from dash import no_update
 from polars import selectors as cs
 
-from src.db import count_marches, count_unique_marches, query_marches, schema
+from src.build import DEFAULT_ORDER_BY, DEFAULT_SORT_KEYS
+from src.db import (
+    export_sql,
+    get_generation,
+    query_marches,
+    query_page,
+    schema,
+)
 from src.utils import logger
-from src.utils.cache import cache
+from src.utils.cache import cache, per_generation
 from src.utils.data import DATA_SCHEMA
 from src.utils.frontend import get_button_properties
 from src.utils.tracking import track_search
@@ -390,61 +397,180 @@ def postprocess_page(dff: pl.DataFrame) -> pl.DataFrame:
     return dff
 
 
-@cache.memoize()
+# Nombre de pages précédentes dont la borne est cherchée dans le cache
+PAGE_BOUNDARIES_LOOKBACK = 50
+
+
+def _page_boundary_key(where_sql, params, sort_keys, page_size, page: int) -> str:
+    """Clé de cache de la borne (dernière ligne) d'une page d'un filtre/tri.
+
+    Une clé par page, par génération : les workers ajoutent leurs bornes sans
+    lire ni réécrire celles des autres.
+    """
+    query = (where_sql, tuple(params), tuple(sort_keys), page_size)
+    return f"page_boundary@{get_generation().name}:{query!r}:{page}"
+
+
+def _known_boundaries(where_sql, params, sort_keys, page_size, page_current) -> dict:
+    """Bornes en cache des PAGE_BOUNDARIES_LOOKBACK pages précédant page_current."""
+    pages = range(max(0, page_current - PAGE_BOUNDARIES_LOOKBACK), page_current)
+    if not pages:
+        return {}
+    keys = [
+        _page_boundary_key(where_sql, params, sort_keys, page_size, p) for p in pages
+    ]
+    return {
+        page: boundary
+        for page, boundary in zip(pages, cache.get_many(*keys), strict=True)
+        if boundary is not None
+    }
+
+
+def _totals_key(where_sql, params) -> str:
+    """Clé de cache des totaux d'un filtre : ils ne dépendent ni du tri ni de la page."""
+    return f"totals@{get_generation().name}:{(where_sql, tuple(params))!r}"
+
+
+def _page_start(boundaries: dict, page_current: int, page_size: int):
+    """Point de départ de la page : (after, offset).
+
+    Reprend après la dernière ligne de la page précédente si elle est connue,
+    sinon après la borne connue la plus proche, complétée d'un OFFSET (saut
+    direct vers une page lointaine).
+    """
+    known = [p for p in boundaries if p < page_current]
+    if not known:
+        return None, page_current * page_size
+    nearest = max(known)
+    return boundaries[nearest], (page_current - 1 - nearest) * page_size
+
+
+@cache.memoize(make_name=per_generation)
 def _fetch_page_sql(
     filter_query: str | None,
     sort_by_key: tuple,
     page_current: int,
     page_size: int,
+    where_sql: str = "TRUE",
+    params: tuple = (),
 ) -> tuple[pl.DataFrame, int, int]:
     """Chemin rapide : filtre/tri/pagine dans DuckDB, post-traite la page seule.
 
+    Pagination par clé : la dernière ligne de chaque page servie est gardée en
+    cache (par filtre et tri) pour que la page suivante reprenne après elle.
+    Les totaux sont gardés en cache par filtre : changer de page ou de tri ne
+    les recalcule pas. `where_sql` restreint les lignes du tableau (marchés
+    d'un acheteur ou d'un titulaire, voir org_marches_where).
+
     Retourne (page_dataframe_post_traitée, total_count, total_unique_count).
     """
     # Import local pour éviter une dépendance circulaire
     # (src.utils.table_sql importe split_filter_part depuis src.utils.table).
-    from src.utils.table_sql import filter_query_to_sql, sort_by_to_sql
+    from src.utils.table_sql import (
+        filter_query_columns,
+        filter_query_to_sql,
+        sort_by_to_keys,
+    )
 
     logger.debug(
         f"Cache miss SQL — filter={filter_query!r} sort={sort_by_key!r} "
         f"page={page_current} size={page_size}"
     )
 
-    where_sql, params = filter_query_to_sql(filter_query or "", schema)
+    filter_sql, filter_params = filter_query_to_sql(filter_query or "", schema)
+    # Colonnes filtrées inconnues (None) pour les marchés d'une organisation
+    filtered_columns = (
+        filter_query_columns(filter_query, schema) if where_sql == "TRUE" else None
+    )
+    if where_sql != "TRUE":
+        filter_sql = f"({where_sql}) AND {filter_sql}"
+    where_sql, params = filter_sql, [*params, *filter_params]
 
     sort_by_dash = [
         {"column_id": col, "direction": direction} for col, direction in sort_by_key
     ]
-    order_by = sort_by_to_sql(sort_by_dash, schema) or None
+    sort_keys = sort_by_to_keys(sort_by_dash, schema) or DEFAULT_SORT_KEYS
 
-    total = count_marches(where_sql, params)
-    total_unique = count_unique_marches(where_sql, params)
+    boundaries = _known_boundaries(
+        where_sql, params, sort_keys, page_size, page_current
+    )
+    after, offset = _page_start(boundaries, page_current, page_size)
+    totals_key = _totals_key(where_sql, params)
+    totals = cache.get(totals_key)
 
-    page = query_marches(
+    page, total, total_unique, last_key = query_page(
         where_sql=where_sql,
         params=params,
-        order_by=order_by,
+        sort_keys=sort_keys,
         limit=page_size,
-        offset=page_current * page_size,
+        offset=offset,
+        after=after,
+        totals=totals,
+        filtered_columns=filtered_columns,
     )
+    if totals is None:
+        cache.set(totals_key, (total, total_unique))
+    if last_key is not None:
+        cache.set(
+            _page_boundary_key(where_sql, params, sort_keys, page_size, page_current),
+            last_key,
+        )
 
     page = postprocess_page(page)
     return page, total, total_unique
 
 
+def table_export_sql(
+    filter_query: str | None,
+    sort_by: list | None,
+    hidden_columns: list | None = None,
+    where_sql: str = "TRUE",
+    params: tuple | list = (),
+) -> tuple[str, list]:
+    """Requête des lignes d'un tableau à exporter : filtre, tri et colonnes visibles.
+
+    Le filtre et le tri sont traduits en SQL comme pour l'affichage
+    (_fetch_page_sql) : seules les lignes et colonnes exportées sortent de
+    DuckDB, dans l'ordre de l'écran. `where_sql` restreint les lignes du
+    tableau (marchés d'un acheteur, filtres de l'observatoire).
+    """
+    from src.utils.table_sql import filter_query_to_sql, sort_by_to_keys
+
+    filter_sql, filter_params = filter_query_to_sql(filter_query or "", schema)
+    sort_keys = sort_by_to_keys(sort_by or [], schema) or DEFAULT_SORT_KEYS
+    hidden = set(hidden_columns or [])
+    columns = [col for col in schema.names() if col not in hidden]
+    return export_sql(
+        f"({where_sql}) AND {filter_sql}",
+        [*params, *filter_params],
+        sort_keys,
+        columns,
+    )
+
+
 def prepare_table_data(
-    data, data_timestamp, filter_query, page_current, page_size, sort_by, source_table
+    data,
+    data_timestamp,
+    filter_query,
+    page_current,
+    page_size,
+    sort_by,
+    source_table,
+    where_sql: str = "TRUE",
+    params: tuple = (),
 ):
     """
     Fonction de préparation des données pour les datatables, afin de permettre une gestion fine des logiques,
     notamment pour les filtres et les tris.
-    :param data
+    :param data: None pour lire decp dans DuckDB (restreinte par where_sql)
     :param data_timestamp:
     :param filter_query:
     :param page_current:
     :param page_size:
     :param sort_by:
     :param source_table:
+    :param where_sql: condition SQL des lignes du tableau, si data est None
+    :param params: paramètres de where_sql
     :return:
     """
     logger.debug(" + + + + + + + + + + + + + + + + + + ")
@@ -455,13 +581,15 @@ def prepare_table_data(
     trigger_cleanup = no_update if source_table == "tableau" else str(uuid.uuid4())
 
     if data is None:
-        # Probablement car il s'agit de la page Tableau
+        # Page Tableau, ou marchés d'une organisation (where_sql) : tout dans DuckDB
         sort_by_key = normalize_sort_by(sort_by)
         dff, height, total_unique = _fetch_page_sql(
             filter_query=filter_query,
             sort_by_key=sort_by_key,
             page_current=page_current,
             page_size=page_size,
+            where_sql=where_sql,
+            params=tuple(params),
         )
     else:
         if isinstance(data, list):
@@ -471,7 +599,7 @@ def prepare_table_data(
         elif isinstance(data, pl.LazyFrame):
             lff = data
         else:
-            lff = query_marches().lazy()
+            lff = query_marches(order_by=DEFAULT_ORDER_BY).lazy()
 
         if filter_query:
             lff = filter_table_data(lff, filter_query)
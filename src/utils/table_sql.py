@@ -2,6 +2,7 @@ from datetime import datetime, timedelta
 
 import polars as pl
 
+from src.db import keys_to_order_by
 from src.utils import logger
 from src.utils.table import split_filter_part
 
@@ -75,16 +76,23 @@ def filter_query_to_sql(filter_query: str, schema: pl.Schema) -> tuple[str, list
     return " AND ".join(clauses), params
 
 
-def sort_by_to_sql(sort_by: list[dict] | None, schema: pl.Schema) -> str:
-    """Traduit sort_by (format Dash) en clause ORDER BY DuckDB.
+def filter_query_columns(filter_query: str, schema: pl.Schema) -> set[str]:
+    """Colonnes du schéma sur lesquelles porte filter_query (voir filter_query_to_sql)."""
+    columns = set()
+    for part in (filter_query or "").split(" && "):
+        col_name, _operator, _raw_value = split_filter_part(part)
+        if isinstance(col_name, str) and col_name in schema.names():
+            columns.add(col_name)
+    return columns
 
-    Retourne '' si pas de tri (aucun ORDER BY à ajouter).
-    """
-    if not sort_by:
-        return ""
 
-    fragments: list[str] = []
-    for entry in sort_by:
+def sort_by_to_keys(sort_by: list[dict] | None, schema: pl.Schema) -> list[tuple]:
+    """Traduit sort_by (format Dash) en liste de (colonne, "ASC" | "DESC").
+
+    Les colonnes et directions inconnues sont ignorées.
+    """
+    keys: list[tuple] = []
+    for entry in sort_by or []:
         col = entry.get("column_id")
         direction = entry.get("direction")
         if col not in schema.names():
@@ -93,9 +101,16 @@ def sort_by_to_sql(sort_by: list[dict] | None, schema: pl.Schema) -> str:
         if direction not in ("asc", "desc"):
             logger.warning(f"Tri sur direction inconnue ignoré : {direction!r}")
             continue
-        fragments.append(f'"{col}" {direction.upper()} NULLS LAST')
+        keys.append((col, direction.upper()))
+    return keys
 
-    return ", ".join(fragments)
+
+def sort_by_to_sql(sort_by: list[dict] | None, schema: pl.Schema) -> str:
+    """Traduit sort_by (format Dash) en clause ORDER BY DuckDB.
+
+    Retourne '' si pas de tri (aucun ORDER BY à ajouter).
+    """
+    return keys_to_order_by(sort_by_to_keys(sort_by, schema))
 
 
 def dashboard_filters_to_sql(
@@ -116,17 +131,22 @@ def dashboard_filters_to_sql(
     dashboard_marche_sous_traitance_declaree=None,
     dashboard_montant_min=None,
     dashboard_montant_max=None,
+    with_period: bool = True,
 ) -> tuple[str, list]:
-    """Traduit les filtres du tableau de bord en (where_clause, params) DuckDB."""
+    """Traduit les filtres du tableau de bord en (where_clause, params) DuckDB.
+
+    Avec `with_period=False`, la période (année ou 12 derniers mois) n'est pas
+    filtrée : l'appelant la traduit lui-même (voir src.utils.cube).
+    """
     clauses: list[str] = []
     params: list = []
 
-    if dashboard_year:
+    if with_period and dashboard_year:
         clauses.append('YEAR("dateNotification") = ?')
         params.append(int(dashboard_year))
-    else:
+    elif with_period:
         clauses.append('"dateNotification" > ?')
-        params.append(datetime.now() - timedelta(days=365))
+        params.append(default_period_start())
 
     if dashboard_acheteur_id:
         clauses.append('"acheteur_id" LIKE ?')
@@ -200,9 +220,16 @@ def dashboard_filters_to_sql(
         clauses.append('"montant" <= ?')
         params.append(dashboard_montant_max)
 
+    if not clauses:
+        return "TRUE", []
     return " AND ".join(clauses), params
 
 
+def default_period_start() -> datetime:
+    """Début (exclu) de la période par défaut du tableau de bord : 12 derniers mois."""
+    return datetime.now() - timedelta(days=365)
+
+
 def tokenize_text_filter(column: str, text: str) -> tuple[str, list]:
     terms = text.split()
 
@@ -1,30 +1,166 @@
+"""Suivi des recherches dans Matomo, hors du chemin des requêtes.
+
+track_search ajoute l'événement à une file bornée (TRACKING_QUEUE_SIZE) au
+lieu d'appeler Matomo : un thread envoie les événements par lots avec l'API
+de suivi groupé (bulk tracking), au plus tard TRACKING_FLUSH_INTERVAL secondes
+après leur ajout. Quand la file est pleine (Matomo lent ou injoignable), les
+nouveaux événements sont abandonnés et comptés dans `metrics`.
+"""
+
 import os
+import queue
+import threading
+import time
 import uuid
-from time import localtime
+from urllib.parse import urlencode
 
 from httpx import post
 
-from src.utils import DEVELOPMENT
+from src.utils import DEVELOPMENT, logger
+
+TRACKING_QUEUE_SIZE = int(os.getenv("TRACKING_QUEUE_SIZE", 1000))
+TRACKING_BATCH_SIZE = int(os.getenv("TRACKING_BATCH_SIZE", 50))
+TRACKING_FLUSH_INTERVAL = float(os.getenv("TRACKING_FLUSH_INTERVAL", 5))
+TRACKING_TIMEOUT = float(os.getenv("TRACKING_TIMEOUT", 5))
+
+
+class TrackingDispatcher:
+    """File d'événements Matomo vidée par lots par un thread de fond."""
+
+    def __init__(
+        self,
+        endpoint: str,
+        token: str | None,
+        maxsize: int = TRACKING_QUEUE_SIZE,
+        batch_size: int = TRACKING_BATCH_SIZE,
+        flush_interval: float = TRACKING_FLUSH_INTERVAL,
+        timeout: float = TRACKING_TIMEOUT,
+    ):
+        self.endpoint = endpoint
+        self.token = token
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.metrics = {"queued": 0, "sent": 0, "dropped": 0, "failed": 0}
+        self._queue: queue.Queue[dict] = queue.Queue(maxsize=maxsize)
+        self._send_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+
+    def _count(self, metric: str, n: int = 1) -> int:
+        with self._metrics_lock:
+            self.metrics[metric] += n
+            return self.metrics[metric]
+
+    def enqueue(self, params: dict) -> bool:
+        """Ajoute un événement sans attendre ; False s'il a été abandonné."""
+        try:
+            self._queue.put_nowait(params)
+        except queue.Full:
+            dropped = self._count("dropped")
+            if dropped % 100 == 1:
+                logger.warning(f"File Matomo pleine : {dropped} événements abandonnés")
+            return False
+        self._count("queued")
+        return True
+
+    def flush(self) -> None:
+        """Envoie tous les événements en attente."""
+        while batch := self._take(self.batch_size, wait=0):
+            self._send(batch)
+
+    def start(self) -> "TrackingDispatcher":
+        """Démarre le thread d'envoi (une seule fois)."""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="decp-tracking", daemon=True
+                )
+                self._thread.start()
+        return self
+
+    def _take(self, size: int, wait: float | None) -> list[dict]:
+        """Jusqu'à `size` événements, en attendant au plus `wait` s le premier."""
+        batch = []
+        try:
+            batch.append(
+                self._queue.get(timeout=wait) if wait else self._queue.get_nowait()
+            )
+            while len(batch) < size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take(self.batch_size, wait=self.flush_interval)
+            # Laisse s'accumuler les événements suivants jusqu'au prochain envoi
+            if 0 < len(batch) < self.batch_size:
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size and time.monotonic() < deadline:
+                    batch += self._take(
+                        self.batch_size - len(batch),
+                        wait=max(deadline - time.monotonic(), 0.01),
+                    )
+            if batch:
+                try:
+                    self._send(batch)
+                except Exception as e:
+                    # Le thread doit survivre à toute erreur, sinon la file
+                    # se remplit et tous les événements suivants sont abandonnés
+                    self._count("failed", len(batch))
+                    logger.exception(
+                        f"Envoi de {len(batch)} événements à Matomo : {e!r}"
+                    )
+
+    def _send(self, batch: list[dict]) -> None:
+        body = {"requests": [f"?{urlencode(params)}" for params in batch]}
+        if self.token:
+            body["token_auth"] = self.token
+        with self._send_lock:
+            try:
+                post(self.endpoint, json=body, timeout=self.timeout).raise_for_status()
+            except Exception as e:
+                # HTTPError, mais aussi InvalidURL (MATOMO_DOMAIN mal formé)
+                self._count("failed", len(batch))
+                logger.warning(f"Envoi de {len(batch)} événements à Matomo : {e!r}")
+                return
+            self._count("sent", len(batch))
+
+
+_dispatcher: TrackingDispatcher | None = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> TrackingDispatcher:
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = TrackingDispatcher(
+                endpoint=f"https://{os.getenv('MATOMO_DOMAIN')}/matomo.php",
+                token=os.getenv("MATOMO_TOKEN"),
+            ).start()
+        return _dispatcher
 
 
 def track_search(query, category):
     if len(query) >= 4 and not DEVELOPMENT and os.getenv("MATOMO_DOMAIN"):
-        url = "https://decp.info"
+        now = time.localtime()
         params = {
             "idsite": os.getenv("MATOMO_ID_SITE"),
-            "url": url,
+            "url": "https://decp.info",
             "rec": "1",
             "action_name": "search" if category == "home_page_search" else "filter",
             "search_cat": category,
             "rand": uuid.uuid4().hex,
             "apiv": "1",
-            "h": localtime().tm_hour,
-            "m": localtime().tm_min,
-            "s": localtime().tm_sec,
+            "h": now.tm_hour,
+            "m": now.tm_min,
+            "s": now.tm_sec,
+            # Heure de l'événement, et non de l'envoi du lot
+            "cdt": int(time.time()),
             "search": query,
-            "token_auth": os.getenv("MATOMO_TOKEN"),
         }
-        post(
-            url=f"https://{os.getenv('MATOMO_DOMAIN')}/matomo.php",
-            params=params,
-        ).raise_for_status()
+        get_dispatcher().enqueue(params)
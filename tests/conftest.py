@@ -1,5 +1,7 @@
 import datetime
 import os
+import threading
+from http.server import ThreadingHTTPServer
 from pathlib import Path
 
 import polars as pl
@@ -48,8 +50,9 @@ def _cleanup_db_artifacts() -> None:
         _DB_PATH,
         _DB_PATH.with_suffix(".duckdb.tmp"),
         _DB_PATH.with_suffix(".duckdb.lock"),
+        *_DB_PATH.parent.glob(f"{_DB_PATH.stem}.*{_DB_PATH.suffix}"),
     ):
-        if artifact.exists():
+        if artifact.is_symlink() or artifact.exists():
             artifact.unlink()
 
 
@@ -68,6 +71,125 @@ def test_data():
     _cleanup_db_artifacts()
 
 
+def build_test_db(tmp_path: Path, rows: list[dict]) -> Path:
+    """Base tmp_path/decp.duckdb construite à partir de `rows` (en parquet)."""
+    from src.build import build_database
+
+    parquet_path = tmp_path / "source.parquet"
+    db_path = tmp_path / "decp.duckdb"
+    pl.DataFrame(rows).write_parquet(parquet_path)
+    build_database(db_path, parquet_path)
+    return db_path
+
+
+@pytest.fixture
+def built_db(tmp_path, monkeypatch):
+    """Build a DuckDB from a small Polars frame written as parquet."""
+    monkeypatch.setenv("DATA_FILE_PARQUET_PATH", str(tmp_path / "source.parquet"))
+    monkeypatch.setenv("DUCKDB_PATH", str(tmp_path / "decp.duckdb"))
+    return build_test_db(
+        tmp_path,
+        [
+            {
+                "uid": "1",
+                "id": "1",
+                "objet": "Travaux",
+                "acheteur_id": "123",
+                "acheteur_nom": "ACHETEUR 1",
+                "acheteur_departement_code": "75",
+                "acheteur_departement_nom": "Paris",
+                "acheteur_commune_nom": "Paris",
+                "titulaire_commune_nom": "Paris",
+                "titulaire_departement_nom": "Paris",
+                "titulaire_id": "345",
+                "titulaire_nom": "TITULAIRE 1",
+                "titulaire_departement_code": "35",
+                "titulaire_typeIdentifiant": "SIRET",
+                "titulaire_distance": 12.0,
+                "montant": 1000.0,
+                "dateNotification": datetime.date(2025, 1, 1),
+                "donneesActuelles": True,
+                "marcheInnovant": True,
+            },
+            {
+                "uid": "2",
+                "id": "2",
+                "objet": "Études",
+                "acheteur_id": "123",
+                "acheteur_nom": "ACHETEUR 1",
+                "acheteur_departement_code": "75",
+                "acheteur_departement_nom": "Paris",
+                "acheteur_commune_nom": "Paris",
+                "titulaire_commune_nom": "Paris",
+                "titulaire_departement_nom": "Paris",
+                "titulaire_id": "567",
+                "titulaire_nom": None,
+                "titulaire_departement_code": "75",
+                "titulaire_typeIdentifiant": "SIRET",
+                "titulaire_distance": 250.0,
+                "montant": 500.0,
+                "dateNotification": datetime.date(2024, 6, 1),
+                "donneesActuelles": True,
+                "marcheInnovant": False,
+            },
+            {
+                "uid": "3",
+                "id": "3",
+                "objet": "Ancien",
+                "acheteur_id": "A2",
+                "acheteur_nom": None,
+                "acheteur_departement_code": "13",
+                "acheteur_departement_nom": "Paris",
+                "acheteur_commune_nom": "Paris",
+                "titulaire_commune_nom": "Paris",
+                "titulaire_departement_nom": "Paris",
+                "titulaire_id": "T3",
+                "titulaire_nom": "Autre",
+                "titulaire_departement_code": "13",
+                "titulaire_typeIdentifiant": "SIRET",
+                "titulaire_distance": 5.0,
+                "montant": 100.0,
+                "dateNotification": datetime.date(2023, 1, 1),
+                "donneesActuelles": False,  # must be filtered out
+                "marcheInnovant": False,
+            },
+        ],
+    )
+
+
+def _no_log(handler, *args):
+    pass
+
+
+@pytest.fixture
+def http_stub():
+    """Démarre des serveurs HTTP locaux (port libre) pour un handler de test.
+
+    `http_stub(handler, **attributes)` pose les attributs (et un verrou `lock`)
+    sur le serveur, où le handler les lit via self.server, et renvoie le
+    serveur avec son adresse dans `url`. Les serveurs sont arrêtés à la fin du
+    test.
+    """
+    servers = []
+
+    def start(handler, **attributes):
+        quiet = type(handler.__name__, (handler,), {"log_message": _no_log})
+        server = ThreadingHTTPServer(("127.0.0.1", 0), quiet)
+        server.lock = threading.Lock()
+        for name, value in attributes.items():
+            setattr(server, name, value)
+        host, port = server.server_address
+        server.url = f"http://{host}:{port}"
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
 def pytest_setup_options():
     options = Options()
     options.add_argument("--window-size=1200,1200 ")
@@ -0,0 +1,186 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+ETABLISSEMENT = {
+    "nom_raison_sociale": "COMMUNE DE TEST",
+    "matching_etablissements": [
+        {"code_postal": "35000", "libelle_commune": "RENNES", "adresse": "1 RUE"}
+    ],
+}
+
+
+class StubAnnuaire(BaseHTTPRequestHandler):
+    """Imite /search de recherche-entreprises : réponses pilotées par le test."""
+
+    def do_GET(self):
+        server = self.server
+        siret = parse_qs(urlparse(self.path).query)["q"][0]
+        with server.lock:
+            server.requests.append(siret)
+        time.sleep(server.delay)
+        if server.status != 200:
+            self.send_response(server.status)
+            self.end_headers()
+            return
+        results = [server.results[siret]] if siret in server.results else []
+        body = json.dumps({"results": results}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def stub_server(http_stub):
+    return http_stub(
+        StubAnnuaire,
+        requests=[],
+        results={"12345678900011": ETABLISSEMENT},
+        delay=0,
+        status=200,
+    )
+
+
+@pytest.fixture
+def annuaire(stub_server, tmp_path, monkeypatch):
+    """Module annuaire interrogeant le serveur local, avec un cache temporaire."""
+    from src.utils import annuaire
+
+    monkeypatch.setattr(annuaire, "ANNUAIRE_URL", f"{stub_server.url}/search")
+    monkeypatch.setattr(annuaire, "ANNUAIRE_CACHE_PATH", tmp_path / "annuaire.sqlite")
+    monkeypatch.setattr(annuaire, "ANNUAIRE_TIMEOUT", 1)
+    return annuaire
+
+
+def _later(annuaire, monkeypatch, seconds):
+    later = time.time() + seconds
+    monkeypatch.setattr(annuaire, "time", SimpleNamespace(time=lambda: later))
+
+
+def test_response_is_cached(annuaire, stub_server):
+    assert annuaire.get_annuaire_data("12345678900011") == ETABLISSEMENT
+    assert annuaire.get_annuaire_data("12345678900011") == ETABLISSEMENT
+    assert stub_server.requests == ["12345678900011"]
+
+
+def test_response_expires_after_ttl(annuaire, stub_server, monkeypatch):
+    annuaire.get_annuaire_data("12345678900011")
+    _later(annuaire, monkeypatch, annuaire.ANNUAIRE_TTL + 1)
+
+    assert annuaire.get_annuaire_data("12345678900011") == ETABLISSEMENT
+    assert len(stub_server.requests) == 2
+
+
+def test_unknown_siret_is_cached(annuaire, stub_server, monkeypatch):
+    assert annuaire.get_annuaire_data("00000000000000") is None
+    assert annuaire.get_annuaire_data("00000000000000") is None
+    assert len(stub_server.requests) == 1
+
+    _later(annuaire, monkeypatch, annuaire.ANNUAIRE_NEGATIVE_TTL + 1)
+    annuaire.get_annuaire_data("00000000000000")
+    assert len(stub_server.requests) == 2
+
+
+def test_errors_are_cached_briefly(annuaire, stub_server, monkeypatch):
+    stub_server.status = 503
+    assert annuaire.get_annuaire_data("12345678900011") is None
+    assert annuaire.get_annuaire_data("12345678900011") is None
+    assert len(stub_server.requests) == 1
+
+    stub_server.status = 200
+    _later(annuaire, monkeypatch, annuaire.ANNUAIRE_ERROR_TTL + 1)
+    assert annuaire.get_annuaire_data("12345678900011") == ETABLISSEMENT
+
+
+def test_expired_response_is_served_on_error(annuaire, stub_server, monkeypatch):
+    annuaire.get_annuaire_data("12345678900011")
+    _later(annuaire, monkeypatch, annuaire.ANNUAIRE_TTL + 1)
+    stub_server.status = 500
+
+    assert annuaire.get_annuaire_data("12345678900011") == ETABLISSEMENT
+    assert len(stub_server.requests) == 2
+
+
+def test_slow_api_times_out(annuaire, stub_server, monkeypatch):
+    monkeypatch.setattr(annuaire, "ANNUAIRE_TIMEOUT", 0.2)
+    stub_server.delay = 1
+
+    start = time.perf_counter()
+    assert annuaire.get_annuaire_data("12345678900011") is None
+    assert time.perf_counter() - start < 0.9
+
+
+def test_concurrent_lookups_are_coalesced(annuaire, stub_server):
+    stub_server.delay = 0.3
+    results = []
+
+    def lookup():
+        results.append(annuaire.get_annuaire_data("12345678900011"))
+
+    threads = [threading.Thread(target=lookup) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [ETABLISSEMENT] * 8
+    assert stub_server.requests == ["12345678900011"]
+
+
+def test_local_etablissements_are_used_first(annuaire, stub_server, monkeypatch):
+    import duckdb
+
+    con = duckdb.connect()
+    con.execute(
+        "CREATE TABLE etablissements AS SELECT '12345678900011' AS siret, "
+        "'COMMUNE DE TEST' AS nom_raison_sociale, NULL::VARCHAR AS adresse, "
+        "'35000' AS code_postal, 'RENNES' AS libelle_commune, "
+        "48.11 AS latitude, -1.68 AS longitude"
+    )
+    monkeypatch.setattr(
+        annuaire, "get_generation", lambda: SimpleNamespace(tables={"etablissements"})
+    )
+    monkeypatch.setattr(annuaire, "get_cursor", con.cursor)
+
+    data = annuaire.get_annuaire_data("12345678900011")
+    assert data["nom_raison_sociale"] == "COMMUNE DE TEST"
+    assert data["matching_etablissements"][0]["code_postal"] == "35000"
+    # Absent de l'extrait : l'API prend le relais
+    assert annuaire.get_annuaire_data("00000000000000") is None
+    assert stub_server.requests == ["00000000000000"]
+
+
+@pytest.mark.parametrize("org_type", ["acheteur", "titulaire"])
+def test_org_pages_without_postal_code(annuaire, monkeypatch, org_type):
+    import importlib
+
+    import duckdb
+
+    import src.app  # noqa: F401 (enregistre les pages)
+
+    page = importlib.import_module(f"pages.{org_type}")
+    con = duckdb.connect()
+    con.execute(
+        "CREATE TABLE etablissements AS SELECT '12345678900011' AS siret, "
+        "'SOCIETE A L ETRANGER' AS nom_raison_sociale, NULL::VARCHAR AS adresse, "
+        "NULL::VARCHAR AS code_postal, 'BRUXELLES' AS libelle_commune, "
+        "NULL::DOUBLE AS latitude, NULL::DOUBLE AS longitude"
+    )
+    monkeypatch.setattr(
+        annuaire, "get_generation", lambda: SimpleNamespace(tables={"etablissements"})
+    )
+    monkeypatch.setattr(annuaire, "get_cursor", con.cursor)
+
+    update_infos = getattr(page, f"update_{org_type}_infos")
+    siret, nom, commune, _map, departement, region, _lien = update_infos(
+        f"/{org_type}s/12345678900011"
+    )
+    assert (nom, commune) == ("SOCIETE A L ETRANGER", "BRUXELLES")
+    assert (departement, region) == ("", "")
@@ -0,0 +1,141 @@
+from http.server import BaseHTTPRequestHandler
+
+import polars as pl
+import pytest
+
+
+class StubDataGouv(BaseHTTPRequestHandler):
+    """Sert un fichier avec son ETag et répond 304 s'il n'a pas changé."""
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get("If-None-Match"))
+        if server.status != 200:
+            self.send_response(server.status)
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", server.etag)
+        self.send_header("Content-Length", str(len(server.body)))
+        self.end_headers()
+        self.wfile.write(server.body)
+
+
+@pytest.fixture
+def stub_server(http_stub):
+    return http_stub(
+        StubDataGouv,
+        requests=[],
+        etag='"v1"',
+        body=b'{"nb_marches": 1}',
+        status=200,
+    )
+
+
+@pytest.fixture
+def artifacts(stub_server, tmp_path, monkeypatch):
+    """Module artifacts téléchargeant depuis le serveur local, dans un dossier temporaire."""
+    from src.utils import artifacts
+
+    monkeypatch.setattr(artifacts, "ARTIFACTS_DIR", tmp_path / "artifacts")
+    monkeypatch.setattr(
+        artifacts,
+        "REMOTE_ARTIFACTS",
+        {
+            "statistics": {"url": f"{stub_server.url}/stats", "suffix": ".json"},
+            "duplicate_matrix": {
+                "url": f"{stub_server.url}/doublons",
+                "suffix": ".parquet",
+            },
+            "sources": {"url": str(tmp_path / "sources.csv"), "suffix": ".csv"},
+        },
+    )
+    return artifacts
+
+
+def test_unchanged_artifact_is_not_downloaded_again(artifacts, stub_server):
+    assert artifacts.refresh_artifact("statistics")
+    path = artifacts.artifact_path("statistics")
+    assert path.read_bytes() == stub_server.body
+
+    assert not artifacts.refresh_artifact("statistics")
+    assert stub_server.requests == [None, '"v1"']
+    assert artifacts.artifact_path("statistics") == path
+
+
+def test_new_version_replaces_the_previous_one(artifacts, stub_server):
+    old_path = artifacts.artifact_path("statistics")
+    stub_server.etag = '"v2"'
+    stub_server.body = b'{"nb_marches": 2}'
+
+    assert artifacts.refresh_artifact("statistics")
+    path = artifacts.artifact_path("statistics")
+    assert path != old_path
+    assert path.read_bytes() == b'{"nb_marches": 2}'
+    assert not old_path.exists()
+
+
+def test_errors_keep_the_local_copy(artifacts, stub_server):
+    path = artifacts.artifact_path("statistics")
+    stub_server.status = 503
+    assert not artifacts.refresh_artifact("statistics")
+    assert artifacts.artifact_path("statistics") == path
+    assert path.read_bytes() == stub_server.body
+
+
+def test_missing_artifact_is_downloaded_once(artifacts, stub_server):
+    from src.utils.data import get_statistics
+
+    stub_server.status = 503
+    with pytest.raises(FileNotFoundError):
+        artifacts.artifact_path("statistics")
+
+    stub_server.status = 200
+    assert get_statistics() == {"nb_marches": 1}
+    assert get_statistics() == {"nb_marches": 1}
+    assert len(stub_server.requests) == 2
+
+
+def test_local_source_is_read_directly(artifacts, tmp_path):
+    assert artifacts.artifact_path("sources") == tmp_path / "sources.csv"
+    assert not artifacts.refresh_artifact("sources")
+
+
+def test_duplicate_matrix_is_built_once_per_version(artifacts, stub_server):
+    from flask import Flask
+
+    from src.figures import get_duplicate_matrix
+    from src.utils.cache import cache
+
+    def matrix(sources):
+        dff = pl.DataFrame(
+            {
+                "sourceDataset": sources,
+                "unique": [1.0] * len(sources),
+                **{s: [0.5] * len(sources) for s in sources},
+            }
+        )
+        dff.write_parquet(artifacts.ARTIFACTS_DIR / "matrix.parquet")
+        return (artifacts.ARTIFACTS_DIR / "matrix.parquet").read_bytes()
+
+    app = Flask(__name__)
+    cache.init_app(app, config={"CACHE_TYPE": "SimpleCache"})
+    artifacts.ARTIFACTS_DIR.mkdir()
+    stub_server.body = matrix(["b", "a"])
+
+    with app.app_context():
+        graph = get_duplicate_matrix()
+        assert list(graph.figure.data[0].y) == ["a", "b"]
+
+        # Même version : la figure vient du cache, le fichier n'est pas relu
+        artifacts.artifact_path("duplicate_matrix").write_bytes(b"")
+        assert get_duplicate_matrix().figure == graph.figure
+
+        stub_server.etag = '"v2"'
+        stub_server.body = matrix(["c"])
+        artifacts.refresh_artifact("duplicate_matrix")
+        assert list(get_duplicate_matrix().figure.data[0].y) == ["c"]
@@ -0,0 +1,133 @@
+import datetime
+import random
+
+import duckdb
+import pytest
+
+from tests.conftest import build_test_db
+
+PERIOD_START = datetime.datetime(2025, 3, 14, 10, 0)
+
+
+@pytest.fixture
+def cube_db(tmp_path, monkeypatch):
+    """Base de quelques centaines de marchés répartis sur deux ans."""
+    rng = random.Random(1)
+    rows = []
+    for i in range(300):
+        notification = datetime.date(2024, 1, 1) + datetime.timedelta(
+            days=rng.randrange(730)
+        )
+        for _ in range(rng.choice([1, 1, 2, 3])):
+            rows.append(
+                {
+                    "uid": str(i),
+                    "id": str(i),
+                    "objet": "Travaux",
+                    "acheteur_id": f"A{i % 7}",
+                    "acheteur_nom": f"ACHETEUR {i % 7}",
+                    "acheteur_categorie": ["Commune", "Région", None][i % 3],
+                    "acheteur_departement_code": ["35", "75"][i % 2],
+                    "titulaire_id": f"T{rng.randrange(20)}",
+                    "titulaire_nom": "TITULAIRE",
+                    "titulaire_typeIdentifiant": "SIRET",
+                    "titulaire_categorie": rng.choice(["PME", "ETI", None]),
+                    "titulaire_departement_code": rng.choice(["13", "35", "75"]),
+                    "montant": 100 * (i + 1) + 0.35,
+                    "dateNotification": notification,
+                    "type": ["Marché", "Concession"][i % 2],
+                    "techniques": ["", "Accord-cadre"][i % 2],
+                    "sourceDataset": ["atexo_1", "megalis", "pes"][i % 3],
+                    "donneesActuelles": True,
+                }
+            )
+    db_path = build_test_db(tmp_path, rows)
+
+    import src.utils.cube
+    import src.utils.table_sql
+
+    with duckdb.connect(str(db_path), read_only=True) as con:
+        schema = con.execute("SELECT * FROM decp LIMIT 0").pl().schema
+        monkeypatch.setattr(src.utils.cube, "schema", schema)
+        monkeypatch.setattr(
+            src.utils.cube, "default_period_start", lambda: PERIOD_START
+        )
+        monkeypatch.setattr(
+            src.utils.table_sql, "default_period_start", lambda: PERIOD_START
+        )
+        yield con
+
+
+def _sums(con, table, filter_params, use_cube, group_by):
+    from src.build import CUBE_TABLES
+    from src.utils.cube import cells_sql
+
+    sql, params = cells_sql(table, filter_params, use_cube)
+    columns = [f'"{c}"' for c in group_by] + [
+        f"sum({m})" for m in CUBE_TABLES[table]["measures"]
+    ]
+    return con.execute(
+        f"SELECT {', '.join(columns)} FROM ({sql}) GROUP BY ALL ORDER BY ALL", params
+    ).fetchall()
+
+
+@pytest.mark.parametrize(
+    "filter_params",
+    [
+        {},
+        {"dashboard_year": 2025},
+        {"dashboard_acheteur_categorie": "Commune"},
+        {"dashboard_acheteur_departement_code": ["75"], "dashboard_year": 2024},
+        {"dashboard_marche_type": "Concession"},
+        {"dashboard_marche_techniques": ["Accord-cadre"]},
+    ],
+)
+@pytest.mark.parametrize(
+    "table, group_by",
+    [
+        ("cube_marches", ["acheteur_categorie"]),
+        ("cube_marches", ["mois", "sourceDataset"]),
+        ("cube_titulaires", ["titulaire_categorie"]),
+    ],
+)
+def test_cube_matches_raw_query(cube_db, table, group_by, filter_params):
+    from src.utils.cube import can_use_cube
+
+    assert can_use_cube(table, filter_params)
+    cube = _sums(cube_db, table, filter_params, True, group_by)
+    raw = _sums(cube_db, table, filter_params, False, group_by)
+    assert cube == raw
+    assert cube
+
+
+def test_cube_marches_counts_each_market_once(cube_db):
+    nb_marches, montant = _sums(
+        cube_db, "cube_marches", {"dashboard_year": 2024}, True, []
+    )[0]
+    expected = cube_db.execute(
+        "SELECT count(DISTINCT uid), sum(DISTINCT montant) FROM decp "
+        'WHERE year("dateNotification") = 2024'
+    ).fetchone()
+    assert nb_marches == expected[0]
+    assert float(montant) == pytest.approx(expected[1])
+
+
+def test_montant_totals_are_not_rounded(cube_db):
+    from src.utils.cube import query_cube
+
+    expected = cube_db.execute(
+        'SELECT sum(DISTINCT montant) FROM decp WHERE year("dateNotification") = 2024'
+    ).fetchone()[0]
+    totals = query_cube("cube_marches", {"dashboard_year": 2024}, cursor=cube_db)
+    assert totals["montant"].item() == pytest.approx(float(expected))
+    assert totals["montant"].item() % 1 != 0
+
+
+def test_titulaire_filters_fall_back_to_raw_for_marches(cube_db):
+    from src.utils.cube import can_use_cube, cells_sql
+
+    filter_params = {"dashboard_titulaire_categorie": "PME"}
+    assert not can_use_cube("cube_marches", filter_params)
+    assert can_use_cube("cube_titulaires", filter_params)
+    sql, _params = cells_sql("cube_marches", filter_params)
+    assert "FROM decp" in sql and "cube_marches" not in sql
@@ -0,0 +1,323 @@
+import datetime
+import random
+import time
+
+import duckdb
+import numpy as np
+import polars as pl
+import pytest
+
+from tests.conftest import build_test_db
+
+PERIOD_START = datetime.datetime(2025, 3, 14, 10, 0)
+
+FILTERS = [
+    {},
+    {"dashboard_year": 2024},
+    {"dashboard_acheteur_departement_code": ["971"]},
+    {"dashboard_titulaire_categorie": "PME", "dashboard_year": 2025},
+    {"dashboard_marche_objet": "aucun marché"},
+]
+REGION_CODES = ["Hexagone", "971", "972", "976"]
+
+
+@pytest.fixture(scope="module")
+def dashboard_db_path(tmp_path_factory):
+    """Marchés sur deux ans, avec distances, coordonnées et quelques valeurs manquantes."""
+    rng = random.Random(2)
+    rows = []
+    for i in range(400):
+        notification = datetime.date(2024, 1, 1) + datetime.timedelta(
+            days=rng.randrange(730)
+        )
+        departement = ["35", "75", "971", None][i % 4]
+        for _ in range(rng.choice([1, 1, 2, 3])):
+            titulaire = rng.randrange(30)
+            rows.append(
+                {
+                    "uid": str(i),
+                    "id": str(i),
+                    "objet": "Travaux",
+                    "acheteur_id": f"A{i % 9}" if i % 50 else None,
+                    "acheteur_nom": f"ACHETEUR {i % 9}",
+                    "acheteur_departement_code": departement,
+                    "acheteur_latitude": 48.0 + i % 9,
+                    "acheteur_longitude": -1.0 - i % 9,
+                    "titulaire_id": f"T{titulaire}",
+                    "titulaire_nom": f"TITULAIRE {titulaire}",
+                    "titulaire_typeIdentifiant": ["SIRET", "TVA"][titulaire % 7 == 0],
+                    "titulaire_categorie": rng.choice(["PME", "ETI", None]),
+                    "titulaire_departement_code": rng.choice(["13", "35", "972"]),
+                    "titulaire_latitude": 43.0 + titulaire if titulaire % 5 else None,
+                    "titulaire_longitude": 5.0 + titulaire,
+                    "titulaire_distance": rng.choice([0.0, 1.5, 12.0, 250.0])
+                    * rng.random()
+                    if titulaire % 3
+                    else None,
+                    "montant": float(100 * (i + 1)),
+                    "dateNotification": notification,
+                    "type": "Marché",
+                    "sourceDataset": "megalis",
+                    "donneesActuelles": True,
+                }
+            )
+    return build_test_db(tmp_path_factory.mktemp("dashboard"), rows)
+
+
+@pytest.fixture
+def dashboard_db(dashboard_db_path, monkeypatch):
+    import src.utils.dashboard
+    import src.utils.table_sql
+
+    monkeypatch.setattr(
+        src.utils.table_sql, "default_period_start", lambda: PERIOD_START
+    )
+    with duckdb.connect(str(dashboard_db_path), read_only=True) as con:
+        schema = con.execute("SELECT * FROM decp LIMIT 0").pl().schema
+        monkeypatch.setattr(src.utils.dashboard, "schema", schema)
+        monkeypatch.setattr(src.utils.dashboard, "get_cursor", con.cursor)
+        yield con
+
+
+def _rows(con, filter_params) -> pl.DataFrame:
+    """Marchés filtrés, toutes colonnes (comme prepare_dashboard_data)."""
+    from src.utils.table_sql import dashboard_filters_to_sql
+
+    where_sql, params = dashboard_filters_to_sql(**filter_params)
+    return con.execute(f"SELECT * FROM decp WHERE {where_sql}", params).pl()
+
+
+@pytest.mark.parametrize("filter_params", FILTERS)
+def test_summary_matches_polars(dashboard_db, filter_params):
+    from src.utils.dashboard import get_summary
+
+    dff = _rows(dashboard_db, filter_params)
+    assert get_summary(filter_params) == {
+        "nb_acheteurs": dff.select("acheteur_id").n_unique(),
+        "nb_titulaires": dff.select(
+            "titulaire_id", "titulaire_typeIdentifiant"
+        ).n_unique(),
+        "distance_mediane": dff["titulaire_distance"].median(),
+    }
+
+
+@pytest.mark.parametrize("filter_params", FILTERS)
+def test_distance_histogram_matches_numpy(dashboard_db, filter_params):
+    from src.utils.dashboard import get_distance_histogram_stats
+
+    distances = (
+        _rows(dashboard_db, filter_params)
+        .filter(pl.col("titulaire_distance") > 0)["titulaire_distance"]
+        .log(10)
+        .to_numpy()
+    )
+    stats = get_distance_histogram_stats(filter_params)
+    if len(distances) == 0:
+        assert stats == {}
+        return
+    counts, edges = np.histogram(distances, bins=25)
+    assert stats["distance_bins"] == counts.tolist()
+    assert stats["distance_log_min"] == pytest.approx(edges[0])
+    assert stats["distance_log_max"] == pytest.approx(edges[-1])
+
+
+@pytest.mark.parametrize("filter_params", FILTERS)
+def test_distance_histogram_from_stats_returns_graph(dashboard_db, filter_params):
+    from dash import dcc
+
+    from src.figures import get_distance_histogram_from_stats
+    from src.utils.dashboard import get_distance_histogram_stats
+
+    stats = get_distance_histogram_stats(filter_params)
+    result = get_distance_histogram_from_stats(stats)
+    assert isinstance(result, dcc.Graph)
+    assert len(result.figure.data) == (1 if stats else 0)
+
+
+def test_distance_histogram_from_stats_single_distance():
+    from src.figures import get_distance_histogram_from_stats
+
+    stats = {"distance_bins": [3], "distance_log_min": 1.0, "distance_log_max": 1.0}
+    bar = get_distance_histogram_from_stats(stats).figure.data[0]
+    assert list(bar.y) == [3]
+    assert list(bar.x) == [1.0]
+
+
+@pytest.mark.parametrize("filter_params", FILTERS)
+@pytest.mark.parametrize("org_type", ["acheteur", "titulaire"])
+def test_top_orgs_match_polars(dashboard_db, filter_params, org_type):
+    from src.utils.dashboard import get_top_orgs
+
+    keys = [f"{org_type}_id", f"{org_type}_nom"]
+    if org_type == "titulaire":
+        keys.append("titulaire_typeIdentifiant")
+    expected = (
+        _rows(dashboard_db, filter_params)
+        .group_by(keys)
+        .agg(pl.len().alias("Attributions"))
+        .sort(["Attributions", f"{org_type}_id"], descending=[True, False])
+    )
+    top = get_top_orgs(filter_params, org_type, limit=5)
+    assert top.columns == keys + ["Attributions"]
+    assert top.rows() == expected.head(5).rows()
+    assert get_top_orgs(filter_params, org_type).height == expected.height
+
+
+@pytest.mark.parametrize("filter_params", FILTERS)
+def test_dashboard_stats_match_card_queries(dashboard_db, filter_params):
+    from src.utils.dashboard import (
+        get_dashboard_stats,
+        get_distance_histogram_stats,
+        get_summary,
+        get_top_orgs,
+    )
+
+    stats = get_dashboard_stats(filter_params)
+    assert stats["summary"] == get_summary(filter_params)
+    assert stats["distance_histogram"] == get_distance_histogram_stats(filter_params)
+    for org_type in ["acheteur", "titulaire"]:
+        assert stats[f"top_{org_type}s"].equals(get_top_orgs(filter_params, org_type))
+
+
+def test_dashboard_stats_are_computed_once_for_concurrent_cards(
+    dashboard_db, monkeypatch
+):
+    import threading
+
+    from src.utils import dashboard
+
+    calls = []
+    release = threading.Event()
+    query = dashboard._query_dashboard_stats
+
+    def slow_query(filter_params, cursor):
+        calls.append(filter_params)
+        release.wait(5)
+        return query(filter_params, cursor)
+
+    monkeypatch.setattr(dashboard, "_query_dashboard_stats", slow_query)
+    results = [None] * 4
+
+    def card(i):
+        results[i] = dashboard.get_dashboard_stats({}, dashboard_db.cursor())
+
+    threads = [threading.Thread(target=card, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results[0]["summary"] == dashboard.get_summary({})
+    assert all(result is results[0] for result in results)
+
+
+@pytest.mark.parametrize("filter_params", FILTERS)
+@pytest.mark.parametrize("threshold", [0, 10000])
+@pytest.mark.parametrize("region_code", REGION_CODES)
+def test_region_map_data_matches_polars(
+    dashboard_db, monkeypatch, filter_params, threshold, region_code
+):
+    from src.utils import dashboard
+
+    monkeypatch.setattr(dashboard, "CHOROPLETH_MIN_MARCHES", {})
+    monkeypatch.setattr(dashboard, "CHOROPLETH_MIN_MARCHES_DROM", threshold)
+    dff = _rows(dashboard_db, filter_params)
+    if region_code == "Hexagone":
+        dff = dff.filter(
+            (pl.col("acheteur_departement_code").str.len_chars() == 2)
+            & (pl.col("titulaire_departement_code").str.len_chars() == 2)
+        )
+    else:
+        dff = dff.filter(
+            (pl.col("acheteur_departement_code") == region_code)
+            | (pl.col("titulaire_departement_code") == region_code)
+        )
+
+    maps_data = dashboard.get_maps_data(filter_params, REGION_CODES)
+    dfs, map_type = maps_data[region_code]
+    if dff.height == 0:
+        assert (dfs, map_type) == ([], None)
+    elif threshold == 0:
+        # Le département de l'acheteur est le même pour toutes les lignes d'un marché
+        expected = (
+            dff.select("uid", pl.col("acheteur_departement_code").alias("Département"))
+            .drop_nulls()
+            .unique()
+            .group_by("Département")
+            .len("uid")
+        )
+        assert map_type == "chloropleth"
+        assert sorted(dfs[0].rows()) == sorted(expected.rows())
+    else:
+        assert map_type == "clusters"
+        for org_type, markers in zip(["acheteur", "titulaire"], dfs, strict=True):
+            columns = [f"{org_type}_{c}" for c in ["longitude", "latitude", "nom"]]
+            expected = (
+                dff.group_by(columns)
+                .len("nb_marches")
+                .drop_nulls([f"{org_type}_latitude", f"{org_type}_longitude"])
+            )
+            assert markers.columns == columns + ["nb_marches"]
+            assert sorted(markers.rows()) == sorted(expected.rows())
+
+
+def test_run_cards_isolates_failures():
+    from src.utils.dashboard import run_cards
+
+    def failing(cursor):
+        raise ValueError("carte cassée")
+
+    results = run_cards(
+        {
+            "ok": lambda cursor: cursor.execute("SELECT 42").fetchone()[0],
+            "erreur": failing,
+        }
+    )
+    assert results["ok"] == 42
+    assert isinstance(results["erreur"], ValueError)
+
+
+def test_run_cards_runs_cards_in_parallel():
+    from src.utils.dashboard import run_cards
+
+    start = time.perf_counter()
+    results = run_cards({str(i): lambda cursor: time.sleep(0.3) for i in range(3)})
+    assert time.perf_counter() - start < 0.6
+    assert list(results.values()) == [None] * 3
+
+
+def test_run_cards_interrupts_slow_queries():
+    from src.utils.dashboard import run_cards
+
+    errors = []
+
+    def slow(cursor):
+        try:
+            cursor.execute("SELECT count(*) FROM range(1e12::BIGINT)").fetchone()
+        except duckdb.InterruptException as e:
+            errors.append(e)
+
+    results = run_cards({"lente": slow, "rapide": lambda cursor: 1}, timeout=0.2)
+    assert isinstance(results["lente"], TimeoutError)
+    assert results["rapide"] == 1
+    deadline = time.monotonic() + 5
+    while not errors and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert errors
+
+
+def test_run_cards_timeout_starts_when_the_card_runs(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    from src.utils import dashboard
+
+    # Un seul thread : la seconde carte attend la fin de la première
+    monkeypatch.setattr(dashboard, "_executor", ThreadPoolExecutor(max_workers=1))
+    results = dashboard.run_cards(
+        {str(i): lambda cursor: time.sleep(0.3) or 1 for i in range(2)},
+        timeout=0.5,
+    )
+    assert results == {"0": 1, "1": 1}
@@ -6,6 +6,7 @@ import polars as pl
 import pytest
 
 from src.db import should_rebuild
+from tests.conftest import build_test_db
 
 
 @pytest.fixture
@@ -69,86 +70,6 @@ def test_should_rebuild_dev_when_rebuild_forced(parquet_and_db, monkeypatch):
     assert should_rebuild(db, parquet) is True
 
 
-@pytest.fixture
-def built_db(tmp_path, monkeypatch):
-    """Build a DuckDB from a small Polars frame written as parquet."""
-    parquet_path = tmp_path / "source.parquet"
-    db_path = tmp_path / "decp.duckdb"
-
-    data = pl.DataFrame(
-        [
-            {
-                "uid": "1",
-                "id": "1",
-                "objet": "Travaux",
-                "acheteur_id": "123",
-                "acheteur_nom": "ACHETEUR 1",
-                "acheteur_departement_code": "75",
-                "acheteur_departement_nom": "Paris",
-                "acheteur_commune_nom": "Paris",
-                "titulaire_commune_nom": "Paris",
-                "titulaire_departement_nom": "Paris",
-                "titulaire_id": "345",
-                "titulaire_nom": "TITULAIRE 1",
-                "titulaire_departement_code": "35",
-                "titulaire_typeIdentifiant": "SIRET",
-                "montant": 1000.0,
-                "dateNotification": datetime.date(2025, 1, 1),
-                "donneesActuelles": True,
-                "marcheInnovant": True,
-            },
-            {
-                "uid": "2",
-                "id": "2",
-                "objet": "Études",
-                "acheteur_id": "123",
-                "acheteur_nom": "ACHETEUR 1",
-                "acheteur_departement_code": "75",
-                "acheteur_departement_nom": "Paris",
-                "acheteur_commune_nom": "Paris",
-                "titulaire_commune_nom": "Paris",
-                "titulaire_departement_nom": "Paris",
-                "titulaire_id": "567",
-                "titulaire_nom": None,
-                "titulaire_departement_code": "75",
-                "titulaire_typeIdentifiant": "SIRET",
-                "montant": 500.0,
-                "dateNotification": datetime.date(2024, 6, 1),
-                "donneesActuelles": True,
-                "marcheInnovant": False,
-            },
-            {
-                "uid": "3",
-                "id": "3",
-                "objet": "Ancien",
-                "acheteur_id": "A2",
-                "acheteur_nom": None,
-                "acheteur_departement_code": "13",
-                "acheteur_departement_nom": "Paris",
-                "acheteur_commune_nom": "Paris",
-                "titulaire_commune_nom": "Paris",
-                "titulaire_departement_nom": "Paris",
-                "titulaire_id": "T3",
-                "titulaire_nom": "Autre",
-                "titulaire_departement_code": "13",
-                "titulaire_typeIdentifiant": "SIRET",
-                "montant": 100.0,
-                "dateNotification": datetime.date(2023, 1, 1),
-                "donneesActuelles": False,  # must be filtered out
-                "marcheInnovant": False,
-            },
-        ]
-    )
-    data.write_parquet(parquet_path)
-    monkeypatch.setenv("DATA_FILE_PARQUET_PATH", str(parquet_path))
-    monkeypatch.setenv("DUCKDB_PATH", str(db_path))
-
-    from src.db import build_database
-
-    build_database(db_path, parquet_path)
-    return db_path
-
-
 def test_build_filters_donnees_actuelles(built_db):
     import duckdb
 
@@ -189,6 +110,433 @@ def test_build_creates_derived_tables(built_db):
     } <= tables
 
 
+def test_build_creates_lookup_indexes(built_db):
+    import duckdb
+
+    with duckdb.connect(str(built_db), read_only=True) as c:
+        indexes = {
+            r[0]
+            for r in c.execute(
+                "SELECT sql FROM duckdb_indexes() WHERE table_name = 'decp'"
+            ).fetchall()
+        }
+    assert indexes == {
+        "CREATE INDEX decp_uid_idx ON decp(uid);",
+        "CREATE INDEX decp_acheteur_id_idx ON decp(acheteur_id);",
+        "CREATE INDEX decp_titulaire_id_idx ON decp(titulaire_id);",
+    }
+
+
+def test_build_creates_marches_tables(built_db):
+    import duckdb
+
+    with duckdb.connect(str(built_db), read_only=True) as con:
+        marches = con.execute("SELECT * FROM marches ORDER BY uid").pl()
+        titulaires = con.execute(
+            "SELECT uid, titulaire_id, nb_lignes FROM marches_titulaires ORDER BY uid"
+        ).fetchall()
+    assert marches["uid"].to_list() == ["1", "2"]
+    assert marches["nb_titulaires"].to_list() == [1, 1]
+    assert not any(c.startswith("titulaire_") for c in marches.columns)
+    assert titulaires == [("1", "345", 1), ("2", "567", 1)]
+
+
+def test_update_database_rebuilds_outdated_database(built_db, tmp_path):
+    import duckdb
+
+    from src.build import is_outdated, update_database
+
+    with duckdb.connect(str(built_db.resolve())) as con:
+        con.execute("DROP TABLE marches")
+    assert is_outdated(built_db)
+    update_database(built_db, tmp_path / "source.parquet")
+    assert not is_outdated(built_db)
+
+
+def test_build_creates_cubes(built_db):
+    import duckdb
+
+    with duckdb.connect(str(built_db), read_only=True) as con:
+        marches = con.execute(
+            "SELECT mois, acheteur_departement_code, nb_marches, montant "
+            "FROM cube_marches ORDER BY mois"
+        ).fetchall()
+        lignes = con.execute("SELECT sum(nb_lignes) FROM cube_titulaires").fetchone()
+    assert marches == [
+        (datetime.date(2024, 6, 1), "75", 1, 500),
+        (datetime.date(2025, 1, 1), "75", 1, 1000),
+    ]
+    assert lignes == (2,)
+
+
+def test_build_creates_org_stats(built_db):
+    import duckdb
+
+    with duckdb.connect(str(built_db), read_only=True) as con:
+        rows = con.execute(
+            "SELECT acheteur_id, annee, nb_lignes, nb_marches, nb_partenaires, "
+            "len(top_partenaires), list_sum(distance_bins) "
+            "FROM acheteur_stats ORDER BY annee NULLS FIRST"
+        ).fetchall()
+        titulaire = con.execute(
+            "SELECT top_partenaires FROM titulaire_stats "
+            "WHERE titulaire_id = '345' AND annee IS NULL"
+        ).fetchone()[0]
+    assert rows == [
+        ("123", None, 2, 2, 2, 2, 2),
+        ("123", 2024, 1, 1, 1, 1, 1),
+        ("123", 2025, 1, 1, 1, 1, 1),
+    ]
+    assert titulaire == [
+        {
+            "acheteur_id": "123",
+            "acheteur_nom": "ACHETEUR 1",
+            "titulaire_distance": 12.0,
+            "Attributions": 1,
+        }
+    ]
+
+
+def test_build_engines_produce_same_table(built_db, tmp_path):
+    """Le chemin en flux (DuckDB) reproduit exactement l'ancien chemin Polars."""
+    import duckdb
+
+    from src.db import build_database
+
+    polars_db = tmp_path / "polars.duckdb"
+    build_database(polars_db, tmp_path / "source.parquet", engine="polars")
+
+    with duckdb.connect(str(built_db), read_only=True) as c:
+        streamed = c.execute("SELECT * FROM decp").pl()
+    with duckdb.connect(str(polars_db), read_only=True) as c:
+        collected = c.execute("SELECT * FROM decp").pl()
+
+    assert streamed.schema == collected.schema
+    assert streamed.equals(collected)
+
+
+def _table_rows(db_path, table: str) -> list[tuple]:
+    import duckdb
+
+    with duckdb.connect(str(db_path), read_only=True) as c:
+        return sorted(
+            c.execute(f"SELECT * FROM {table}").fetchall(),
+            key=lambda row: tuple(str(v) for v in row),
+        )
+
+
+def test_refresh_applies_only_changed_uids(built_db, tmp_path):
+    """La mise à jour incrémentale aboutit aux mêmes tables qu'une reconstruction."""
+    from src.build import (
+        CUBE_TABLES,
+        DERIVED_TABLES,
+        MARCHES_TABLES,
+        ORG_STATS_TABLES,
+        build_database,
+        refresh_database,
+    )
+
+    source = pl.read_parquet(tmp_path / "source.parquet")
+    new_row = source.filter(pl.col("uid") == "1").with_columns(
+        uid=pl.lit("4"), acheteur_id=pl.lit("A4"), acheteur_nom=pl.lit("ACHETEUR 4")
+    )
+    updated = pl.concat(
+        [
+            source.filter(pl.col("uid") != "2").with_columns(
+                objet=pl.when(pl.col("uid") == "1")
+                .then(pl.lit("Travaux modifiés"))
+                .otherwise(pl.col("objet"))
+            ),
+            new_row,
+            # Deuxième titulaire du nouveau marché
+            new_row.with_columns(titulaire_id=pl.lit("T4")),
+        ]
+    )
+    updated_parquet = tmp_path / "updated.parquet"
+    updated.write_parquet(updated_parquet)
+
+    refresh_database(built_db, updated_parquet)
+    full_db = tmp_path / "full.duckdb"
+    build_database(full_db, updated_parquet)
+
+    tables = [
+        "decp",
+        "decp_hashes",
+        *DERIVED_TABLES,
+        *MARCHES_TABLES,
+        *CUBE_TABLES,
+        *ORG_STATS_TABLES,
+    ]
+    for table in tables:
+        assert _table_rows(built_db, table) == _table_rows(full_db, table), table
+    assert [r[0] for r in _table_rows(built_db, "decp")] == ["1", "4", "4"]
+    assert [r[0] for r in _table_rows(built_db, "marches")] == ["1", "4"]
+    assert not built_db.with_suffix(".duckdb.tmp").exists()
+
+
+def test_refresh_keeps_organisations_without_id(built_db, tmp_path, monkeypatch):
+    """Les lignes sans acheteur_id ni titulaire_id sont ajoutées, modifiées et
+    supprimées comme par une reconstruction complète."""
+    from src import build
+
+    monkeypatch.setattr(build, "RECLUSTER_RATIO", float("inf"))
+    source = pl.read_parquet(tmp_path / "source.parquet")
+    sans_id = source.filter(pl.col("uid") == "1").with_columns(
+        uid=pl.lit("5"),
+        acheteur_id=pl.lit(None, pl.String),
+        titulaire_id=pl.lit(None, pl.String),
+    )
+    updates = [
+        pl.concat([source, sans_id]),
+        pl.concat(
+            [source, sans_id.with_columns(acheteur_departement_code=pl.lit("35"))]
+        ),
+        source,
+    ]
+    for i, updated in enumerate(updates):
+        updated_parquet = tmp_path / f"updated_{i}.parquet"
+        updated.write_parquet(updated_parquet)
+        build.refresh_database(built_db, updated_parquet)
+        full_db = tmp_path / f"full_{i}.duckdb"
+        build.build_database(full_db, updated_parquet)
+
+        assert build.unclustered_ratio(built_db) > 0
+        for table in [*build.DERIVED_TABLES, *build.ORG_STATS_TABLES]:
+            assert _table_rows(built_db, table) == _table_rows(full_db, table), table
+
+
+def test_build_copies_sirene_etablissements(built_db, tmp_path, monkeypatch):
+    from src import build
+
+    sirene = tmp_path / "sirene.parquet"
+    pl.DataFrame(
+        {
+            "siret": ["123", "345", "999", "A4"],
+            "denominationUniteLegale": ["COMMUNE", "ENTREPRISE", "AUTRE", "NOUVEL"],
+            "codePostalEtablissement": ["75001", "35000", "13001", "75002"],
+            "libelleCommuneEtablissement": ["PARIS", "RENNES", "MARSEILLE", "PARIS"],
+            "latitude": [48.86, 48.11, 43.30, 48.87],
+            "longitude": [2.34, -1.68, 5.37, 2.34],
+        }
+    ).write_parquet(sirene)
+    monkeypatch.setattr(build, "SIRENE_ETABLISSEMENTS_PATH", str(sirene))
+    assert build.is_outdated(built_db)
+
+    build.build_database(built_db, tmp_path / "source.parquet")
+    assert _table_rows(built_db, "etablissements") == [
+        ("123", "COMMUNE", None, "75001", "PARIS", 48.86, 2.34),
+        ("345", "ENTREPRISE", None, "35000", "RENNES", 48.11, -1.68),
+    ]
+
+    # Un nouvel acheteur est ajouté par la mise à jour incrémentale
+    source = pl.read_parquet(tmp_path / "source.parquet")
+    updated = pl.concat(
+        [source, source.head(1).with_columns(uid=pl.lit("4"), acheteur_id=pl.lit("A4"))]
+    )
+    updated.write_parquet(tmp_path / "updated.parquet")
+    build.refresh_database(built_db, tmp_path / "updated.parquet")
+    assert [r[0] for r in _table_rows(built_db, "etablissements")] == [
+        "123",
+        "345",
+        "A4",
+    ]
+
+
+def test_refresh_without_changes_keeps_tables(built_db, tmp_path):
+    from src.build import refresh_database
+
+    before = _table_rows(built_db, "decp")
+    refresh_database(built_db, tmp_path / "source.parquet")
+    assert _table_rows(built_db, "decp") == before
+
+
+def test_refresh_keeps_storage_order(built_db, tmp_path, monkeypatch):
+    """Les lignes ajoutées en fin de decp par les mises à jour sont retriées
+    par une reconstruction complète au-delà de RECLUSTER_RATIO."""
+    import duckdb
+
+    from src import build
+
+    monkeypatch.setattr(build, "RECLUSTER_RATIO", 0.5)
+
+    def storage_order(db_path):
+        with duckdb.connect(str(db_path), read_only=True) as c:
+            stored = c.execute("SELECT uid FROM decp ORDER BY rowid").fetchall()
+            expected = c.execute(
+                f"SELECT uid FROM decp ORDER BY {build.STORAGE_ORDER_BY}"
+            ).fetchall()
+        return stored, expected
+
+    source = pl.read_parquet(tmp_path / "source.parquet")
+    for i, uid in enumerate(["0", "00", "000"]):
+        # Nouvel acheteur, trié avant les autres
+        source = pl.concat(
+            [
+                source,
+                source.head(1).with_columns(
+                    uid=pl.lit(uid), acheteur_id=pl.lit(f"0{i}")
+                ),
+            ]
+        )
+        source.write_parquet(tmp_path / "updated.parquet")
+        build.refresh_database(built_db, tmp_path / "updated.parquet")
+
+        stored, expected = storage_order(built_db)
+        if uid != "000":
+            # Mise à jour incrémentale : la ligne est ajoutée en fin de table
+            assert stored[-1] == (uid,)
+            assert stored != expected
+    # 2 lignes réécrites sur 4 : la troisième mise à jour reconstruit la base
+    assert stored == expected
+    assert build.unclustered_ratio(built_db) == 0
+
+
+def test_refresh_falls_back_to_full_build_on_schema_change(built_db, tmp_path):
+    import duckdb
+
+    from src.build import refresh_database
+
+    updated_parquet = tmp_path / "updated.parquet"
+    pl.read_parquet(tmp_path / "source.parquet").with_columns(
+        nouvelle_colonne=pl.lit("x")
+    ).write_parquet(updated_parquet)
+
+    refresh_database(built_db, updated_parquet)
+
+    with duckdb.connect(str(built_db), read_only=True) as c:
+        columns = [r[0] for r in c.execute("DESCRIBE decp").fetchall()]
+    assert "nouvelle_colonne" in columns
+
+
+def test_publish_keeps_current_and_previous_generation(built_db, tmp_path):
+    from src.build import build_database, list_generations
+
+    source = tmp_path / "source.parquet"
+    build_database(built_db, source)
+    build_database(built_db, source)
+
+    generations = list_generations(built_db)
+    assert len(generations) == 2
+    assert built_db.is_symlink()
+    assert built_db.resolve() == generations[-1]
+
+
+def test_database_handle_swaps_generation(built_db, tmp_path):
+    from src.build import build_database
+    from src.db import DatabaseHandle
+
+    handle = DatabaseHandle(built_db)
+    preloaded = []
+    handle.on_new_generation(lambda g: preloaded.append(g.name))
+
+    old = handle.get()
+    in_flight = handle.cursor()
+
+    source = pl.read_parquet(tmp_path / "source.parquet")
+    updated = tmp_path / "updated.parquet"
+    source.with_columns(objet=pl.lit("Nouvel objet")).write_parquet(updated)
+    build_database(built_db, updated)
+
+    handle.get()
+    handle.join_swap()
+    new = handle.get()
+    assert new is not old
+    assert preloaded == [new.name]
+    assert handle.cursor().execute("SELECT DISTINCT objet FROM decp").fetchall() == [
+        ("Nouvel objet",)
+    ]
+
+    # La requête en cours termine sur l'ancienne génération, fermée ensuite
+    assert in_flight.execute("SELECT count(*) FROM decp").fetchone()[0] == 2
+    assert not old._closed
+    del in_flight
+    assert old._closed
+
+
+def test_database_handle_ignores_generation_with_new_schema(built_db, tmp_path):
+    from src.build import build_database
+    from src.db import DatabaseHandle
+
+    handle = DatabaseHandle(built_db)
+    current = handle.get()
+
+    updated = tmp_path / "updated.parquet"
+    pl.read_parquet(tmp_path / "source.parquet").with_columns(
+        nouvelle_colonne=pl.lit("x")
+    ).write_parquet(updated)
+    build_database(built_db, updated)
+
+    handle.get()
+    handle.join_swap()
+    assert handle.get() is current
+
+
+def test_database_handle_preloads_in_background(built_db, tmp_path):
+    import threading
+
+    from src.build import build_database
+    from src.db import DatabaseHandle
+
+    handle = DatabaseHandle(built_db)
+    release = threading.Event()
+    handle.on_new_generation(lambda g: release.wait(5))
+    old = handle.get()
+
+    updated = tmp_path / "updated.parquet"
+    pl.read_parquet(tmp_path / "source.parquet").write_parquet(updated)
+    build_database(built_db, updated)
+
+    # Le préchargement est en cours : les requêtes restent sur l'ancienne base
+    assert handle.get() is old
+    assert handle.get() is old
+    release.set()
+    handle.join_swap()
+    assert handle.get() is not old
+
+
+def test_database_handle_rejects_generation_when_a_hook_fails(built_db, tmp_path):
+    from src.build import build_database
+    from src.db import DatabaseHandle
+
+    handle = DatabaseHandle(built_db)
+    calls = []
+
+    def failing_hook(generation):
+        calls.append(generation.name)
+        raise RuntimeError("préchargement cassé")
+
+    handle.on_new_generation(failing_hook)
+    current = handle.get()
+
+    updated = tmp_path / "updated.parquet"
+    pl.read_parquet(tmp_path / "source.parquet").write_parquet(updated)
+    build_database(built_db, updated)
+
+    for _ in range(3):
+        assert handle.get() is current
+        handle.join_swap()
+    assert len(calls) == 1
+
+
+def test_database_handle_cursor_retries_on_the_next_generation(built_db):
+    import duckdb
+
+    from src.db import DatabaseHandle, Generation
+
+    handle = DatabaseHandle(built_db)
+    # Génération fermée par une bascule juste après avoir été lue
+    closed = Generation(built_db.resolve())
+    closed.retire()
+    generations = iter([closed])
+    handle.get = lambda: next(generations, handle.current)
+
+    assert handle.cursor().execute("SELECT count(*) FROM decp").fetchone() == (2,)
+
+    handle.current.retire()
+    with pytest.raises(duckdb.ConnectionException):
+        handle.cursor()
+
+
 def test_query_marches_returns_polars_frame(built_db, monkeypatch):
     monkeypatch.setenv(
         "DATA_FILE_PARQUET_PATH", str(built_db.parent / "source.parquet")
@@ -201,10 +549,15 @@ def test_query_marches_returns_polars_frame(built_db, monkeypatch):
     importlib.reload(src.db)
     from src.db import query_marches
 
-    frame = query_marches("acheteur_id = ?", ("123",))
-    assert isinstance(frame, pl.DataFrame)
-    assert frame.height == 2
-    assert set(frame["uid"].to_list()) == {"1", "2"}
+    try:
+        frame = query_marches("acheteur_id = ?", ("123",))
+        assert isinstance(frame, pl.DataFrame)
+        assert frame.height == 2
+        assert set(frame["uid"].to_list()) == {"1", "2"}
+    finally:
+        # Les modules importés ensuite doivent retrouver la base des tests
+        monkeypatch.undo()
+        importlib.reload(src.db)
 
 
 def test_count_marches_returns_total_without_filter():
@@ -230,6 +583,36 @@ def test_count_unique_marches_respects_distinct():
     assert n > 0
 
 
+def test_count_unique_marches_uses_the_filtered_columns():
+    from src.db import count_unique_marches
+
+    assert count_unique_marches('"titulaire_id" = ?', ["345"], {"titulaire_id"}) == 1
+    assert count_unique_marches('"titulaire_id" = ?', ["000"], {"titulaire_id"}) == 0
+    assert count_unique_marches('"acheteur_id" = ?', ["123"], {"acheteur_id"}) == 1
+    # Colonnes inconnues : decp
+    assert count_unique_marches('"titulaire_id" = ?', ["345"]) == 1
+
+
+def test_nb_titulaires_counts_distinct_titulaires():
+    import duckdb
+
+    from src.build import marches_select_sql
+
+    con = duckdb.connect()
+    con.execute(
+        "CREATE TABLE decp AS SELECT * FROM (VALUES "
+        "('1', 'A', 'SIRET'), ('1', 'A', 'SIRET'), ('1', 'B', 'SIRET'), "
+        "('1', 'B', 'TVA'), ('2', NULL, NULL)"
+        ") t(uid, titulaire_id, titulaire_typeIdentifiant)"
+    )
+    sql = marches_select_sql(
+        "marches", ["uid", "titulaire_id", "titulaire_typeIdentifiant"]
+    )
+    assert con.execute(
+        f"SELECT uid, nb_titulaires FROM ({sql}) ORDER BY uid"
+    ).fetchall() == [("1", 3), ("2", 0)]
+
+
 def test_query_marches_with_offset():
     from src.db import query_marches
 
@@ -239,6 +622,146 @@ def test_query_marches_with_offset():
         assert set(page_0["uid"].to_list()).isdisjoint(set(page_1["uid"].to_list()))
 
 
+@pytest.mark.parametrize(
+    "where_sql, params, offset",
+    [
+        ("TRUE", [], 0),
+        ("TRUE", [], 1),
+        ('"acheteur_id" = ?', ["123"], 0),
+        ('"acheteur_id" = ?', ["123"], 5),
+        ('"uid" = ?', ["__nonexistent__"], 0),
+    ],
+)
+@pytest.mark.parametrize("unique_on_marches", [False, True])
+def test_page_sql_matches_separate_queries(
+    built_db, where_sql, params, offset, unique_on_marches
+):
+    import duckdb
+
+    from src.build import DEFAULT_ORDER_BY, DEFAULT_SORT_KEYS
+    from src.db import page_sql
+
+    with duckdb.connect(str(built_db), read_only=True) as con:
+        sql, all_params = page_sql(
+            where_sql,
+            params,
+            DEFAULT_SORT_KEYS,
+            1,
+            offset,
+            unique_on_marches=unique_on_marches,
+        )
+        frame = con.execute(sql, all_params).pl()
+        expected_page = con.execute(
+            f"SELECT * FROM decp WHERE {where_sql} "
+            f"ORDER BY {DEFAULT_ORDER_BY} LIMIT 1 OFFSET {offset}",
+            params,
+        ).pl()
+        expected_totals = con.execute(
+            f"SELECT count(*), count(DISTINCT uid) FROM decp WHERE {where_sql}",
+            params,
+        ).fetchone()
+
+        sql, all_params = page_sql(
+            where_sql, params, DEFAULT_SORT_KEYS, 1, offset, with_totals=False
+        )
+        page_only = con.execute(sql, all_params).pl()
+
+    assert (frame["__total"][0], frame["__total_unique"][0]) == expected_totals
+    page = frame.filter(pl.col("__in_page")).drop(
+        "__total", "__total_unique", "__in_page", "__rowid"
+    )
+    assert page.equals(expected_page)
+    assert page_only.drop("__in_page", "__rowid").equals(expected_page)
+
+
+@pytest.mark.parametrize(
+    "sort_keys",
+    [
+        [("dateNotification", "DESC"), ("uid", "DESC")],
+        [("montant", "ASC")],
+        [("objet", "DESC"), ("montant", "DESC")],
+    ],
+)
+def test_keyset_pages_match_offset_pages(tmp_path, sort_keys):
+    """Enchaîner les pages avec `after` parcourt toutes les lignes dans l'ordre."""
+    import duckdb
+
+    from src.db import keys_to_order_by, page_keys, page_sql
+
+    rows = [
+        {
+            "uid": str(i // 2),
+            "id": str(i // 2),
+            "objet": ["Travaux", None, "Études"][i % 3],
+            "acheteur_id": "123",
+            "acheteur_nom": "ACHETEUR 1",
+            "acheteur_departement_code": "75",
+            "titulaire_id": f"T{i}",
+            "titulaire_nom": "TITULAIRE",
+            "titulaire_departement_code": "35",
+            "montant": [None, 100.0, 200.0, 100.0][i % 4],
+            "dateNotification": [None, datetime.date(2025, 1, 1)][i % 5 > 0],
+            "donneesActuelles": True,
+        }
+        for i in range(37)
+    ]
+    db_path = build_test_db(tmp_path, rows)
+
+    with duckdb.connect(str(db_path), read_only=True) as con:
+        expected = con.execute(
+            "SELECT * FROM (SELECT *, rowid AS __rowid FROM decp) "
+            f"ORDER BY {keys_to_order_by(page_keys(sort_keys))}"
+        ).pl()
+        pages, after = [], None
+        while True:
+            sql, params = page_sql("TRUE", [], sort_keys, 5, after=after)
+            page = con.execute(sql, params).pl().filter(pl.col("__in_page"))
+            if page.height == 0:
+                break
+            pages.append(page.drop("__total", "__total_unique", "__in_page"))
+            last = page.row(-1, named=True)
+            after = tuple(last[col] for col, _ in page_keys(sort_keys))
+
+    assert pl.concat(pages).equals(expected)
+
+
+def test_query_page_returns_page_and_totals():
+    from src.build import DEFAULT_SORT_KEYS
+    from src.db import count_marches, count_unique_marches, query_page
+
+    page, total, total_unique, last_key = query_page("TRUE", [], DEFAULT_SORT_KEYS, 2)
+    assert total == count_marches()
+    assert total_unique == count_unique_marches()
+    assert page.height == min(2, total)
+    assert "__in_page" not in page.columns and "__rowid" not in page.columns
+    assert len(last_key) == 3
+
+    page, total, _, last_key = query_page(
+        '"uid" = ?', ["__nonexistent__"], DEFAULT_SORT_KEYS, 2
+    )
+    assert (page.height, total, last_key) == (0, 0, None)
+
+
+@pytest.mark.parametrize(
+    "where_sql, params, filtered_columns",
+    [
+        ("TRUE", [], set()),
+        ('"acheteur_id" = ?', ["123"], {"acheteur_id"}),
+        ('"titulaire_id" = ?', ["345"], {"titulaire_id"}),
+    ],
+)
+def test_query_page_counts_unique_marches_on_marches_table(
+    where_sql, params, filtered_columns
+):
+    from src.build import DEFAULT_SORT_KEYS
+    from src.db import count_unique_marches, query_page
+
+    _, _, total_unique, _ = query_page(
+        where_sql, params, DEFAULT_SORT_KEYS, 2, filtered_columns=filtered_columns
+    )
+    assert total_unique == count_unique_marches(where_sql, params) > 0
+
+
 def test_concurrent_build_serialized(tmp_path):
     """Multiple threads calling _ensure_database must serialize via flock.
 
@@ -0,0 +1,194 @@
+import io
+import time
+from types import SimpleNamespace
+from urllib.parse import unquote
+
+import polars as pl
+import pytest
+
+
+@pytest.fixture
+def export(tmp_path, monkeypatch):
+    """Module d'export écrivant dans un dossier temporaire."""
+    from src.utils import export
+
+    monkeypatch.setattr(export, "EXPORT_DIR", tmp_path / "exports")
+    return export
+
+
+@pytest.fixture
+def client(export):
+    """App Flask minimale servant la route de téléchargement des exports."""
+    from flask import Flask
+
+    app = Flask(__name__)
+    app.add_url_rule(
+        "/telechargements/<job_id>/<filename>", view_func=export.export_response
+    )
+    return app.test_client()
+
+
+class RecordingExecutor:
+    """Remplace le pool : garde les tâches soumises sans les exécuter."""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append(args)
+
+
+def _wait(export, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = export.get_job(job_id)
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(job_id)
+
+
+def _download(export, client, sql, params, fmt, **kwargs):
+    job = _wait(export, export.submit_export(sql, params, fmt, "decp_test"))
+    assert job["status"] == "done"
+    return client.get(export.download_url(job), **kwargs)
+
+
+def test_csv_export_matches_query(export, client):
+    from src.db import query_marches
+
+    response = _download(
+        export, client, 'SELECT * FROM decp WHERE "uid" = ?', ["1"], "csv"
+    )
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+    assert "decp_test.csv" in unquote(response.headers["Content-Disposition"])
+    assert int(response.headers["Content-Length"]) == len(response.data)
+    exported = pl.read_csv(io.BytesIO(response.data))
+    assert exported["uid"].cast(pl.String).to_list() == ["1"]
+    assert exported.columns == query_marches().columns
+
+
+def test_parquet_export_matches_query(export, client):
+    from src.db import query_marches
+
+    response = _download(export, client, "SELECT * FROM decp", [], "parquet")
+    assert pl.read_parquet(io.BytesIO(response.data)).equals(query_marches())
+
+
+def test_excel_export_is_a_workbook(export, client):
+    response = _download(export, client, "SELECT uid, montant FROM decp", [], "xlsx")
+    assert response.status_code == 200
+    assert response.data[:2] == b"PK"
+
+
+def test_download_supports_range_requests(export, client):
+    full = _download(export, client, "SELECT * FROM decp", [], "csv").data
+    response = _download(
+        export, client, "SELECT * FROM decp", [], "csv", headers={"Range": "bytes=5-"}
+    )
+    assert response.status_code == 206
+    assert response.data == full[5:]
+
+
+def test_identical_exports_are_deduplicated(export, monkeypatch):
+    executor = RecordingExecutor()
+    monkeypatch.setattr(export, "_executor", executor)
+
+    first = export.submit_export("SELECT * FROM decp", [], "csv", "a")
+    second = export.submit_export("SELECT * FROM decp", [], "csv", "b")
+    other_format = export.submit_export("SELECT * FROM decp", [], "parquet", "a")
+
+    assert first == second != other_format
+    assert len(executor.submitted) == 2
+    assert export.get_job(first)["status"] == "pending"
+
+
+def test_queue_is_bounded(export, monkeypatch):
+    monkeypatch.setattr(export, "_executor", RecordingExecutor())
+    monkeypatch.setattr(export, "EXPORT_MAX_PENDING", 1)
+
+    export.submit_export("SELECT 1", [], "csv", "a")
+    with pytest.raises(export.ExportQueueFull):
+        export.submit_export("SELECT 2", [], "csv", "b")
+
+
+def test_failed_export_can_be_resubmitted(export, client):
+    sql = "SELECT colonne_inconnue FROM decp"
+    job = _wait(export, export.submit_export(sql, [], "csv", "a"))
+
+    assert job["status"] == "failed"
+    assert "colonne_inconnue" in job["error"]
+    assert not list(export.EXPORT_DIR.glob(f"{job['id']}*"))
+    assert client.get(export.download_url(job)).status_code == 404
+    assert export.submit_export(sql, [], "csv", "a") == job["id"]
+    assert _wait(export, job["id"])["status"] == "failed"
+
+
+def test_stale_and_expired_jobs(export, monkeypatch):
+    executor = RecordingExecutor()
+    monkeypatch.setattr(export, "_executor", executor)
+    stale = export.submit_export("SELECT 1", [], "csv", "a")
+    done = export.submit_export("SELECT 2", [], "csv", "b")
+    export._run_job(*executor.submitted[-1])
+    assert export.get_job(done)["status"] == "done"
+
+    later = time.time() + max(export.EXPORT_TTL, export.EXPORT_JOB_TIMEOUT) + 1
+    monkeypatch.setattr(
+        export,
+        "time",
+        SimpleNamespace(time=lambda: later, perf_counter=time.perf_counter),
+    )
+    assert export.get_job(stale)["status"] == "failed"
+    # La tâche abandonnée est relancée, l'export expiré est supprimé
+    assert export.submit_export("SELECT 1", [], "csv", "a") == stale
+    assert len(executor.submitted) == 3
+    assert export.get_job(done) is None
+    assert not (export.EXPORT_DIR / done).exists()
+
+
+def test_queued_job_runs_once(export, monkeypatch):
+    executor = RecordingExecutor()
+    monkeypatch.setattr(export, "_executor", executor)
+    writes = []
+    write_export = export.write_export
+
+    def counting_write(*args):
+        writes.append(args)
+        return write_export(*args)
+
+    monkeypatch.setattr(export, "write_export", counting_write)
+    job_id = export.submit_export("SELECT 1", [], "csv", "a")
+
+    # Toujours en attente d'un thread libre après EXPORT_JOB_TIMEOUT
+    start = time.time()
+    clock = SimpleNamespace(
+        time=lambda: start + export.EXPORT_JOB_TIMEOUT + 1,
+        perf_counter=time.perf_counter,
+    )
+    monkeypatch.setattr(export, "time", clock)
+    assert export.get_job(job_id)["status"] == "pending"
+
+    # Abandonnée après EXPORT_TTL puis redemandée : deux exécutions en file
+    clock.time = lambda: start + export.EXPORT_TTL + 1
+    assert export.get_job(job_id)["status"] == "failed"
+    assert export.submit_export("SELECT 1", [], "csv", "a") == job_id
+    for args in executor.submitted:
+        export._run_job(*args)
+
+    assert len(executor.submitted) == 2
+    assert len(writes) == 1
+    assert export.get_job(job_id)["status"] == "done"
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "/telechargements/inconnu/decp.csv",
+        "/telechargements/..%2F..%2Fetc%2Fpasswd/decp.csv",
+        f"/telechargements/{'0' * 32}/decp.csv",
+    ],
+)
+def test_unknown_exports_are_not_found(client, url):
+    assert client.get(url).status_code == 404
@@ -290,36 +290,3 @@ def test_011_observatoire_multi_param_url(dash_duo: DashComposite):
     assert montant_value in ("10000", "10000.0"), (
         f"montant_min input should be populated from URL param, got: {montant_value}"
     )
-
-
-def test_get_distance_histogram_returns_graph():
-    import polars as pl
-    from dash import dcc
-
-    from src.figures import get_distance_histogram
-
-    lff = pl.LazyFrame({"titulaire_distance": [1, 10, 100, 500, 1000]})
-    result = get_distance_histogram(lff)
-    assert isinstance(result, dcc.Graph)
-
-
-def test_get_distance_histogram_handles_nulls():
-    import polars as pl
-    from dash import dcc
-
-    from src.figures import get_distance_histogram
-
-    lff = pl.LazyFrame({"titulaire_distance": [None, None, 50]})
-    result = get_distance_histogram(lff)
-    assert isinstance(result, dcc.Graph)
-
-
-def test_get_distance_histogram_all_nulls():
-    import polars as pl
-    from dash import dcc
-
-    from src.figures import get_distance_histogram
-
-    lff = pl.LazyFrame({"titulaire_distance": pl.Series([], dtype=pl.Int64)})
-    result = get_distance_histogram(lff)
-    assert isinstance(result, dcc.Graph)
@@ -0,0 +1,177 @@
+import polars as pl
+import pytest
+
+
+def _titulaires(rows):
+    columns = [
+        "titulaire_id",
+        "titulaire_nom",
+        "titulaire_typeIdentifiant",
+        "titulaire_departement_code",
+        "titulaire_departement_nom",
+        "titulaire_commune_nom",
+        "Marchés",
+    ]
+    return pl.DataFrame(rows, schema=columns, orient="row")
+
+
+@pytest.fixture
+def index():
+    from src.utils.search import build_search_index
+
+    return build_search_index(
+        _titulaires(
+            [
+                ("111", "Société Générale", "SIRET", "75", "Paris", "Paris", 3),
+                (
+                    "222",
+                    "SOCIETE DU GRAND OUEST",
+                    "SIRET",
+                    "35",
+                    "Ille-et-Vilaine",
+                    "Rennes",
+                    8,
+                ),
+                (
+                    "222",
+                    "SOCIETE DU GRAND OUEST",
+                    "SIRET",
+                    "35",
+                    "Ille-et-Vilaine",
+                    "Saint-Malo",
+                    2,
+                ),
+                ("333", "ŒUVRES D'ART", "TVA", "35", "Ille-et-Vilaine", None, 5),
+            ]
+        ),
+        "titulaire",
+    )
+
+
+def _ids(index, query, limit=None):
+    from src.utils.search import query_tokens
+
+    results, count = index.search(query_tokens(query), limit)
+    return results["titulaire_id"].str.extract(r"(\d{3})").to_list(), count
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("societe", ["222", "111"]),
+        ("sociétés", []),
+        ("SOC gen", ["111"]),
+        ("ille 35", ["222", "333"]),
+        ("saint malo", ["222"]),
+        ("oeuvres art", ["333"]),
+        ("22", ["222"]),
+        ("", []),
+    ],
+)
+def test_all_tokens_must_prefix_a_word(index, query, expected):
+    assert _ids(index, query) == (expected, len(expected))
+
+
+def test_results_are_grouped_and_ranked_by_marches(index):
+    from src.utils.search import query_tokens
+
+    results, count = index.search(query_tokens("35"), None)
+    assert results["Marchés"].to_list() == [10, 5]
+    assert results["Département"].to_list() == ["Ille-et-Vilaine (35)"] * 2
+    # Seuls les SIRET ont une page titulaire
+    assert "/titulaires/222" in results["titulaire_nom"][0]
+    assert results["titulaire_nom"][1] == "ŒUVRES D'ART"
+
+
+def test_limit_keeps_the_total_count(index):
+    assert _ids(index, "ille", limit=1) == (["222"], 2)
+
+
+def test_search_org_uses_the_current_database():
+    from src.utils.search import search_org
+
+    results, count, approximate = search_org("paris achet", "acheteur")
+    assert (count, approximate) == (1, False)
+    assert results.columns == ["acheteur_id", "acheteur_nom", "Département", "Marchés"]
+    assert results["Département"].to_list() == ["Paris (75)"]
+    assert search_org("rennes", "titulaire")[1] == 1
+    assert search_org("marseille", "titulaire")[1] == 0
+    # Faute de frappe : résultat approché
+    assert search_org("titulare", "titulaire")[1:] == (1, True)
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("so", ["222", "111"]),
+        ("societe du g", ["222"]),
+        ("11", ["111"]),
+        ("ille", ["222", "333"]),
+        ("x", []),
+    ],
+)
+def test_suggestions_follow_search_order(index, query, expected):
+    from src.utils.search import query_tokens
+
+    suggested = index.suggest(query_tokens(query), 5)["titulaire_id"].to_list()
+    assert suggested == expected
+    assert suggested == _ids(index, query)[0]
+
+
+@pytest.mark.parametrize("threshold", [0, 1_000_000])
+def test_suggestions_are_capped(index, monkeypatch, threshold):
+    from src.utils import search
+
+    # 0 : parcours de toutes les lignes ; sinon, lignes du terme le plus rare
+    monkeypatch.setattr(search, "SUGGEST_SCAN_THRESHOLD", threshold)
+    tokens = search.query_tokens("35 ille")
+    assert index.suggest(tokens, 1)["titulaire_id"].to_list() == ["222"]
+    assert index.suggest(tokens, 5).height == 2
+
+
+def test_suggest_org_labels():
+    from src.utils.search import suggest_org
+
+    assert suggest_org("achet", "acheteur") == [
+        {"value": "123", "label": "ACHETEUR 1 – Paris (75)"}
+    ]
+    assert suggest_org(" ", "acheteur") == []
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("societte generale", ["111"]),
+        ("sosiete", ["222", "111"]),
+        ("grand ouets", []),
+        ("oeuvre dart", ["333"]),
+        ("generale paris", ["111"]),
+    ],
+)
+def test_fuzzy_search_tolerates_typos(index, query, expected):
+    from src.utils.search import query_tokens
+
+    results, count = index.fuzzy_search(query_tokens(query), None)
+    assert results["titulaire_id"].str.extract(r"(\d{3})").to_list() == expected
+    assert count == len(expected)
+
+
+def test_fuzzy_search_ranks_closest_first(index):
+    from src.utils.search import query_tokens
+
+    # GENERALE (exact) l'emporte sur GRAND (approché) malgré moins de marchés
+    results, _ = index.fuzzy_search(query_tokens("societe generalle"), None)
+    assert results["titulaire_id"].str.extract(r"(\d{3})").to_list()[0] == "111"
+    words, similarity = index.similar_words("METROPOLLE")
+    assert len(words) == 0
+
+
+def test_word_trigrams():
+    from src.utils.search import word_trigrams
+
+    alphabet = " 0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    word_ids, trigrams = word_trigrams(pl.Series(["LYON", "AA", "A"]))
+    decoded = ["".join(alphabet[t // 37**i % 37] for i in (2, 1, 0)) for t in trigrams]
+    by_word = [{d for w, d in zip(word_ids, decoded) if w == i} for i in range(3)]
+    assert by_word == [{" LY", "LYO", "YON", "ON "}, {" AA", "AA "}, {" A "}]
+    assert len(decoded) == 7
@@ -1,6 +1,10 @@
+from types import SimpleNamespace
+
 import polars as pl
 import pytest
 
+from tests.conftest import build_test_db
+
 
 @pytest.fixture
 def sample_lff():
@@ -286,3 +290,315 @@ def test_fetch_page_sql_post_processes_links(flask_app):
         )
     if page.height > 0:
         assert "<a href" in page["uid"][0]
+
+
+def test_page_start_prefers_nearest_known_boundary():
+    from src.utils.table import _page_start
+
+    assert _page_start({}, 0, 20) == (None, 0)
+    assert _page_start({}, 3, 20) == (None, 60)
+    boundaries = {0: ("k0",), 4: ("k4",)}
+    assert _page_start(boundaries, 1, 20) == (("k0",), 0)
+    assert _page_start(boundaries, 3, 20) == (("k0",), 40)
+    assert _page_start(boundaries, 5, 20) == (("k4",), 0)
+    assert _page_start(boundaries, 9, 20) == (("k4",), 80)
+
+
+def test_fetch_page_sql_records_page_boundaries(flask_app):
+    from src.build import DEFAULT_SORT_KEYS
+    from src.utils import table
+    from src.utils.cache import cache
+
+    with flask_app.app_context():
+        page, total, _ = table._fetch_page_sql(
+            filter_query=None, sort_by_key=(), page_current=0, page_size=1
+        )
+        key = table._page_boundary_key("TRUE", [], DEFAULT_SORT_KEYS, 1, 0)
+        boundary = cache.get(key)
+    assert total > 0
+    assert boundary is not None
+    assert table._known_boundaries("TRUE", [], DEFAULT_SORT_KEYS, 1, 0) == {}
+
+
+@pytest.fixture
+def pages_db(tmp_path, monkeypatch):
+    """Base de 37 lignes, servie à query_page à la place de la base de test."""
+    import datetime
+
+    import duckdb
+
+    import src.db
+    from src.utils import table
+
+    rows = [
+        {
+            "uid": str(i // 2),
+            "id": str(i // 2),
+            "objet": "Travaux",
+            "acheteur_id": "123",
+            "acheteur_nom": "ACHETEUR 1",
+            "acheteur_departement_code": "75",
+            "titulaire_id": f"T{i}",
+            "titulaire_nom": "TITULAIRE",
+            "titulaire_typeIdentifiant": "SIRET",
+            "titulaire_departement_code": "35",
+            "montant": [100.0, 200.0, None][i % 3],
+            "dateNotification": datetime.date(2025, 1, 1 + i % 28),
+            "sourceDataset": "test",
+            "sourceFile": "test.xml",
+            "donneesActuelles": True,
+        }
+        for i in range(37)
+    ]
+    db_path = build_test_db(tmp_path, rows)
+    with duckdb.connect(str(db_path), read_only=True) as con:
+        schema = con.execute("SELECT * FROM decp LIMIT 0").pl().schema
+        monkeypatch.setattr(src.db, "get_cursor", con.cursor)
+        monkeypatch.setattr(table, "schema", schema)
+        yield con
+
+
+@pytest.mark.parametrize("sort_by_key", [(), (("montant", "asc"),)])
+def test_deep_page_through_boundary_matches_offset(pages_db, flask_app, sort_by_key):
+    from src.build import DEFAULT_SORT_KEYS
+    from src.db import query_page
+    from src.utils import table
+    from src.utils.table_sql import sort_by_to_keys
+
+    sort_keys = (
+        sort_by_to_keys(
+            [{"column_id": c, "direction": d} for c, d in sort_by_key], table.schema
+        )
+        or DEFAULT_SORT_KEYS
+    )
+    with flask_app.app_context():
+        for page_current in range(3):
+            table._fetch_page_sql(None, sort_by_key, page_current, 5)
+        assert set(table._known_boundaries("TRUE", [], sort_keys, 5, 6)) == {0, 1, 2}
+        # Reprise après la borne de la page 2, puis OFFSET de trois pages
+        deep_page, total, _ = table._fetch_page_sql(None, sort_by_key, 6, 5)
+
+    by_offset, *_ = query_page("TRUE", [], sort_keys, 5, offset=30)
+    assert total == 37
+    assert deep_page.height == 5
+    assert deep_page.equals(table.postprocess_page(by_offset))
+
+
+def test_fetch_page_sql_passes_filtered_columns(monkeypatch, flask_app):
+    """Le nombre de marchés est compté dans la table marches si aucune colonne
+    des titulaires n'est filtrée (voir src.db.count_unique_marches)."""
+    from src.utils import table
+
+    calls = []
+    query_page = table.query_page
+
+    def recording_query_page(*args, **kwargs):
+        calls.append(kwargs["filtered_columns"])
+        return query_page(*args, **kwargs)
+
+    monkeypatch.setattr(table, "query_page", recording_query_page)
+    with flask_app.app_context():
+        table._fetch_page_sql("{objet} icontains travaux", (), 0, 5)
+        table._fetch_page_sql(None, (), 0, 5, '"acheteur_id" = ?', ("123",))
+
+    assert calls == [{"objet"}, None]
+
+
+def test_fetch_page_sql_reuses_cached_totals(monkeypatch, flask_app):
+    from src.utils import table
+
+    calls = []
+    query_page = table.query_page
+
+    def spy(*args, **kwargs):
+        calls.append(kwargs["totals"])
+        return query_page(*args, **kwargs)
+
+    monkeypatch.setattr(table, "query_page", spy)
+    with flask_app.app_context():
+        _, total, total_unique = table._fetch_page_sql(
+            filter_query=None, sort_by_key=(), page_current=0, page_size=1
+        )
+        _, *totals_page_1 = table._fetch_page_sql(
+            filter_query=None, sort_by_key=(), page_current=1, page_size=1
+        )
+        table._fetch_page_sql(
+            filter_query=None,
+            sort_by_key=(("montant", "asc"),),
+            page_current=0,
+            page_size=1,
+        )
+    assert calls == [None, (total, total_unique), (total, total_unique)]
+    assert totals_page_1 == [total, total_unique]
+
+
+@pytest.fixture
+def export_db(tmp_path, monkeypatch):
+    """Base de quelques dizaines de lignes, avec des ex aequo sur les tris."""
+    import datetime
+
+    import duckdb
+
+    import src.db
+    from src.utils import table
+
+    rows = [
+        {
+            "uid": str(i // 2),
+            "id": str(i // 2),
+            "objet": ["Travaux de voirie", None, "Études"][i % 3],
+            "acheteur_id": "123",
+            "acheteur_nom": "ACHETEUR 1",
+            "acheteur_departement_code": "75",
+            "titulaire_id": f"T{i}",
+            "titulaire_nom": f"TITULAIRE {i}",
+            "titulaire_typeIdentifiant": "SIRET",
+            "titulaire_departement_code": "35",
+            "montant": [None, 100.0, 200.0, 100.0][i % 4],
+            "dateNotification": [None, datetime.date(2025, 1, 1)][i % 5 > 0],
+            "donneesActuelles": True,
+        }
+        for i in range(23)
+    ]
+    db_path = build_test_db(tmp_path, rows)
+
+    with duckdb.connect(str(db_path), read_only=True) as con:
+        monkeypatch.setattr(src.db, "get_cursor", con.cursor)
+        monkeypatch.setattr(
+            table, "schema", con.execute("SELECT * FROM decp LIMIT 0").pl().schema
+        )
+        yield con
+
+
+@pytest.mark.parametrize(
+    "filter_query, sort_by",
+    [
+        (None, []),
+        ("{objet} icontains voirie", []),
+        (None, [{"column_id": "montant", "direction": "asc"}]),
+        (
+            "{montant} i< 150",
+            [
+                {"column_id": "objet", "direction": "desc"},
+                {"column_id": "dateNotification", "direction": "asc"},
+            ],
+        ),
+    ],
+)
+def test_export_matches_rows_on_screen(export_db, flask_app, filter_query, sort_by):
+    from src.utils import table
+
+    hidden_columns = ["acheteur_nom", "acheteur_departement_code"]
+    sql, params = table.table_export_sql(filter_query, sort_by, hidden_columns)
+    exported = export_db.execute(sql, params).pl()
+
+    pages = []
+    with flask_app.app_context():
+        for page_current in range(10):
+            page, total, _ = table._fetch_page_sql(
+                filter_query=filter_query,
+                sort_by_key=table.normalize_sort_by(sort_by),
+                page_current=page_current,
+                page_size=4,
+            )
+            pages.append(page)
+    screen = pl.concat(pages).drop(hidden_columns)
+
+    assert exported.height == total > 0
+    assert exported.columns == screen.columns
+    assert not set(hidden_columns) & set(exported.columns)
+    assert table.postprocess_page(exported).equals(screen)
+
+
+def test_org_table_is_paged_in_duckdb(flask_app):
+    """Le navigateur ne reçoit qu'une référence, le tableau de l'organisation
+    est filtré et paginé dans DuckDB comme la page Tableau."""
+    from src.utils import data, table
+
+    handle = data.org_data_handle("acheteur", "123", "Toutes les années")
+    assert handle == {"org_type": "acheteur", "org_id": "123", "year": None}
+    where_sql, params = data.org_marches_where(**handle)
+    markets = data.get_org_marches(**handle)
+    assert markets.height > 0
+
+    pages = []
+    with flask_app.app_context():
+        for page_current in range((markets.height + 2) // 3):
+            page, total, total_unique = table._fetch_page_sql(
+                None, (), page_current, 3, where_sql, tuple(params)
+            )
+            pages.append(page)
+
+        uid = markets["uid"][0]
+        _, filtered_total, _ = table._fetch_page_sql(
+            f"{{uid}} icontains {uid}", (), 0, 3, where_sql, tuple(params)
+        )
+
+    assert total == markets.height
+    assert total_unique == markets["uid"].n_unique()
+    assert pl.concat(pages).equals(table.postprocess_page(markets))
+    assert filtered_total == markets.filter(pl.col("uid").str.contains(uid)).height
+
+
+@pytest.mark.parametrize(
+    "org_type, org_id", [("acheteur", "123"), ("titulaire", "345")]
+)
+def test_org_page_table_callback(flask_app, org_type, org_id):
+    import importlib
+
+    import src.app  # noqa: F401 (enregistre les pages)
+    from src.utils import data
+
+    page = importlib.import_module(f"pages.{org_type}")
+    handle = data.org_data_handle(org_type, org_id, "Toutes les années")
+    with flask_app.app_context():
+        rows, *_, nb_rows, _, _, _, _ = page.get_last_marches_data(
+            f"/{org_type}s/{org_id}", handle, 0, 20, None, [], 0
+        )
+        stats = data.get_org_stats(**handle)
+
+    assert len(rows) == stats["nb_lignes"] > 0
+    assert nb_rows.startswith(f"{stats['nb_lignes']} lignes")
+
+
+def test_org_marches_where_titulaire_year():
+    from src.utils.data import org_data_handle, org_marches_where
+
+    where_sql, params = org_marches_where(**org_data_handle("titulaire", "345", "2025"))
+    assert "\"titulaire_typeIdentifiant\" = 'SIRET'" in where_sql
+    assert 'year("dateNotification") = ?' in where_sql
+    assert params == ["345", 2025]
+
+
+@pytest.mark.parametrize("precomputed", [True, False])
+def test_org_stats_match_markets(monkeypatch, flask_app, precomputed):
+    """Les statistiques pré-calculées (ou recalculées si la table manque)
+    correspondent aux marchés de l'organisation."""
+    import numpy as np
+
+    from src.utils import data
+
+    if not precomputed:
+        monkeypatch.setattr(
+            data, "get_generation", lambda: SimpleNamespace(tables={"decp"})
+        )
+    with flask_app.app_context():
+        stats = data.get_org_stats("acheteur", "123")
+        markets = data.get_org_marches("acheteur", "123")
+
+    distances = markets.filter(pl.col("titulaire_distance") > 0)["titulaire_distance"]
+    counts, _ = np.histogram(np.log10(distances.to_numpy()), bins=25)
+    assert stats["nb_lignes"] == markets.height
+    assert stats["nb_marches"] == markets["uid"].n_unique()
+    assert stats["nb_partenaires"] == markets["titulaire_id"].drop_nulls().n_unique()
+    assert stats["distance_bins"] == counts.tolist()
+    assert sum(p["Attributions"] for p in stats["top_partenaires"]) == markets.height
+
+
+def test_org_stats_for_unknown_org(flask_app):
+    from src.utils.data import get_org_stats
+
+    with flask_app.app_context():
+        stats = get_org_stats("titulaire", "inconnu", 2025)
+    assert stats["nb_lignes"] == 0
+    assert stats["top_partenaires"] == []
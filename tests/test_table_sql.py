@@ -138,3 +138,13 @@ def test_sort_by_ignores_unknown_column():
 
     result = sort_by_to_sql([{"column_id": "fake", "direction": "asc"}], SCHEMA)
     assert result == ""
+
+
+def test_filter_query_columns():
+    from src.utils.table_sql import filter_query_columns
+
+    assert filter_query_columns(
+        "{objet} icontains travaux && {montant} i> 10 && {inconnue} icontains x",
+        SCHEMA,
+    ) == {"objet", "montant"}
+    assert filter_query_columns("", SCHEMA) == set()
@@ -0,0 +1,139 @@
+import json
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+import pytest
+
+
+class FakeMatomo(BaseHTTPRequestHandler):
+    """Enregistre les lots reçus par /matomo.php (API de suivi groupé)."""
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(server.delay)
+        with server.lock:
+            server.batches.append(body)
+        self.send_response(server.status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+@pytest.fixture
+def matomo(http_stub):
+    server = http_stub(FakeMatomo, batches=[], delay=0, status=200)
+    server.endpoint = f"{server.url}/matomo.php"
+    return server
+
+
+def _dispatcher(matomo, **kwargs):
+    from src.utils.tracking import TrackingDispatcher
+
+    # Sans thread d'envoi : les événements partent aux appels à flush()
+    options = {"batch_size": 3} | kwargs
+    return TrackingDispatcher(matomo.endpoint, "secret", **options)
+
+
+def test_events_are_sent_in_batches(matomo):
+    dispatcher = _dispatcher(matomo)
+    for i in range(5):
+        dispatcher.enqueue({"idsite": "1", "search": f"recherche {i}"})
+    dispatcher.flush()
+
+    assert [len(b["requests"]) for b in matomo.batches] == [3, 2]
+    assert all(b["token_auth"] == "secret" for b in matomo.batches)
+    first = parse_qs(matomo.batches[0]["requests"][0].lstrip("?"))
+    assert first == {"idsite": ["1"], "search": ["recherche 0"]}
+    assert dispatcher.metrics == {
+        "queued": 5,
+        "sent": 5,
+        "dropped": 0,
+        "failed": 0,
+    }
+
+
+def test_background_thread_flushes(matomo):
+    dispatcher = _dispatcher(matomo, flush_interval=0.1).start()
+    dispatcher.enqueue({"search": "voirie"})
+
+    deadline = time.time() + 5
+    # Compté après la réponse de Matomo, donc après l'enregistrement du lot
+    while not dispatcher.metrics["sent"] and time.time() < deadline:
+        time.sleep(0.05)
+    assert matomo.batches[0]["requests"] == ["?search=voirie"]
+    assert dispatcher.metrics["sent"] == 1
+
+
+def test_full_queue_drops_events(matomo):
+    dispatcher = _dispatcher(matomo, maxsize=2)
+    results = [dispatcher.enqueue({"search": str(i)}) for i in range(4)]
+
+    assert results == [True, True, False, False]
+    assert dispatcher.metrics["dropped"] == 2
+    dispatcher.flush()
+    assert dispatcher.metrics["sent"] == 2
+
+
+def test_matomo_errors_are_counted_not_raised(matomo):
+    matomo.status = 500
+    dispatcher = _dispatcher(matomo)
+    dispatcher.enqueue({"search": "voirie"})
+    dispatcher.flush()
+    assert dispatcher.metrics["failed"] == 1
+
+
+def test_malformed_endpoint_is_counted_not_raised():
+    from src.utils.tracking import TrackingDispatcher
+
+    # httpx.InvalidURL n'est pas une HTTPError
+    dispatcher = TrackingDispatcher("https://matomo:abc/matomo.php", None)
+    dispatcher.enqueue({"search": "voirie"})
+    dispatcher.flush()
+    assert dispatcher.metrics["failed"] == 1
+
+
+def test_background_thread_survives_send_errors(matomo, monkeypatch):
+    dispatcher = _dispatcher(matomo, batch_size=1, flush_interval=0.05)
+    send = dispatcher._send
+    calls = []
+
+    def flaky_send(batch):
+        calls.append(batch)
+        if len(calls) == 1:
+            raise RuntimeError("erreur imprévue")
+        send(batch)
+
+    monkeypatch.setattr(dispatcher, "_send", flaky_send)
+    dispatcher.start()
+    dispatcher.enqueue({"search": "perdu"})
+    dispatcher.enqueue({"search": "voirie"})
+
+    deadline = time.time() + 5
+    while not matomo.batches and time.time() < deadline:
+        time.sleep(0.05)
+    assert matomo.batches[0]["requests"] == ["?search=voirie"]
+    assert dispatcher.metrics["failed"] == 1
+    assert dispatcher._thread.is_alive()
+
+
+def test_track_search_does_not_wait_for_matomo(matomo, monkeypatch):
+    from src.utils import tracking
+
+    matomo.delay = 1
+    dispatcher = _dispatcher(matomo)
+    monkeypatch.setattr(tracking, "DEVELOPMENT", False)
+    monkeypatch.setenv("MATOMO_DOMAIN", "matomo.example.com")
+    monkeypatch.setattr(tracking, "get_dispatcher", lambda: dispatcher)
+
+    start = time.perf_counter()
+    tracking.track_search("{objet} icontains voirie", "tableau")
+    tracking.track_search("abc", "tableau")  # trop court, ignoré
+    assert time.perf_counter() - start < 0.5
+    assert dispatcher.metrics["queued"] == 1
+
+    dispatcher.flush()
+    (request,) = matomo.batches[0]["requests"]
+    params = parse_qs(request.lstrip("?"))
+    assert params["search"] == ["{objet} icontains voirie"]
+    assert params["action_name"] == ["filter"]